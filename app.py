@@ -1,10 +1,19 @@
+from typing import List
+from core.jobs import JobManager
+from core.metrics import registry
 from core.main_noise_creator import noise_maker
-from fastapi import HTTPException
+from core.building_loader import clear_building_cache
+from core.facade_store import refresh_facade_segments
+from core.db_connect import mark_streets_dirty, count_queued_streets
+from fastapi import Body, HTTPException
+from fastapi.responses import PlainTextResponse
 from app_settings import create_app
+from config import max_concurrent_jobs, facade_segment_source
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+from starlette.status import HTTP_202_ACCEPTED, HTTP_404_NOT_FOUND
 
 app = create_app(create_custom_static_urls=True)
+jobs = JobManager(runner=noise_maker, max_jobs=max_concurrent_jobs)
 
 app.add_middleware(
     middleware_class=CORSMiddleware,
@@ -15,14 +24,83 @@ app.add_middleware(
 )
 
 
+@app.on_event('shutdown')
+def stop_jobs():
+    jobs.shutdown()
+
+
 @app.post(
     path='/noise',
-    name='make_noise'
+    name='make_noise',
+    status_code=HTTP_202_ACCEPTED
 )
 def make_noise(count_streets_update: int):
-    try:
-        noise_maker(count_streets_update=count_streets_update)
-        return {'response': 'данные обновлены'}
-    except Exception as e:
-        raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY,
-                            detail=str(e))
+    job = jobs.submit(count_streets=count_streets_update)
+    return {'response': 'задача поставлена в очередь', 'job_id': job.id}
+
+
+@app.get(
+    path='/noise',
+    name='list_noise_jobs'
+)
+def list_noise_jobs():
+    return [job.to_dict() for job in jobs.list()]
+
+
+@app.get(
+    path='/noise/{job_id}',
+    name='get_noise_job'
+)
+def get_noise_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND,
+                            detail='задача не найдена')
+    return job.to_dict()
+
+
+@app.delete(
+    path='/noise/{job_id}',
+    name='cancel_noise_job'
+)
+def cancel_noise_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND,
+                            detail='задача не найдена')
+    return job.to_dict()
+
+
+@app.post(
+    path='/streets/dirty',
+    name='mark_dirty_streets'
+)
+def mark_dirty_streets(building_ids: List[int] = Body(..., embed=True)):
+    """Возвращает в очередь улицы, на которые влияют изменённые здания"""
+    # Тайлы зданий этого процесса могли устареть
+    clear_building_cache()
+    if facade_segment_source == 'store':
+        # Сегменты изменённых зданий перестраиваются сразу, удалённых -
+        # после их удаления из таблицы при следующем обновлении
+        refresh_facade_segments(building_ids)
+    street_ids = mark_streets_dirty(building_ids)
+    return {'street_ids': street_ids, 'count': len(street_ids)}
+
+
+@app.get(
+    path='/streets/dirty',
+    name='count_dirty_streets'
+)
+def count_dirty_streets():
+    return {'count': count_queued_streets()}
+
+
+@app.get(
+    path='/metrics',
+    name='metrics',
+    response_class=PlainTextResponse
+)
+def metrics():
+    return PlainTextResponse(
+        registry.render(), media_type='text/plain; version=0.0.4'
+    )
@@ -4,8 +4,26 @@ stars_line_step = 3
 noise_segment_size = 3
 amount_of_reflections = 3
 base_crs = '3857'
+# 'geodesic' | 'batched' | 'mercator', см. core/length_model.py
+length_model = 'batched'
+# Углы лучей звезды: 'fixed' - через stars_line_step градусов, 'adaptive' -
+# через adaptive_coarse_step с дроблением до adaptive_min_step рядом со
+# зданиями, см. core/adaptive_stars.py
+star_mode = 'fixed'
+adaptive_coarse_step = 24
+adaptive_min_step = 3
+# Общие лучи соседних точек: у улиц с типом highway из словаря лучи идут из
+# каждой origin_stride[тип] точки, пропуски шума фасадов не длиннее
+# facade_gap_segments сегментов заполняются интерполяцией, см.
+# core/origin_sharing.py
+origin_stride = {}
+facade_gap_segments = 2
+# 'wavefront' - пакетная трассировка, 'legacy' - по одному лучу
+reflection_engine = 'wavefront'
 
 geometry_column = 'geometry'
+street_id_column = 'id'
+building_id_column = 'id'
 noise_level_column = 'level'
 building_level_column = 'floors'
 street_column_noise = 'noise_from_type'
@@ -18,3 +36,78 @@ street_table_name = 'highway'
 building_table_name = 'building'
 noise_lines_table_name = 'noise_lines'
 barrier_noise_table_name = 'barrier_noise'
+ray_origins_table_name = 'noise_ray_origins'
+rays_table_name = 'noise_rays'
+rays_view_name = 'noise_rays_lines'
+facade_segments_table_name = 'facade_segments'
+
+# Потоковый расчёт: сколько точек начала лучей обрабатывается за раз,
+# результаты каждого блока сохраняются до расчёта следующего; None - вся
+# пачка улиц целиком
+stream_block_origins = None
+
+# Что сохранять по лучам: 'lines' - линии в noise_lines, 'grid' - растр
+# шума в grid_dir (см. core/noise_grid.py), 'both' - и то и другое
+output_mode = 'lines'
+# Растр: размер ячейки в единицах base_crs, этажей в одной полосе, ячеек
+# в стороне тайла
+grid_dir = 'noise_grid'
+grid_cell_size = 5.0
+grid_floors_per_band = 3
+grid_tile_cells = 512
+# Формат лучей: 'linestring' - линии в noise_lines, 'compact' - источники и
+# параметры лучей в noise_ray_origins / noise_rays (геометрии собирает
+# представление noise_rays_lines), 'parquet' - то же в файлы в
+# compact_rays_dir, см. core/ray_store.py
+noise_lines_format = 'linestring'
+compact_rays_dir = 'noise_rays'
+
+# 'copy' - потоковая запись через COPY, 'to_postgis' - GeoDataFrame.to_postgis
+output_writer = 'copy'
+copy_batch_size = 100000
+# Писать сначала в нежурналируемую промежуточную таблицу
+copy_via_staging = False
+
+street_highway_types = (
+    'living_street', 'trunk', 'trunk_link', 'primary', 'primary_link',
+    'secondary', 'secondary_link', 'tertiary', 'tertiary_link',
+    'unclassified', 'residential'
+)
+# Очередь улиц: сколько улиц забирает обработчик за раз и на сколько секунд
+street_batch_size = 1
+street_lease_seconds = 3600
+# Сколько фоновых задач POST /noise выполняются одновременно
+max_concurrent_jobs = 2
+# Завершённые задачи забываются через job_ttl_seconds секунд, и их
+# хранится не больше max_finished_jobs
+job_ttl_seconds = 24 * 3600
+max_finished_jobs = 100
+
+# Здания читаются из базы тайлами со стороной building_tile_size метров,
+# в памяти процесса хранится не больше building_cache_tiles тайлов
+building_tile_size = 1000
+building_cache_tiles = 256
+# Сегменты фасадов: 'compute' - строятся из зданий при каждом расчёте,
+# 'store' - читаются теми же тайлами из facade_segments_table_name, которую
+# обновляет python -m core.facade_store, см. core/facade_store.py
+facade_segment_source = 'compute'
+facade_refresh_batch = 10000
+
+# Сторона тайла города для python -m core.city_tiles, в единицах base_crs
+city_tile_size = 2000
+
+# Исполнитель, общий для всех стадий: 'serial' | 'thread' | 'process'.
+# Пул создаётся один раз на процесс; executor_workers = None - по числу ядер,
+# executor_chunk_size - сколько задач пул процессов передаёт обработчику за раз
+executor_backend = 'process'
+executor_workers = None
+executor_chunk_size = 1
+
+# Кэш результатов улиц (core/result_cache.py): каталог, None - не
+# использовать, и предельный размер, после которого вытесняются давно
+# прочитанные записи
+result_cache_dir = None
+result_cache_max_bytes = 20 * 2 ** 30
+
+# Каталог для JSON с метриками каждой пачки улиц; None - не записывать
+metrics_json_dir = None
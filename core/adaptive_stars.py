@@ -0,0 +1,153 @@
+import shapely
+import numpy as np
+import geopandas as gpd
+from typing import Tuple
+
+from core.stars_maker import star_angles
+from core.ray_culling import entry_distances, ground_rays
+from config import (
+    star_mode,
+    stars_line_step,
+    adaptive_min_step,
+    adaptive_coarse_step
+)
+
+# Ключ веера: точка * ANGLE_KEY + угол, углы лучей меньше 380
+ANGLE_KEY = 1000
+
+
+def origin_fans(
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        buildings: gpd.GeoDataFrame,
+        mode: str = star_mode
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Fans (origin index, angle) of the stars, sorted by origin and angle.
+
+    'fixed' gives every origin all star_angles(stars_line_step);
+    'adaptive' refines a coarse fan near buildings, see adaptive_fans.
+    """
+    if mode == 'fixed':
+        angles = star_angles(stars_line_step)
+        return (np.repeat(np.arange(len(distance_normal)), len(angles)),
+                np.tile(angles, len(distance_normal)))
+    if mode == 'adaptive':
+        return adaptive_fans(origins, distance_normal, buildings)
+    raise ValueError(f'Неизвестный режим лучей {mode}')
+
+
+def adaptive_fans(
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        buildings: gpd.GeoDataFrame,
+        coarse_step: int = adaptive_coarse_step,
+        min_step: int = adaptive_min_step
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Angles of every origin refined where the coarse fan sees buildings.
+
+    Rays are cast every coarse_step degrees; the angular interval between
+    two neighbouring rays is halved while its width is above min_step and
+    the two ground rays hit different buildings, either of them hits a
+    building, or - when both miss - the sector between them still touches
+    a building. Open space keeps the coarse step, facades get min_step.
+    All angles lie on the grid of star_angles(min_step).
+    """
+    ratio = coarse_step // min_step
+    if (coarse_step % min_step or ratio & (ratio - 1) or
+            360 % coarse_step or coarse_step >= 180):
+        raise ValueError(
+            'adaptive_coarse_step должен быть меньше 180, делить 360 и '
+            'быть равен adaptive_min_step, умноженному на степень двойки'
+        )
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    distance_normal = np.asarray(distance_normal, dtype=float)
+    polygons = np.asarray(buildings.geometry.values)
+    tree = shapely.STRtree(polygons)
+
+    def first_hits(fan_origin, fan_angle):
+        rays = ground_rays(origins, distance_normal, fan_origin, fan_angle)
+        ray, building = tree.query(rays, predicate='intersects')
+        entry = entry_distances(rays[ray], polygons[building])
+        order = np.lexsort((entry, ray))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ray[order][1:] != ray[order][:-1]
+        hits = np.full(len(rays), -1)
+        hits[ray[order][first]] = building[order][first]
+        return hits
+
+    # Интервалы: точка, начальный угол и ширина; концы уже посчитаны
+    angles = star_angles(coarse_step)
+    interval_origin = np.repeat(np.arange(len(origins)), len(angles))
+    interval_angle = np.tile(angles, len(origins))
+    known_keys = interval_origin * ANGLE_KEY + interval_angle
+    known_hits = first_hits(interval_origin, interval_angle)
+    width = coarse_step
+    while width > min_step and len(interval_origin):
+        order = np.argsort(known_keys)
+        known_keys, known_hits = known_keys[order], known_hits[order]
+        end_angle = 20 + (interval_angle + width - 20) % 360
+        low = known_hits[np.searchsorted(
+            known_keys, interval_origin * ANGLE_KEY + interval_angle
+        )]
+        high = known_hits[np.searchsorted(
+            known_keys, interval_origin * ANGLE_KEY + end_angle
+        )]
+        refine = (low != high) | (low >= 0) | (high >= 0)
+        empty = ~refine
+        refine[empty] = _sectors_touch(
+            tree, origins, distance_normal, interval_origin[empty],
+            interval_angle[empty], width
+        )
+        interval_origin = interval_origin[refine]
+        interval_angle = interval_angle[refine]
+        width //= 2
+        middle = interval_angle + width
+        known_keys = np.concatenate(
+            [known_keys, interval_origin * ANGLE_KEY + middle]
+        )
+        known_hits = np.concatenate(
+            [known_hits, first_hits(interval_origin, middle)]
+        )
+        interval_origin = np.concatenate([interval_origin, interval_origin])
+        interval_angle = np.concatenate([interval_angle, middle])
+
+    known_keys = np.sort(known_keys)
+    return known_keys // ANGLE_KEY, known_keys % ANGLE_KEY
+
+
+def facade_keys(segments: gpd.GeoDataFrame) -> np.ndarray:
+    """Distinct facade segments, whatever their floor rows"""
+    return np.unique(shapely.to_wkb(np.asarray(segments.geometry.values)))
+
+
+def _sectors_touch(
+        tree: shapely.STRtree,
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        fan_origin: np.ndarray,
+        fan_angle: np.ndarray,
+        width: int
+) -> np.ndarray:
+    """Whether the sector of each interval touches any building.
+
+    The sector of radius d is covered by the polygon of the origin, both
+    ray ends and the point where the tangents at the ends meet.
+    """
+    if not len(fan_origin):
+        return np.zeros(0, dtype=bool)
+    center = origins[fan_origin]
+    distance = distance_normal[fan_origin]
+    angles = np.radians(np.stack([
+        fan_angle, fan_angle + width / 2, fan_angle + width
+    ], axis=1))
+    radius = np.stack([
+        distance, distance / np.cos(np.radians(width / 2)), distance
+    ], axis=1)
+    coords = np.empty((len(fan_origin), 5, 2))
+    coords[:, 0] = coords[:, 4] = center
+    coords[:, 1:4, 0] = center[:, None, 0] + radius * np.cos(angles)
+    coords[:, 1:4, 1] = center[:, None, 1] + radius * np.sin(angles)
+    sectors = shapely.polygons(coords)
+    touched = np.zeros(len(fan_origin), dtype=bool)
+    touched[tree.query(sectors, predicate='intersects')[0]] = True
+    return touched
@@ -0,0 +1,142 @@
+import shapely
+import numpy as np
+from contextlib import contextmanager
+from geopandas import GeoDataFrame
+from typing import Dict, Tuple, List, Iterator, Optional
+from multiprocessing import shared_memory
+
+from core.executor import attach_block
+from config import building_level_column
+
+# Описание блока общей памяти: имя, форма и тип массива
+SharedArraySpec = Tuple[str, Tuple[int, ...], str]
+
+
+class BarrierIndex:
+    """Spatial index of facade segments, built once per run.
+
+    Every segment is stored once with the floor count of its building and
+    stands for all of its floors at the same time (see covers_floor). One
+    STRtree is kept together with compact arrays of segment coordinates
+    and floors, so that rays never have to filter the barriers frame or
+    build an R-tree themselves.
+    """
+
+    def __init__(self, coords: np.ndarray, floors: np.ndarray):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2, 2)
+        self.floors = np.asarray(floors, dtype=float)
+        self.tree: Optional[shapely.STRtree] = None
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self._build_tree()
+
+    @classmethod
+    def from_barriers(cls, barriers: GeoDataFrame) -> 'BarrierIndex':
+        """Index the two-point segments of a barriers frame"""
+        return cls(*barrier_arrays(barriers))
+
+    @classmethod
+    def attach(cls, spec: Dict[str, SharedArraySpec]) -> 'BarrierIndex':
+        """Index arrays exported by share_barrier_arrays without copying"""
+        blocks = {key: attach_block(name) for key, (name, _, _) in
+                  spec.items()}
+        arrays = {
+            key: np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)
+            for key, (_, shape, dtype) in spec.items()
+        }
+        index = cls(coords=arrays['coords'], floors=arrays['floors'])
+        # Блоки должны жить столько же, сколько ссылающиеся на них массивы
+        index._blocks = list(blocks.values())
+        return index
+
+    def __len__(self) -> int:
+        return len(self.floors)
+
+    def __getstate__(self):
+        # Деревья не передаются между процессами, они строятся заново
+        return {'coords': self.coords, 'floors': self.floors}
+
+    def __setstate__(self, state):
+        self.coords = state['coords']
+        self.floors = state['floors']
+        self.tree = None
+        self._blocks = []
+        self._build_tree()
+
+    def _build_tree(self):
+        self.tree = shapely.STRtree(shapely.linestrings(self.coords))
+
+    def query(
+            self,
+            geoms: np.ndarray,
+            floors: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Bulk lookup of segments whose envelope meets each geometry.
+
+        Every geometry is matched only against the segments whose building
+        has its floor. Returns pairs of input positions and segment
+        positions.
+        """
+        floors = np.asarray(floors, dtype=float)
+        input_idx, segment_idx = self.tree.query(geoms)
+        covered = covers_floor(self.floors[segment_idx], floors[input_idx])
+        return input_idx[covered], segment_idx[covered]
+
+
+def covers_floor(
+        barrier_floors: np.ndarray,
+        floors: np.ndarray
+) -> np.ndarray:
+    """Whether a facade of barrier_floors floors has the given floors.
+
+    Matches what segmentation_of_barrier_by_floors materializes: a copy of
+    the segment for every floor from 1 to the floor count plus the
+    original segment at the floor count itself.
+    """
+    return (floors == barrier_floors) | (
+        (floors >= 1) & (floors <= barrier_floors)
+    )
+
+
+def barrier_arrays(barriers: GeoDataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Segment coordinates (n, 2, 2) and floors of a barriers frame.
+
+    A segment with unknown floor count has one floor, as in
+    segmentation_of_barrier_by_floors.
+    """
+    geoms = barriers.geometry.values
+    if np.any(shapely.get_num_coordinates(geoms) != 2):
+        raise ValueError('Expected two-point LineString geometries')
+    floors = barriers[building_level_column].to_numpy(dtype=float)
+    return (
+        shapely.get_coordinates(geoms).reshape(-1, 2, 2),
+        np.where(np.isnan(floors), 1.0, floors)
+    )
+
+
+@contextmanager
+def share_barrier_arrays(
+        barriers: GeoDataFrame
+) -> Iterator[Dict[str, SharedArraySpec]]:
+    """Export barrier coordinates and floors into shared memory once.
+
+    Yields a small picklable spec for BarrierIndex.attach; the blocks are
+    released when the context exits.
+    """
+    coords, floors = barrier_arrays(barriers)
+    blocks = []
+    spec = {}
+    try:
+        for key, array in (('coords', coords), ('floors', floors)):
+            block = shared_memory.SharedMemory(
+                create=True, size=max(array.nbytes, 1)
+            )
+            blocks.append(block)
+            view = np.ndarray(array.shape, dtype=array.dtype,
+                              buffer=block.buf)
+            view[...] = array
+            spec[key] = (block.name, array.shape, array.dtype.str)
+        yield spec
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,138 @@
+import math
+import threading
+import shapely
+import pandas as pd
+import geopandas as gpd
+from collections import OrderedDict
+from typing import Callable, Tuple, List
+
+from core.db_connect import engine
+from config import (
+    schema,
+    base_crs,
+    noise_limit,
+    geometry_column,
+    building_tile_size,
+    building_id_column,
+    building_table_name,
+    street_column_noise,
+    building_cache_tiles,
+    building_level_column
+)
+
+TileKey = Tuple[int, int]
+
+
+class TileCache:
+    """Tiles read before; the least recently used ones are evicted.
+
+    Jobs running in threads share one cache, so lookups, inserts and
+    eviction hold a lock.
+    """
+
+    def __init__(self, max_tiles: int):
+        self.max_tiles = max_tiles
+        self._tiles: 'OrderedDict[TileKey, gpd.GeoDataFrame]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def get(
+            self,
+            tile: TileKey,
+            read: Callable[[TileKey], gpd.GeoDataFrame]
+    ) -> gpd.GeoDataFrame:
+        """The cached tile, or the tile given by read(tile) and cached"""
+        with self._lock:
+            if tile in self._tiles:
+                self._tiles.move_to_end(tile)
+                return self._tiles[tile]
+        # Тайл читается без блокировки: задачи в других потоках не ждут базу
+        frame = read(tile)
+        with self._lock:
+            self._tiles[tile] = frame
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return frame
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+
+# Здания, уже прочитанные из базы, по тайлам building_tile_size x
+# building_tile_size
+_tile_cache = TileCache(building_cache_tiles)
+
+
+def max_noise_distance(streets: gpd.GeoDataFrame) -> float:
+    """Largest noise propagation distance of the given streets"""
+    noise = streets[street_column_noise].astype(int).max()
+    return 10 ** ((noise - noise_limit) / 10)
+
+
+def load_buildings_near(streets: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Buildings within the maximum noise distance of the streets.
+
+    Only the columns used by the pipeline are read, and only for the
+    tiles covering the streets' buffer; tiles read before are taken from
+    the in-process cache.
+    """
+    distance = max_noise_distance(streets)
+    min_x, min_y, max_x, max_y = streets.total_bounds
+    tiles = tiles_for_bounds(
+        (min_x - distance, min_y - distance,
+         max_x + distance, max_y + distance)
+    )
+    buildings = pd.concat(
+        [_get_tile(tile) for tile in tiles], ignore_index=True
+    ).drop_duplicates(subset=building_id_column, ignore_index=True)
+    buildings = gpd.GeoDataFrame(
+        buildings, geometry=geometry_column, crs=f'EPSG:{base_crs}'
+    )
+
+    near = shapely.dwithin(
+        buildings.geometry.values,
+        shapely.union_all(streets.geometry.values),
+        distance
+    )
+    return buildings[near].reset_index(drop=True)
+
+
+def tiles_for_bounds(
+        bounds: Tuple[float, float, float, float]
+) -> List[TileKey]:
+    """Keys of the building tiles intersecting a bounding box"""
+    min_x, min_y, max_x, max_y = bounds
+    return [
+        (i, j)
+        for i in range(math.floor(min_x / building_tile_size),
+                       math.floor(max_x / building_tile_size) + 1)
+        for j in range(math.floor(min_y / building_tile_size),
+                       math.floor(max_y / building_tile_size) + 1)
+    ]
+
+
+def clear_building_cache():
+    _tile_cache.clear()
+
+
+def _get_tile(tile: TileKey) -> gpd.GeoDataFrame:
+    return _tile_cache.get(tile, read_buildings_tile)
+
+
+def read_buildings_tile(tile: TileKey) -> gpd.GeoDataFrame:
+    """Read the buildings whose bounding box touches one tile"""
+    i, j = tile
+    return gpd.read_postgis(
+        con=engine,
+        crs=base_crs,
+        geom_col=geometry_column,
+        sql=f'''SELECT "{building_id_column}", "{building_level_column}",
+        "{geometry_column}" FROM {schema}.{building_table_name}
+        WHERE "{geometry_column}" && ST_MakeEnvelope(
+            {i * building_tile_size}, {j * building_tile_size},
+            {(i + 1) * building_tile_size}, {(j + 1) * building_tile_size},
+            {base_crs})'''
+    )
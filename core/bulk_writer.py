@@ -0,0 +1,283 @@
+import io
+import uuid
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from typing import Iterator, List, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from core.ray_store import CompactRays
+from core.db_connect import (
+    engine,
+    reserve_ray_origin_ids,
+    BARRIER_SOURCES_TABLE
+)
+from config import (
+    schema,
+    base_crs,
+    geometry_column,
+    copy_batch_size,
+    copy_via_staging,
+    rays_table_name,
+    ray_origins_table_name,
+    building_level_column,
+    barrier_noise_table_name,
+    facade_segments_table_name,
+    barrier_noise_level_column
+)
+
+
+def copy_to_postgis(
+        gdf: gpd.GeoDataFrame,
+        name: str,
+        con: Connection = None,
+        batch_size: int = copy_batch_size,
+        staging: bool = copy_via_staging
+):
+    """Append a frame to a PostGIS table through COPY ... FROM STDIN.
+
+    Writes the same columns as GeoDataFrame.to_postgis(index=True) and
+    creates the table with GEOMETRY(LINESTRING, base_crs) if it is
+    missing. Rows are streamed as CSV with hex EWKB geometries in batches
+    of batch_size. With staging=True they first go into an unlogged table
+    which is then appended to the target in a single INSERT.
+    """
+    if con is None:
+        with engine.begin() as connection:
+            return copy_to_postgis(gdf, name, connection, batch_size,
+                                   staging)
+
+    frame = gdf.reset_index()
+    columns = list(frame.columns)
+    _create_table(con, name, frame)
+
+    target = f'{schema}."{name}"'
+    table = target
+    if staging:
+        table = f'{schema}."{name}_staging_{uuid.uuid4().hex[:8]}"'
+        con.execute(text(
+            f'CREATE UNLOGGED TABLE {table} (LIKE {target})'
+        ))
+
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    _copy_frame(con, table, frame, batch_size)
+
+    if staging:
+        con.execute(text(
+            f'INSERT INTO {target} ({column_list}) '
+            f'SELECT {column_list} FROM {table}'
+        ))
+        con.execute(text(f'DROP TABLE {table}'))
+
+
+def replace_street_barrier_noise(
+        gdf: gpd.GeoDataFrame,
+        street_ids: List[int],
+        con: Connection,
+        batch_size: int = copy_batch_size
+):
+    """Replace the facade noise of recomputed streets.
+
+    gdf holds the facade noise of the streets street_ids with a street_id
+    column; streets without rows in it had no facade noise this time. The
+    previous rows of these streets in barrier_noise_sources are replaced,
+    and every segment and floor they had before or have now is set in
+    barrier_noise to the maximum over all streets - lowered as well as
+    raised, or deleted when no street reaches it any more. Rows written
+    before the sources table existed stay in it under LEGACY_STREET_ID
+    and keep counting in the maximum. An advisory lock serializes the
+    recomputation, so concurrent workers see each other's streets.
+    """
+    if not street_ids:
+        return
+    target = f'{schema}.{barrier_noise_table_name}'
+    suffix = uuid.uuid4().hex[:8]
+    incoming = f'{barrier_noise_table_name}_sources_incoming_{suffix}'
+    affected = f'{barrier_noise_table_name}_affected_{suffix}'
+    ids = {'street_ids': [int(i) for i in street_ids]}
+    frame = pd.DataFrame(gdf).reindex(columns=[
+        'street_id', building_level_column, barrier_noise_level_column
+    ]).astype({'street_id': np.int64, building_level_column: float,
+               barrier_noise_level_column: float})
+    frame[geometry_column] = gdf.geometry.values
+    columns = ', '.join(f'"{column}"' for column in frame.columns)
+    level = f'"{building_level_column}"'
+    noise = f'"{barrier_noise_level_column}"'
+
+    con.execute(text(
+        f'CREATE TEMP TABLE {incoming} ({_column_definitions(frame)}) '
+        f'ON COMMIT DROP'
+    ))
+    _copy_frame(con, incoming, frame, batch_size)
+    con.execute(text('SELECT pg_advisory_xact_lock(hashtext(:table))'),
+                {'table': target})
+    con.execute(text(f"""
+        CREATE TEMP TABLE {affected} ON COMMIT DROP AS
+        SELECT segment_key, {level} FROM {BARRIER_SOURCES_TABLE}
+        WHERE street_id = ANY(:street_ids)
+        UNION
+        SELECT md5(ST_AsEWKB({geometry_column})), {level} FROM {incoming}
+    """), ids)
+    con.execute(text(f"""
+        DELETE FROM {BARRIER_SOURCES_TABLE}
+        WHERE street_id = ANY(:street_ids)
+    """), ids)
+    con.execute(text(f"""
+        INSERT INTO {BARRIER_SOURCES_TABLE} ({columns})
+        SELECT {columns} FROM {incoming}
+    """))
+    con.execute(text(f"""
+        DELETE FROM {target} t
+        USING {affected} a
+        WHERE t.segment_key = a.segment_key AND t.{level} = a.{level}
+            AND NOT EXISTS (
+                SELECT 1 FROM {BARRIER_SOURCES_TABLE} s
+                WHERE s.segment_key = a.segment_key AND s.{level} = a.{level}
+            )
+    """))
+    con.execute(text(f"""
+        INSERT INTO {target} ({geometry_column}, {level}, {noise})
+        SELECT DISTINCT ON (s.segment_key, s.{level})
+            s.{geometry_column}, s.{level}, s.{noise}
+        FROM {BARRIER_SOURCES_TABLE} s
+        JOIN {affected} a
+            ON s.segment_key = a.segment_key AND s.{level} = a.{level}
+        ORDER BY s.segment_key, s.{level}, s.{noise} DESC
+        ON CONFLICT (segment_key, {level}) DO UPDATE
+        SET {noise} = EXCLUDED.{noise}
+    """))
+
+
+def copy_compact_rays(
+        rays: CompactRays,
+        con: Connection,
+        batch_size: int = copy_batch_size,
+        street_id: Optional[int] = None
+):
+    """Append compact rays to noise_ray_origins and noise_rays via COPY.
+
+    Origin ids are taken from the origins sequence up front, so the rays
+    can be written with their origin_id in the same pass. street_id is
+    stored with the origins, see delete_street_compact_rays. The tables
+    are prepared by ensure_compact_ray_tables.
+    """
+    if not len(rays):
+        return
+    origin_ids = np.asarray(
+        reserve_ray_origin_ids(con, len(rays.origin_x)), dtype=np.int64
+    )
+    origins = pd.DataFrame({
+        'id': origin_ids,
+        'street_id': pd.array([street_id] * len(origin_ids),
+                              dtype='Int64'),
+        'start_noise': rays.origin_noise,
+        geometry_column: shapely.points(rays.origin_x, rays.origin_y)
+    })
+    split = rays.vertex_offsets[1:-1]
+    frame = pd.DataFrame({
+        'origin_id': origin_ids[rays.ray_origin],
+        'angle': rays.angle,
+        'floor': rays.floor,
+        'length': rays.length,
+        'bounce_dx': [_array_literal(values)
+                      for values in np.split(rays.vertex_dx, split)],
+        'bounce_dy': [_array_literal(values)
+                      for values in np.split(rays.vertex_dy, split)]
+    })
+    _copy_frame(con, f'{schema}.{ray_origins_table_name}', origins,
+                batch_size)
+    _copy_frame(con, f'{schema}.{rays_table_name}', frame, batch_size)
+
+
+def copy_facade_segments(
+        segments: gpd.GeoDataFrame,
+        con: Connection,
+        batch_size: int = copy_batch_size
+):
+    """Append facade segments to the segment store via COPY.
+
+    segments has building_id, floors and geometry columns; ids are given
+    by the table. The table is prepared by ensure_facade_segment_tables.
+    """
+    if segments.empty:
+        return
+    frame = pd.DataFrame({
+        'building_id': segments['building_id'].to_numpy(),
+        building_level_column: segments[building_level_column].to_numpy(),
+        geometry_column: segments.geometry.values
+    })
+    _copy_frame(con, f'{schema}.{facade_segments_table_name}', frame,
+                batch_size)
+
+
+def csv_batches(
+        frame: pd.DataFrame,
+        batch_size: int
+) -> Iterator[io.StringIO]:
+    """CSV buffers of at most batch_size rows, geometries as hex EWKB"""
+    for start in range(0, len(frame), batch_size):
+        batch = pd.DataFrame(frame.iloc[start:start + batch_size])
+        if geometry_column in batch.columns:
+            geoms = shapely.set_srid(
+                np.asarray(batch[geometry_column].values), int(base_crs)
+            )
+            batch[geometry_column] = shapely.to_wkb(
+                geoms, hex=True, include_srid=True
+            )
+        buffer = io.StringIO()
+        batch.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        yield buffer
+
+
+def _copy_frame(
+        con: Connection,
+        table: str,
+        frame: pd.DataFrame,
+        batch_size: int
+):
+    column_list = ', '.join(f'"{column}"' for column in frame.columns)
+    cursor = con.connection.cursor()
+    try:
+        for buffer in csv_batches(frame, batch_size):
+            cursor.copy_expert(
+                f'COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+    finally:
+        cursor.close()
+
+
+def _array_literal(values: np.ndarray):
+    # Пустой массив - луч без отражений, в базе NULL
+    if not len(values):
+        return None
+    return '{' + ','.join(values.astype(str)) + '}'
+
+
+def _create_table(con: Connection, name: str, frame: pd.DataFrame):
+    con.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {schema}."{name}" '
+        f'({_column_definitions(frame)})'
+    ))
+
+
+def _column_definitions(frame: pd.DataFrame) -> str:
+    return ', '.join(
+        f'"{column}" {_column_type(frame[column], column)}'
+        for column in frame.columns
+    )
+
+
+def _column_type(series: pd.Series, column: str) -> str:
+    if column == geometry_column:
+        return f'GEOMETRY(LINESTRING, {base_crs})'
+    if pd.api.types.is_bool_dtype(series):
+        return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(series):
+        return 'BIGINT'
+    if pd.api.types.is_float_dtype(series):
+        return 'DOUBLE PRECISION'
+    return 'TEXT'
@@ -0,0 +1,179 @@
+"""Обработка города тайлами.
+
+Город делится на квадратные тайлы со стороной city_tile_size; улица
+относится к тайлу, в котором лежит её ST_PointOnSurface. Тайл - отдельная
+единица работы: его улицы считаются на зданиях тайла с полем (halo),
+равным наибольшей дальности шума 10 ** ((шум - noise_limit) / 10) улиц
+тайла, и сохраняются одной транзакцией. Шум фасадов хранится по улицам
+и в barrier_noise сводится максимумом по сегменту и этажу
+(replace_street_barrier_noise), поэтому результат не зависит от порядка
+и распределения тайлов. Диапазоны тайлов можно раздать разным
+процессам или машинам с общей базой или файловым хранилищем.
+
+Режим не пользуется арендой улиц из очереди noise_maker: одновременно
+их запускать не нужно.
+
+Запуск из корня репозитория:
+    python -m core.city_tiles --list
+    python -m core.city_tiles --start 0 --stop 100
+"""
+import sys
+import argparse
+import geopandas as gpd
+from typing import List, Optional, Tuple
+
+from core.metrics import span, street_metrics, STREETS_PROCESSED
+from core.noise_grid import (
+    grid_key,
+    max_per_cell,
+    merge_into_grid,
+    rasterize_noise_lines
+)
+from core.bulk_writer import replace_street_barrier_noise
+from core.building_loader import load_buildings_near, max_noise_distance
+from core.main_noise_creator import (
+    street_blocks,
+    save_noise_lines,
+    delete_noise_lines,
+    street_barrier_noise
+)
+from core.db_connect import (
+    engine,
+    list_city_tiles,
+    ensure_barrier_noise_key,
+    ensure_compact_ray_tables,
+    mark_streets_finished,
+    ensure_noise_lines_street_id
+)
+from config import (
+    schema,
+    base_crs,
+    output_mode,
+    city_tile_size,
+    geometry_column,
+    street_id_column,
+    street_table_name,
+    noise_lines_format,
+    street_highway_types
+)
+
+TileKey = Tuple[int, int]
+
+
+def read_tile_streets(
+        tile: TileKey,
+        tile_size: float = city_tile_size
+) -> gpd.GeoDataFrame:
+    """Unfinished queue streets whose point on surface lies in the tile"""
+    i, j = tile
+    highway_types = ', '.join(f"'{value}'" for value in street_highway_types)
+    return gpd.read_postgis(
+        con=engine,
+        crs=base_crs,
+        geom_col=geometry_column,
+        sql=f'''SELECT * FROM {schema}.{street_table_name}
+        WHERE "highway" IN ({highway_types}) AND finished IS NOT TRUE
+            AND floor(ST_X(ST_PointOnSurface({geometry_column}))
+                      / {tile_size}) = {int(i)}
+            AND floor(ST_Y(ST_PointOnSurface({geometry_column}))
+                      / {tile_size}) = {int(j)}
+        ORDER BY {street_id_column}'''
+    )
+
+
+def process_tile(tile: TileKey, tile_size: float = city_tile_size) -> int:
+    """Compute and save all unfinished streets of one tile.
+
+    The buildings are read once for the tile with its halo; the streets
+    go through street_blocks one by one, and their previous rays, facade
+    noise and grid contributions are replaced. Returns the number of
+    streets processed.
+    """
+    with span('read_streets'):
+        streets = read_tile_streets(tile, tile_size)
+    if streets.empty:
+        return 0
+    street_ids = streets[street_id_column].tolist()
+    print(f'тайл {tile}: {len(street_ids)} улиц, '
+          f'поле {max_noise_distance(streets):.0f} м')
+    with street_metrics(street_ids):
+        with span('load_buildings'):
+            buildings = load_buildings_near(streets)
+
+        street_barriers = {street_id: [] for street_id in street_ids}
+        street_cells = {street_id: [] for street_id in street_ids}
+        parts = dict.fromkeys(street_ids, 0)
+        with engine.begin() as connection:
+            if output_mode in ('lines', 'both'):
+                with span('write_noise_lines'):
+                    delete_noise_lines(street_ids, connection)
+            for street_id, noise_lines, block_barrier in street_blocks(
+                    streets, buildings
+            ):
+                street_barriers[street_id].append(block_barrier)
+                if output_mode in ('lines', 'both'):
+                    with span('write_noise_lines'):
+                        save_noise_lines(noise_lines, street_id, connection,
+                                         parts[street_id])
+                if output_mode in ('grid', 'both'):
+                    with span('rasterize'):
+                        street_cells[street_id].append(
+                            rasterize_noise_lines(noise_lines)
+                        )
+                parts[street_id] += 1
+            with span('replace_street_barrier_noise'):
+                replace_street_barrier_noise(
+                    street_barrier_noise(street_barriers), street_ids,
+                    connection
+                )
+            mark_streets_finished(connection, street_ids)
+        # Растр пишется после фиксации транзакции, как в process_streets
+        if output_mode in ('grid', 'both'):
+            with span('write_grid'):
+                for street_id, cells in street_cells.items():
+                    merge_into_grid(max_per_cell(cells),
+                                    grid_key([street_id]))
+    STREETS_PROCESSED.inc(len(street_ids))
+    return len(street_ids)
+
+
+def process_tiles(
+        start: int,
+        stop: Optional[int] = None,
+        tile_size: float = city_tile_size
+) -> List[TileKey]:
+    """Process the tiles start:stop of list_city_tiles(tile_size)"""
+    ensure_barrier_noise_key()
+    if noise_lines_format == 'compact':
+        ensure_compact_ray_tables()
+    elif noise_lines_format == 'linestring':
+        ensure_noise_lines_street_id()
+    tiles = list_city_tiles(tile_size)[start:stop]
+    for number, tile in enumerate(tiles, start):
+        count = process_tile(tile, tile_size)
+        print(f'тайл {number} {tile} готов, улиц: {count}')
+    return tiles
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--start', type=int, default=0,
+                        help='номер первого тайла')
+    parser.add_argument('--stop', type=int, default=None,
+                        help='номер тайла после последнего')
+    parser.add_argument('--tile-size', type=float, default=city_tile_size,
+                        help='сторона тайла в единицах base_crs')
+    parser.add_argument('--list', action='store_true',
+                        help='вывести тайлы с их номерами и выйти')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for number, tile in enumerate(list_city_tiles(args.tile_size)):
+            print(number, *tile)
+        return 0
+    process_tiles(args.start, args.stop, args.tile_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
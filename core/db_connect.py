@@ -1,14 +1,27 @@
 import os
+from typing import List, Tuple
 from dotenv import load_dotenv
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, Table, MetaData, update, text
+from sqlalchemy.engine import Connection
+from sqlalchemy import create_engine, text, bindparam
 from config import (
     schema,
     db_name,
+    base_crs,
+    noise_limit,
     geometry_column,
     street_table_name,
+    street_id_column,
+    street_highway_types,
+    street_column_noise,
+    building_id_column,
+    building_table_name,
+    rays_view_name,
+    rays_table_name,
+    ray_origins_table_name,
     building_level_column,
+    noise_lines_table_name,
     barrier_noise_table_name,
+    facade_segments_table_name,
     barrier_noise_level_column
 )
 
@@ -19,22 +32,421 @@ engine = create_engine(
     f'{DB_CONN}/{db_name}'
 )
 
+# Шум фасадов от каждой улицы отдельно; barrier_noise - максимум по ним
+BARRIER_SOURCES_TABLE = f'{schema}.{barrier_noise_table_name}_sources'
+# Улица строк barrier_noise, записанных до появления таблицы по улицам
+LEGACY_STREET_ID = -1
 
-def mark_a_street_as_processed(street_id: int):
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    metadata = MetaData()
-    street = Table(
-        street_table_name, metadata, autoload_with=engine, schema=schema
+
+class LeaseLostError(RuntimeError):
+    """Аренду улиц перехватил другой обработчик или сняла mark_streets_dirty"""
+
+
+def ensure_street_queue_columns():
+    """Добавляет в таблицу улиц колонки аренды для очереди обработки"""
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+        ALTER TABLE {schema}.{street_table_name}
+            ADD COLUMN IF NOT EXISTS lease_until TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS leased_by TEXT
+        """))
+
+
+def claim_streets(
+        batch_size: int,
+        worker_id: str,
+        lease_seconds: int
+) -> List[int]:
+    """Атомарно забирает до batch_size необработанных улиц.
+
+    Улицы, заблокированные другими обработчиками, пропускаются
+    (SKIP LOCKED), а улицы с истёкшей арендой забираются заново.
+    """
+    with engine.begin() as connection:
+        result = connection.execute(
+            text(f"""
+            UPDATE {schema}.{street_table_name}
+            SET lease_until = now() + make_interval(secs => :lease_seconds),
+                leased_by = :worker_id
+            WHERE {street_id_column} IN (
+                SELECT {street_id_column}
+                FROM {schema}.{street_table_name}
+                WHERE "highway" IN :highway_types
+                    AND finished IS NOT TRUE
+                    AND (lease_until IS NULL OR lease_until < now())
+                ORDER BY {street_id_column} ASC
+                LIMIT :batch_size
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {street_id_column}
+            """).bindparams(bindparam('highway_types', expanding=True)),
+            {
+                'lease_seconds': lease_seconds,
+                'worker_id': worker_id,
+                'highway_types': list(street_highway_types),
+                'batch_size': batch_size
+            }
+        )
+        return sorted(row[0] for row in result)
+
+
+def mark_streets_as_processed(
+        connection: Connection,
+        street_ids: List[int],
+        worker_id: str
+):
+    """Отмечает улицы обработанными в транзакции сохранения результатов.
+
+    Если аренду за это время забрал другой обработчик или её сняла
+    mark_streets_dirty, бросается LeaseLostError, и транзакция откатывается
+    вместе с результатами.
+    """
+    result = connection.execute(
+        text(f"""
+        UPDATE {schema}.{street_table_name}
+        SET finished = TRUE, lease_until = NULL, leased_by = NULL
+        WHERE {street_id_column} IN :street_ids AND leased_by = :worker_id
+        """).bindparams(bindparam('street_ids', expanding=True)),
+        {'street_ids': list(street_ids), 'worker_id': worker_id}
+    )
+    if result.rowcount != len(street_ids):
+        raise LeaseLostError(
+            f'Аренда улиц {street_ids} перехвачена другим обработчиком'
+        )
+
+
+def list_city_tiles(tile_size: float) -> List[Tuple[int, int]]:
+    """Тайлы города со стороной tile_size, в которых есть улицы очереди.
+
+    Улица относится к тайлу, в котором лежит её ST_PointOnSurface, поэтому
+    каждая улица попадает ровно в один тайл. Тайлы упорядочены по (i, j),
+    и номер тайла в списке не зависит от того, кто его запрашивает.
+    """
+    with engine.begin() as connection:
+        result = connection.execute(
+            text(f"""
+            SELECT DISTINCT
+                floor(ST_X(ST_PointOnSurface({geometry_column})) / :size)
+                    ::bigint AS i,
+                floor(ST_Y(ST_PointOnSurface({geometry_column})) / :size)
+                    ::bigint AS j
+            FROM {schema}.{street_table_name}
+            WHERE "highway" IN :highway_types
+            ORDER BY i, j
+            """).bindparams(bindparam('highway_types', expanding=True)),
+            {'size': tile_size, 'highway_types': list(street_highway_types)}
+        )
+        return [(row[0], row[1]) for row in result]
+
+
+def mark_streets_finished(connection: Connection, street_ids: List[int]):
+    """Отмечает улицы обработанными без проверки аренды (режим тайлов)"""
+    connection.execute(
+        text(f"""
+        UPDATE {schema}.{street_table_name}
+        SET finished = TRUE, lease_until = NULL, leased_by = NULL
+        WHERE {street_id_column} IN :street_ids
+        """).bindparams(bindparam('street_ids', expanding=True)),
+        {'street_ids': list(street_ids)}
+    )
+
+
+def mark_streets_dirty(building_ids: List[int]) -> List[int]:
+    """Возвращает в очередь улицы, до которых доходит шум от зданий.
+
+    Улица попадает в очередь заново, если хотя бы одно из зданий лежит в
+    пределах её дальности шума 10 ** ((шум - noise_limit) / 10). Аренда
+    таких улиц снимается: обработчик, который сейчас их считает, не сможет
+    отметить их обработанными, и улицы будут посчитаны по новым зданиям.
+    Удалённые здания нужно передавать до удаления из таблицы.
+    """
+    if not building_ids:
+        return []
+    with engine.begin() as connection:
+        result = connection.execute(
+            text(f"""
+            UPDATE {schema}.{street_table_name} AS street
+            SET finished = FALSE, lease_until = NULL, leased_by = NULL
+            WHERE street."highway" IN :highway_types
+                AND EXISTS (
+                    SELECT 1 FROM {schema}.{building_table_name} AS building
+                    WHERE building."{building_id_column}" IN :building_ids
+                        AND ST_DWithin(
+                            street.{geometry_column},
+                            building.{geometry_column},
+                            power(10, (street.{street_column_noise}::numeric
+                                       - :noise_limit) / 10)
+                        )
+                )
+            RETURNING street.{street_id_column}
+            """).bindparams(
+                bindparam('highway_types', expanding=True),
+                bindparam('building_ids', expanding=True)
+            ),
+            {
+                'highway_types': list(street_highway_types),
+                'building_ids': list(building_ids),
+                'noise_limit': noise_limit
+            }
+        )
+        return sorted(row[0] for row in result)
+
+
+def count_queued_streets() -> int:
+    """Сколько улиц ждут обработки"""
+    with engine.begin() as connection:
+        return connection.execute(
+            text(f"""
+            SELECT count(*) FROM {schema}.{street_table_name}
+            WHERE "highway" IN :highway_types AND finished IS NOT TRUE
+            """).bindparams(bindparam('highway_types', expanding=True)),
+            {'highway_types': list(street_highway_types)}
+        ).scalar()
+
+
+def ensure_barrier_noise_key():
+    """Готовит barrier_noise к записи через upsert.
+
+    Ключ сегмента - хеш геометрии, вычисляемый самой базой. При первом
+    запуске старые дубли удаляются один раз, после чего уникальный индекс
+    (segment_key, этаж) не даёт им появиться снова. Рядом создаётся
+    таблица шума фасадов по улицам, см. replace_street_barrier_noise; при
+    её создании в неё переносятся уже записанные строки barrier_noise с
+    улицей LEGACY_STREET_ID, чтобы пересчёт улиц не терял их шум.
+    """
+    table = f'{schema}.{barrier_noise_table_name}'
+    key_index = f'{barrier_noise_table_name}_segment_key_uidx'
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            id BIGSERIAL PRIMARY KEY,
+            "index" BIGINT,
+            {geometry_column} GEOMETRY(LINESTRING, {base_crs}),
+            {building_level_column} DOUBLE PRECISION,
+            {barrier_noise_level_column} DOUBLE PRECISION
+        )
+        """))
+        connection.execute(text(f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS segment_key TEXT
+            GENERATED ALWAYS AS (md5(ST_AsEWKB({geometry_column}))) STORED
+        """))
+        has_index = connection.execute(
+            text('SELECT to_regclass(:name) IS NOT NULL'),
+            {'name': f'{schema}.{key_index}'}
+        ).scalar()
+        has_sources = connection.execute(
+            text('SELECT to_regclass(:name) IS NOT NULL'),
+            {'name': BARRIER_SOURCES_TABLE}
+        ).scalar()
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {BARRIER_SOURCES_TABLE} (
+            street_id BIGINT NOT NULL,
+            {geometry_column} GEOMETRY(LINESTRING, {base_crs}),
+            {building_level_column} DOUBLE PRECISION,
+            {barrier_noise_level_column} DOUBLE PRECISION,
+            segment_key TEXT GENERATED ALWAYS AS
+                (md5(ST_AsEWKB({geometry_column}))) STORED
+        )
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS
+            {barrier_noise_table_name}_sources_street_idx
+            ON {BARRIER_SOURCES_TABLE} (street_id)
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {barrier_noise_table_name}_sources_key_idx
+            ON {BARRIER_SOURCES_TABLE} (segment_key, {building_level_column})
+        """))
+        if not has_sources:
+            connection.execute(text(f"""
+            INSERT INTO {BARRIER_SOURCES_TABLE} (street_id, {geometry_column},
+                {building_level_column}, {barrier_noise_level_column})
+            SELECT {LEGACY_STREET_ID}, {geometry_column},
+                {building_level_column}, {barrier_noise_level_column}
+            FROM {table}
+            """))
+    if has_index:
+        return
+    delete_duplicates_barriers()
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS {key_index}
+            ON {table} (segment_key, {building_level_column})
+        """))
+
+
+def ensure_compact_ray_tables():
+    """Создаёт таблицы компактного хранения лучей и представление с линиями.
+
+    Луч без отражений восстанавливается по источнику, углу и длине, у
+    отражённого луча точки отражений и конец хранятся смещениями от
+    источника в массивах bounce_dx / bounce_dy. Источник помнит свою
+    улицу, чтобы при пересчёте улицы удалить её прежние лучи.
+    """
+    origins = f'{schema}.{ray_origins_table_name}'
+    rays = f'{schema}.{rays_table_name}'
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {origins} (
+            id BIGSERIAL PRIMARY KEY,
+            street_id BIGINT,
+            start_noise SMALLINT,
+            {geometry_column} GEOMETRY(POINT, {base_crs})
+        )
+        """))
+        connection.execute(text(f"""
+        ALTER TABLE {origins} ADD COLUMN IF NOT EXISTS street_id BIGINT
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {ray_origins_table_name}_street_id_idx
+            ON {origins} (street_id)
+        """))
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {rays} (
+            origin_id BIGINT,
+            angle SMALLINT,
+            floor SMALLINT,
+            length REAL,
+            bounce_dx REAL[],
+            bounce_dy REAL[]
+        )
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {rays_table_name}_origin_id_idx
+            ON {rays} (origin_id)
+        """))
+        connection.execute(text(f"""
+        CREATE OR REPLACE VIEW {schema}.{rays_view_name} AS
+        SELECT
+            r.origin_id,
+            r.angle,
+            r.floor * 3 AS level,
+            o.start_noise,
+            CASE WHEN r.bounce_dx IS NULL THEN ST_MakeLine(
+                o.{geometry_column},
+                ST_Translate(
+                    o.{geometry_column},
+                    r.length * cos(radians(r.angle)),
+                    r.length * sin(radians(r.angle))
+                )
+            ) ELSE (
+                SELECT ST_MakeLine(array_prepend(
+                    o.{geometry_column},
+                    array_agg(
+                        ST_Translate(o.{geometry_column}, v.dx, v.dy)
+                        ORDER BY v.n
+                    )
+                ))
+                FROM unnest(r.bounce_dx, r.bounce_dy)
+                    WITH ORDINALITY AS v(dx, dy, n)
+            ) END AS {geometry_column}
+        FROM {rays} r
+        JOIN {origins} o ON o.id = r.origin_id
+        """))
+
+
+def ensure_noise_lines_street_id():
+    """Добавляет в noise_lines колонку street_id с индексом.
+
+    Таблицу создаёт первая запись лучей; если её ещё нет, колонка появится
+    вместе с ней, а индекс - при следующем запуске.
+    """
+    table = f'{schema}.{noise_lines_table_name}'
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text('SELECT to_regclass(:name) IS NOT NULL'), {'name': table}
+        ).scalar()
+        if not exists:
+            return
+        connection.execute(text(f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS street_id BIGINT
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {noise_lines_table_name}_street_id_idx
+            ON {table} (street_id)
+        """))
+
+
+def delete_street_noise_lines(connection: Connection, street_ids: List[int]):
+    """Удаляет лучи улиц из noise_lines перед их пересчётом"""
+    table = f'{schema}.{noise_lines_table_name}'
+    exists = connection.execute(
+        text('SELECT to_regclass(:name) IS NOT NULL'), {'name': table}
+    ).scalar()
+    if not exists:
+        return
+    connection.execute(
+        text(f'DELETE FROM {table} WHERE street_id = ANY(:street_ids)'),
+        {'street_ids': list(street_ids)}
     )
 
-    update_stmt = (
-        update(street).where(
-            street.c.id == street_id).values(finished=True)
+
+def delete_street_compact_rays(
+        connection: Connection,
+        street_ids: List[int]
+):
+    """Удаляет компактные лучи улиц и их источники перед пересчётом"""
+    origins = f'{schema}.{ray_origins_table_name}'
+    connection.execute(
+        text(f"""
+        DELETE FROM {schema}.{rays_table_name}
+        WHERE origin_id IN (
+            SELECT id FROM {origins} WHERE street_id = ANY(:street_ids)
+        )
+        """),
+        {'street_ids': list(street_ids)}
+    )
+    connection.execute(
+        text(f'DELETE FROM {origins} WHERE street_id = ANY(:street_ids)'),
+        {'street_ids': list(street_ids)}
+    )
+
+
+def ensure_facade_segment_tables():
+    """Создаёт хранилище сегментов фасадов и таблицу состояния зданий.
+
+    У сегмента постоянный id, номер здания, этажность и геометрия под
+    пространственным индексом. В таблице с суффиксом _state для каждого
+    здания хранится хеш геометрии, этажности и noise_segment_size, из
+    которых построены его сегменты; по нему core.facade_store находит
+    устаревшие.
+    """
+    segments = f'{schema}.{facade_segments_table_name}'
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {segments} (
+            id BIGSERIAL PRIMARY KEY,
+            building_id BIGINT NOT NULL,
+            {building_level_column} DOUBLE PRECISION,
+            {geometry_column} GEOMETRY(LINESTRING, {base_crs})
+        )
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {facade_segments_table_name}_geom_idx
+            ON {segments} USING GIST ({geometry_column})
+        """))
+        connection.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS {facade_segments_table_name}_building_idx
+            ON {segments} (building_id)
+        """))
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {segments}_state (
+            building_id BIGINT PRIMARY KEY,
+            building_hash TEXT NOT NULL
+        )
+        """))
+
+
+def reserve_ray_origin_ids(connection: Connection, count: int) -> List[int]:
+    """Берёт count идентификаторов источников из последовательности"""
+    result = connection.execute(
+        text("""
+        SELECT nextval(pg_get_serial_sequence(:table, 'id'))
+        FROM generate_series(1, :count)
+        """),
+        {'table': f'{schema}.{ray_origins_table_name}', 'count': count}
     )
-    session.execute(update_stmt)
-    session.commit()
-    session.close()
+    return [row[0] for row in result]
 
 
 def delete_duplicates_barriers():
@@ -56,9 +56,78 @@ def batch_delete():
                 pbar.update(deleted)
 
 
+def batch_delete_compact():
+    # Компактные лучи: высота луча - floor * 3, как level в noise_lines
+    inspector = inspect(engine)
+    tables = inspector.get_table_names(schema=SCHEMA)
+    if RAYS_TABLE not in tables or ORIGINS_TABLE not in tables:
+        return
+    rays = f'{SCHEMA}.{RAYS_TABLE}'
+    origins = f'{SCHEMA}.{ORIGINS_TABLE}'
+
+    with engine.begin() as conn:
+        total_count = conn.execute(
+            text(f'SELECT COUNT(*) FROM {rays} WHERE floor * 3 > 80')
+        ).scalar()
+
+        with tqdm(total=total_count, desc="Удаление лучей") as pbar:
+            while True:
+                # У таблицы лучей нет своего ключа, пачка выбирается по ctid
+                result = conn.execute(
+                    text(f"""
+                        WITH batch AS (
+                            SELECT ctid
+                            FROM {rays}
+                            WHERE floor * 3 > 80
+                            LIMIT {BATCH_SIZE}
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        DELETE FROM {rays}
+                        WHERE ctid IN (SELECT ctid FROM batch)
+                    """)
+                )
+
+                deleted = result.rowcount
+                if deleted == 0:
+                    break
+
+                pbar.update(deleted)
+
+        # Источники, у которых не осталось лучей
+        with tqdm(desc="Удаление источников лучей") as pbar:
+            while True:
+                result = conn.execute(
+                    text(f"""
+                        WITH batch AS (
+                            SELECT o.id
+                            FROM {origins} o
+                            WHERE NOT EXISTS (
+                                SELECT 1 FROM {rays} r
+                                WHERE r.origin_id = o.id
+                            )
+                            LIMIT {BATCH_SIZE}
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        DELETE FROM {origins}
+                        WHERE id IN (SELECT id FROM batch)
+                    """)
+                )
+
+                deleted = result.rowcount
+                if deleted == 0:
+                    break
+
+                pbar.update(deleted)
+
+
 if __name__ == "__main__":
     TABLE_NAME = "moscow.noise_lines"  # Формат: schema.table_name
     COLUMN_NAME = "level"  # Имя колонки для условия
     BATCH_SIZE = 100000  # Размер пакета
+    # Таблицы компактного хранения лучей (noise_lines_format = 'compact')
+    SCHEMA = "moscow"
+    ORIGINS_TABLE = "noise_ray_origins"
+    RAYS_TABLE = "noise_rays"
 
     batch_delete()
+    batch_delete_compact()
@@ -0,0 +1,191 @@
+import os
+import atexit
+import pickle
+import threading
+from tqdm import tqdm
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import Pool, resource_tracker, shared_memory
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, \
+    Optional
+
+from config import executor_backend, executor_workers, executor_chunk_size
+
+BACKENDS = ('serial', 'thread', 'process')
+
+_executor: Optional['Executor'] = None
+_executor_lock = threading.Lock()
+
+# Контексты, уже прочитанные обработчиком пула из общей памяти
+SHARED_CONTEXT_CACHE = 2
+_shared_contexts: 'OrderedDict[str, Any]' = OrderedDict()
+_shared_contexts_lock = threading.Lock()
+
+
+class SharedContext(NamedTuple):
+    """Name and size of a pickled context in shared memory"""
+    name: str
+    size: int
+
+
+class Executor:
+    """Pool of workers shared by all pipeline stages.
+
+    The pool is started on first use and reused by every later stage and
+    street, so its start-up cost is paid once per process. Backends:
+    'serial' (no pool), 'thread' (shapely 2 and NumPy release the GIL) and
+    'process' (multiprocessing.Pool).
+    """
+
+    def __init__(
+            self,
+            backend: str = executor_backend,
+            workers: Optional[int] = executor_workers,
+            chunk_size: int = executor_chunk_size
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f'Неизвестный исполнитель: {backend}')
+        self.backend = backend
+        self.workers = max(workers or os.cpu_count() or 1, 1)
+        self.chunk_size = max(chunk_size, 1)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def map(
+            self,
+            func: Callable,
+            items: Iterable,
+            context: Any = None,
+            desc: Optional[str] = None
+    ) -> List:
+        """Apply func to every item, keeping the order of items.
+
+        If context is given, func is called as func(item, context); with
+        the thread and serial backends it is shared, not copied. The
+        process backend pickles it once per call of map into shared
+        memory, and every worker unpickles it once (see shared_context).
+        """
+        items = list(items)
+        if self.backend != 'process' or len(items) <= 1:
+            return self._collect(func, items, context, desc)
+        with share_context(context) as shared:
+            return self._collect(func, items, shared, desc)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is None:
+                return
+            if self.backend == 'thread':
+                self._pool.shutdown(wait=True)
+            else:
+                self._pool.close()
+                self._pool.join()
+            self._pool = None
+
+    def _collect(self, func, items, context, desc) -> List:
+        calls = [(func, item, context) for item in items]
+        if self.backend == 'serial' or len(calls) <= 1:
+            results = map(_call, calls)
+        elif self.backend == 'thread':
+            results = self._get_pool().map(_call, calls)
+        else:
+            results = self._get_pool().imap(
+                _call, calls, chunksize=self.chunk_size
+            )
+        return list(tqdm(results, total=len(calls), desc=desc,
+                         disable=desc is None))
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.backend == 'thread':
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix='noise-worker'
+                    )
+                else:
+                    # Обработчики должны делить трекер ресурсов с родителем,
+                    # иначе их трекеры сочтут общую память утёкшей
+                    resource_tracker.ensure_running()
+                    self._pool = Pool(processes=self.workers)
+            return self._pool
+
+
+def get_executor() -> Executor:
+    """The process-wide executor configured in config.py"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = Executor()
+            atexit.register(_executor.shutdown)
+        return _executor
+
+
+def configure_executor(
+        backend: str = executor_backend,
+        workers: Optional[int] = executor_workers,
+        chunk_size: int = executor_chunk_size
+) -> Executor:
+    """Replace the process-wide executor, e.g. for benchmarks"""
+    global _executor
+    executor = Executor(backend, workers, chunk_size)
+    with _executor_lock:
+        previous, _executor = _executor, executor
+    if previous is not None:
+        previous.shutdown()
+    atexit.register(executor.shutdown)
+    return executor
+
+
+@contextmanager
+def share_context(context: Any) -> Iterator[Optional[SharedContext]]:
+    """Pickle context into shared memory for the time of one map"""
+    if context is None:
+        yield None
+        return
+    payload = pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL)
+    block = shared_memory.SharedMemory(create=True, size=max(len(payload), 1))
+    try:
+        block.buf[:len(payload)] = payload
+        yield SharedContext(block.name, len(payload))
+    finally:
+        block.close()
+        block.unlink()
+
+
+def shared_context(shared: SharedContext) -> Any:
+    """Context of share_context, unpickled once per worker process"""
+    with _shared_contexts_lock:
+        if shared.name in _shared_contexts:
+            _shared_contexts.move_to_end(shared.name)
+            return _shared_contexts[shared.name]
+        block = attach_block(shared.name)
+        try:
+            payload = bytes(block.buf[:shared.size])
+        finally:
+            block.close()
+        context = pickle.loads(payload)
+        _shared_contexts[shared.name] = context
+        while len(_shared_contexts) > SHARED_CONTEXT_CACHE:
+            _shared_contexts.popitem(last=False)
+        return context
+
+
+def attach_block(name: str) -> shared_memory.SharedMemory:
+    """Open an existing shared memory block in a worker"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # До Python 3.13 параметра track нет; обработчики пула делят трекер
+        # ресурсов с родителем, так что повторная регистрация безвредна
+        return shared_memory.SharedMemory(name=name)
+
+
+def _call(args):
+    func, item, context = args
+    if isinstance(context, SharedContext):
+        context = shared_context(context)
+    if context is None:
+        return func(item)
+    return func(item, context)
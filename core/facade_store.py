@@ -0,0 +1,283 @@
+"""Хранилище сегментов фасадов.
+
+Сегменты фасадов всех зданий из building_table_name строятся
+polygons_to_segments один раз и хранятся в facade_segments_table_name
+с постоянными id, этажностью и пространственным индексом.
+refresh_facade_segments перестраивает только здания, у которых
+изменились геометрия или этажность (или noise_segment_size), и удаляет
+сегменты удалённых зданий. При facade_segment_source = 'store' расчёт
+берёт сегменты из хранилища тайлами по охвату зданий, как
+building_loader читает сами здания; сегменты зданий, которых в
+хранилище ещё нет или которые изменились после обновления хранилища
+(хеш не совпадает с записанным), строятся на месте.
+
+Обновление хранилища из корня репозитория:
+    python -m core.facade_store
+"""
+import sys
+import hashlib
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from sqlalchemy import text
+from typing import Dict, List, Optional
+
+from core.bulk_writer import copy_facade_segments
+from core.geom_transform import polygons_to_segments
+from core.building_loader import TileKey, TileCache, tiles_for_bounds
+from core.db_connect import engine, ensure_facade_segment_tables
+from config import (
+    schema,
+    base_crs,
+    geometry_column,
+    building_tile_size,
+    building_id_column,
+    building_table_name,
+    noise_segment_size,
+    building_cache_tiles,
+    facade_refresh_batch,
+    building_level_column,
+    facade_segments_table_name
+)
+
+SEGMENTS_TABLE = f'{schema}.{facade_segments_table_name}'
+STATE_TABLE = f'{SEGMENTS_TABLE}_state'
+
+# Сегменты, уже прочитанные из хранилища, по тайлам зданий
+_tile_cache = TileCache(building_cache_tiles)
+
+
+def building_segments(buildings: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Store rows of the buildings: building_id, floors and geometry"""
+    polygons = buildings[
+        buildings.geometry.type.isin(['Polygon', 'MultiPolygon'])
+    ]
+    segments = polygons_to_segments(
+        polygons[[building_id_column, building_level_column,
+                  geometry_column]]
+    )
+    return segments.rename(columns={building_id_column: 'building_id'})
+
+
+def refresh_facade_segments(
+        building_ids: Optional[List[int]] = None,
+        batch_size: int = facade_refresh_batch
+) -> int:
+    """Rebuild the stored segments of changed buildings.
+
+    Buildings are read once, in pages of batch_size ordered by id (keyset
+    paging); the buildings of a page whose hash differs from the one
+    stored with their segments are rebuilt in the page's transaction.
+    Segments of buildings removed from the table are deleted. With
+    building_ids only those buildings are checked. Returns the number of
+    rebuilt buildings.
+    """
+    ensure_facade_segment_tables()
+    only, removed_only = '', ''
+    if building_ids is not None:
+        if not building_ids:
+            return 0
+        id_list = ', '.join(str(int(i)) for i in building_ids)
+        only = f'AND "{building_id_column}" IN ({id_list})'
+        removed_only = f'AND s.building_id IN ({id_list})'
+
+    refreshed, last_id = 0, None
+    while True:
+        with engine.begin() as connection:
+            page = read_building_page(connection, last_id, batch_size, only)
+            if page.empty:
+                break
+            last_id = int(page[building_id_column].iloc[-1])
+            ids = [int(i) for i in page[building_id_column]]
+            hashes = building_hashes(page)
+            stored = read_stored_hashes(connection, ids)
+            stale = np.array([
+                stored.get(building_id) != building_hash
+                for building_id, building_hash in zip(ids, hashes)
+            ], dtype=bool)
+            if stale.any():
+                replace_segments(connection, page[stale], hashes[stale])
+        refreshed += int(stale.sum())
+        print(f'сегменты фасадов: проверены здания до id {last_id}, '
+              f'обновлено {refreshed}')
+
+    with engine.begin() as connection:
+        for table in (SEGMENTS_TABLE, STATE_TABLE):
+            connection.execute(text(f"""
+            DELETE FROM {table} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {schema}.{building_table_name} b
+                WHERE b."{building_id_column}" = s.building_id
+            ) {removed_only}
+            """))
+    clear_facade_cache()
+    return refreshed
+
+
+def building_hashes(buildings: gpd.GeoDataFrame) -> np.ndarray:
+    """Hash of the geometry, floors and noise_segment_size of buildings.
+
+    The segments of a building are stored with this hash; the building
+    read again gives the same hash until it changes.
+    """
+    geoms = shapely.to_wkb(np.asarray(buildings.geometry.values))
+    floors = pd.to_numeric(buildings[building_level_column],
+                           errors='coerce').astype(float)
+    return np.array([
+        hashlib.md5(
+            geom + f'|{level!r}|{noise_segment_size}'.encode()
+        ).hexdigest()
+        for geom, level in zip(geoms, floors)
+    ], dtype=object)
+
+
+def read_building_page(
+        connection,
+        last_id: Optional[int],
+        batch_size: int,
+        only: str = ''
+) -> gpd.GeoDataFrame:
+    """Up to batch_size buildings with ids above last_id, ordered by id"""
+    after = '' if last_id is None else (
+        f'AND "{building_id_column}" > {int(last_id)}'
+    )
+    return gpd.read_postgis(
+        con=connection,
+        crs=base_crs,
+        geom_col=geometry_column,
+        sql=f'''SELECT "{building_id_column}", "{building_level_column}",
+            {geometry_column}
+        FROM {schema}.{building_table_name}
+        WHERE TRUE {after} {only}
+        ORDER BY "{building_id_column}"
+        LIMIT {int(batch_size)}'''
+    )
+
+
+def read_stored_hashes(
+        connection,
+        building_ids: List[int]
+) -> Dict[int, str]:
+    """Hashes stored with the segments of the buildings, by building id"""
+    result = connection.execute(
+        text(f'SELECT building_id, building_hash FROM {STATE_TABLE} '
+             f'WHERE building_id = ANY(:ids)'),
+        {'ids': list(building_ids)}
+    )
+    return {int(row[0]): row[1] for row in result}
+
+
+def replace_segments(
+        connection,
+        buildings: gpd.GeoDataFrame,
+        hashes: np.ndarray
+):
+    """Store the segments of buildings in place of their old segments"""
+    ids = [int(i) for i in buildings[building_id_column]]
+    connection.execute(
+        text(f'DELETE FROM {SEGMENTS_TABLE} '
+             f'WHERE building_id = ANY(:ids)'),
+        {'ids': ids}
+    )
+    copy_facade_segments(building_segments(buildings), connection)
+    connection.execute(
+        text(f"""
+        INSERT INTO {STATE_TABLE} (building_id, building_hash)
+        SELECT * FROM unnest(
+            CAST(:ids AS BIGINT[]), CAST(:hashes AS TEXT[])
+        )
+        ON CONFLICT (building_id) DO UPDATE
+        SET building_hash = EXCLUDED.building_hash
+        """),
+        {'ids': ids, 'hashes': list(hashes)}
+    )
+
+
+def load_facade_segments(buildings: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """polygons_to_segments(buildings) taken from the segment store.
+
+    Segments are read for the building tiles covering the buildings and
+    get the attributes of their building from buildings, in the same row
+    order polygons_to_segments gives. Buildings missing from the store,
+    or stored with another hash than building_hashes gives for them now,
+    are segmented here.
+    """
+    if buildings.empty or building_id_column not in buildings.columns:
+        return polygons_to_segments(buildings)
+    tiles = tiles_for_bounds(tuple(buildings.total_bounds))
+    stored = pd.concat(
+        [_get_tile(tile) for tile in tiles], ignore_index=True
+    ).drop_duplicates(subset='id')
+    position = pd.Series(
+        np.arange(len(buildings)),
+        index=buildings[building_id_column].to_numpy()
+    )
+    stored = stored[stored['building_id'].isin(position.index)]
+    # Сегменты здания, изменённого после обновления хранилища, не годятся
+    current = pd.Series(building_hashes(buildings), index=position.index)
+    stored = stored[stored['building_hash'].to_numpy() ==
+                    current.reindex(stored['building_id']).to_numpy()]
+    stored_position = position.reindex(stored['building_id']).to_numpy()
+    order = np.lexsort((stored['id'].to_numpy(), stored_position))
+
+    attributes = pd.DataFrame(
+        buildings.drop(columns=buildings.geometry.name)
+    ).iloc[stored_position[order]].reset_index(drop=True)
+    attributes[geometry_column] = stored.geometry.values[order]
+    segments = gpd.GeoDataFrame(attributes, geometry=geometry_column,
+                                crs=buildings.crs)
+
+    missing = ~buildings[building_id_column].isin(stored['building_id'])
+    if not missing.any():
+        return segments
+    computed = polygons_to_segments(buildings[missing])
+    computed_position = position.reindex(
+        computed[building_id_column]
+    ).to_numpy()
+    segments = gpd.GeoDataFrame(
+        pd.concat([segments, computed], ignore_index=True),
+        geometry=geometry_column, crs=buildings.crs
+    )
+    return segments.iloc[np.argsort(
+        np.concatenate([stored_position[order], computed_position]),
+        kind='stable'
+    )].reset_index(drop=True)
+
+
+def clear_facade_cache():
+    _tile_cache.clear()
+
+
+def _get_tile(tile: TileKey) -> gpd.GeoDataFrame:
+    return _tile_cache.get(tile, read_facade_tile)
+
+
+def read_facade_tile(tile: TileKey) -> gpd.GeoDataFrame:
+    """Stored segments whose bounding box touches one tile.
+
+    Every segment comes with the hash of the building it was built from.
+    """
+    i, j = tile
+    return gpd.read_postgis(
+        con=engine,
+        crs=base_crs,
+        geom_col=geometry_column,
+        sql=f'''SELECT s.id, s.building_id, state.building_hash,
+            s.{geometry_column}
+        FROM {SEGMENTS_TABLE} s
+        JOIN {STATE_TABLE} state USING (building_id)
+        WHERE s.{geometry_column} && ST_MakeEnvelope(
+            {i * building_tile_size}, {j * building_tile_size},
+            {(i + 1) * building_tile_size}, {(j + 1) * building_tile_size},
+            {base_crs})'''
+    )
+
+
+def main() -> int:
+    refresh_facade_segments()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,11 @@
 import math
+import shapely
 import warnings
 import numpy as np
-from tqdm import tqdm
 from pandas import concat
 from typing import Literal
-from shapely.geometry import LineString
-from multiprocessing import Pool, cpu_count
 from geopandas import GeoDataFrame, options
+from core.executor import get_executor
 from config import noise_segment_size, building_level_column, geometry_column
 
 warnings.filterwarnings('ignore')
@@ -16,85 +15,50 @@ options.use_pygeos = True
 
 
 def polygons_to_segments(gdf: GeoDataFrame):
-    """Конвертация полигонов в сегменты с многопроцессорной обработкой"""
-    if check_geomtype(gdf, 'MultiPolygon'):
-        gdf = gdf.explode(index_parts=True).reset_index(drop=True)
-        gdf = gdf[gdf.geometry.type == 'Polygon'].copy()
-    if not check_geomtype(gdf, 'Polygon'):
-        raise ValueError('Тип геометрии должен быть Polygon')
-
-    # Разбиваем данные на чанки для обработки
-    chunks = np.array_split(gdf, cpu_count() * 4)
-
-    with Pool(processes=cpu_count()) as pool:
-        results = list(tqdm(
-            pool.imap_unordered(_process_polygon_chunk, chunks),
-            total=len(chunks),
-            desc="Converting polygons to lines"
-        ))
-
-    lines = concat(results)
-    return lines_to_segments(GeoDataFrame(lines, crs=gdf.crs))
-
+    """Конвертация полигонов в двухточечные сегменты их колец.
 
-def _process_polygon_chunk(chunk):
-    """Вспомогательная функция для обработки чанка полигонов"""
-    return polygons_to_lines(chunk)
+    Внешние и внутренние кольца всех полигонов разбиваются на отрезки не
+    длиннее noise_segment_size за несколько векторных вызовов shapely;
+    атрибуты полигона переносятся на его сегменты по индексу.
+    """
+    if not all(gdf.geometry.type.isin(['Polygon', 'MultiPolygon'])):
+        raise ValueError('Тип геометрии должен быть Polygon')
+    parts, part_owner = shapely.get_parts(
+        gdf.geometry.values, return_index=True
+    )
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    return _rings_to_segments(gdf, rings, part_owner[ring_part])
 
 
 def lines_to_segments(gdf: GeoDataFrame):
-    """Разделение линий на сегменты с многопроцессорной обработкой"""
-    if check_geomtype(gdf, 'MultiLineString'):
-        gdf = gdf.explode(index_parts=True).reset_index(drop=True)
-        gdf = gdf[gdf.geometry.type == 'LineString'].copy()
-    if not check_geomtype(gdf, 'LineString'):
+    """Разделение линий на двухточечные сегменты"""
+    if not all(gdf.geometry.type.isin(['LineString', 'MultiLineString'])):
         raise ValueError(
             f'Тип геометрии должен быть LineString, а сейчас {gdf.geom_type}')
+    lines, line_owner = shapely.get_parts(
+        gdf.geometry.values, return_index=True
+    )
+    return _rings_to_segments(gdf, lines, line_owner)
 
-    # Разбиваем данные на чанки
-    chunks = [(i, gdf.iloc[i]) for i in range(len(gdf))]
-
-    with Pool(processes=cpu_count()) as pool:
-        results = list(tqdm(
-            pool.imap_unordered(_process_line_chunk, chunks),
-            total=len(chunks),
-            desc="Splitting lines into segments"
-        ))
-
-    # Собираем все сегменты в один DataFrame
-    all_segments = []
-    for segments in results:
-        all_segments.extend(segments)
 
-    return GeoDataFrame(all_segments).set_crs(gdf.crs)
-
-
-def _process_line_chunk(args):
-    """Вспомогательная функция для обработки одной линии"""
-    idx, line = args
-    segments = split_line_into_segments(line.geometry)
-    line_dict = line.to_dict()
-    line_dict.pop(geometry_column)
-    return [{geometry_column: segment, **line_dict} for segment in segments]
-
-
-def polygons_to_lines(gdf: GeoDataFrame):
-    """Оптимизированная конвертация полигонов в линии"""
-    lines_gdf = GeoDataFrame(
-        gdf.drop(columns=geometry_column),
-        geometry=gdf.boundary
-    ).set_crs(gdf.crs)
-    return lines_gdf.explode(index_parts=True).reset_index(drop=True).loc[
-        lambda x: x.geometry.type == 'LineString'
-    ].copy()
-
-
-def split_line_into_segments(line):
-    """Векторизованное разделение линии на сегменты"""
-    line = line.segmentize(noise_segment_size)
-    coords = np.array(line.coords)
-    return [LineString([coords[i], coords[i + 1]]) for i in
-            range(len(coords) - 1)]
+def _rings_to_segments(
+        gdf: GeoDataFrame,
+        lines: np.ndarray,
+        owner: np.ndarray
+) -> GeoDataFrame:
+    """Сегменты линий lines с атрибутами строк gdf с номерами owner"""
+    lines = shapely.segmentize(lines, noise_segment_size)
+    coords, line_idx = shapely.get_coordinates(lines, return_index=True)
+    # Отрезок - пара соседних точек одной и той же линии
+    starts = np.flatnonzero(line_idx[:-1] == line_idx[1:])
+    segments = shapely.linestrings(
+        np.stack([coords[starts], coords[starts + 1]], axis=1)
+    )
+    attributes = gdf.drop(columns=gdf.geometry.name).iloc[
+        owner[line_idx[starts]]
+    ].reset_index(drop=True)
+    attributes[geometry_column] = segments
+    return GeoDataFrame(attributes, geometry=geometry_column, crs=gdf.crs)
 
 
 def check_geomtype(
@@ -112,14 +76,12 @@ def check_geomtype(
 def segmentation_of_barrier_by_floors(barriers: GeoDataFrame):
     """Многопроцессорная сегментация барьеров по этажам"""
     # Разбиваем данные на чанки
-    chunks = np.array_split(barriers, cpu_count() * 4)
-
-    with Pool(processes=cpu_count()) as pool:
-        results = list(tqdm(
-            pool.imap_unordered(_process_barrier_chunk, chunks),
-            total=len(chunks),
-            desc="Processing barriers by floors"
-        ))
+    executor = get_executor()
+    chunks = np.array_split(barriers, executor.workers * 4)
+
+    results = executor.map(
+        _process_barrier_chunk, chunks, desc="Processing barriers by floors"
+    )
 
     # Объединяем результаты
     new_rows = []
@@ -0,0 +1,160 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, List
+
+from config import job_ttl_seconds, max_finished_jobs
+
+# Статусы задач, которые больше не изменятся
+TERMINAL_STATUSES = ('finished', 'cancelled', 'failed')
+
+
+@dataclass
+class NoiseJob:
+    """State of one background noise_maker run"""
+    id: str
+    count_streets: int
+    status: str = 'queued'
+    stage: Optional[str] = None
+    streets_done: int = 0
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    _cancel: threading.Event = field(
+        default_factory=threading.Event, repr=False
+    )
+
+    @property
+    def cancelled(self) -> bool:
+        """Cancellation requested; noise_maker checks it between streets"""
+        return self._cancel.is_set()
+
+    def report(
+            self,
+            stage: Optional[str] = None,
+            streets_done: Optional[int] = None
+    ):
+        if stage is not None:
+            self.stage = stage
+        if streets_done is not None:
+            self.streets_done = streets_done
+
+    def to_dict(self) -> dict:
+        elapsed = None
+        throughput = None
+        eta = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if self.streets_done and elapsed > 0:
+                throughput = self.streets_done / elapsed * 3600
+                if self.status == 'running':
+                    remaining = self.count_streets - self.streets_done
+                    eta = remaining / self.streets_done * elapsed
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'streets_done': self.streets_done,
+            'count_streets': self.count_streets,
+            'elapsed_seconds': elapsed,
+            'streets_per_hour': throughput,
+            'eta_seconds': eta,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """Runs noise_maker jobs in background threads.
+
+    At most max_jobs jobs run at the same time, the rest wait in the queue.
+    The runner is called as runner(count_streets_update=..., job=job).
+    Finished, cancelled and failed jobs are forgotten ttl_seconds after
+    they end, and only the max_finished most recent of them are kept.
+    """
+
+    def __init__(
+            self,
+            runner: Callable[..., None],
+            max_jobs: int,
+            ttl_seconds: float = job_ttl_seconds,
+            max_finished: int = max_finished_jobs
+    ):
+        self.runner = runner
+        self.ttl_seconds = ttl_seconds
+        self.max_finished = max_finished
+        self.jobs: Dict[str, NoiseJob] = {}
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_jobs, thread_name_prefix='noise-job'
+        )
+
+    def submit(self, count_streets: int) -> NoiseJob:
+        job = NoiseJob(id=uuid.uuid4().hex, count_streets=count_streets)
+        with self._lock:
+            self._evict()
+            self.jobs[job.id] = job
+            self._futures[job.id] = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[NoiseJob]:
+        with self._lock:
+            self._evict()
+            return self.jobs.get(job_id)
+
+    def list(self) -> List[NoiseJob]:
+        with self._lock:
+            self._evict()
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[NoiseJob]:
+        """Cancel a queued job at once, a running one after its street"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job._cancel.set()
+        with self._lock:
+            if self._futures[job_id].cancel():
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+            elif job.status == 'running':
+                job.status = 'cancelling'
+        return job
+
+    def shutdown(self):
+        for job in self.list():
+            self.cancel(job.id)
+        self._executor.shutdown(wait=True)
+
+    def _evict(self):
+        # Вызывается под self._lock
+        ended = sorted(
+            (job for job in self.jobs.values()
+             if job.status in TERMINAL_STATUSES),
+            key=lambda job: job.finished_at or job.created_at
+        )
+        expired = time.time() - self.ttl_seconds
+        for number, job in enumerate(ended):
+            if (len(ended) - number > self.max_finished or
+                    (job.finished_at or job.created_at) < expired):
+                del self.jobs[job.id]
+                del self._futures[job.id]
+
+    def _run(self, job: NoiseJob):
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            self.runner(count_streets_update=job.count_streets, job=job)
+            job.status = 'cancelled' if job.cancelled else 'finished'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
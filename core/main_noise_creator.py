@@ -1,147 +1,570 @@
-import time
-import geopandas as gpd
+import os
+import glob
+import shutil
+import socket
+import shapely
+import numpy as np
 import pandas as pd
+import geopandas as gpd
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from core.geom_transform import (
     polygons_to_segments,
     segmentation_of_barrier_by_floors
 )
-from core.stars_maker import make_noise_stars
+from core.jobs import NoiseJob
+from core.metrics import (
+    span,
+    street_metrics,
+    BARRIER_HITS,
+    FACADE_SEGMENTS,
+    FACADE_SEGMENTS_HIT,
+    RAYS_CULLED,
+    RAYS_GENERATED,
+    STREETS_PROCESSED,
+    RESULT_CACHE_HITS,
+    RESULT_CACHE_MISSES
+)
+from core.stars_maker import make_noise_stars_fans
+from core.adaptive_stars import facade_keys, origin_fans
+from core.origin_sharing import (
+    street_strides,
+    fill_facade_gaps,
+    shared_origin_points
+)
+from core.ray_culling import fan_buildings, intersect_stars
 from core.reflection import make_noise_reflection
+from core.wavefront import make_noise_reflection_wavefront
+from core.noise_grid import (
+    grid_key,
+    max_per_cell,
+    merge_into_grid,
+    rasterize_noise_lines
+)
+from core.ray_store import encode_rays, write_rays_parquet
+from core.result_cache import (
+    street_cache_key,
+    get_result_cache,
+    buildings_in_reach,
+    merge_barrier_noise
+)
+from core.bulk_writer import (
+    copy_to_postgis,
+    copy_compact_rays,
+    replace_street_barrier_noise
+)
+from core.building_loader import load_buildings_near
+from core.facade_store import load_facade_segments
 from core.db_connect import (
     engine,
-    mark_a_street_as_processed,
-    delete_duplicates_barriers
+    claim_streets,
+    LeaseLostError,
+    ensure_barrier_noise_key,
+    delete_street_noise_lines,
+    ensure_compact_ray_tables,
+    mark_streets_as_processed,
+    delete_street_compact_rays,
+    ensure_street_queue_columns,
+    ensure_noise_lines_street_id
 )
 from config import (
     schema,
     base_crs,
     noise_limit,
+    output_mode,
+    output_writer,
+    compact_rays_dir,
+    facade_gap_segments,
+    facade_segment_source,
     point_interval,
-    stars_line_step,
     geometry_column,
+    street_id_column,
     street_table_name,
+    street_batch_size,
+    reflection_engine,
     noise_level_column,
-    building_table_name,
+    noise_lines_format,
+    star_mode,
+    origin_stride,
+    street_lease_seconds,
+    stream_block_origins,
     building_level_column,
-    noise_lines_table_name,
-    barrier_noise_table_name
+    noise_lines_table_name
 )
 
+reflection_engines = {
+    'legacy': make_noise_reflection,
+    'wavefront': make_noise_reflection_wavefront
+}
 
-def create_noise(streets: gpd.GeoDataFrame, buildings: gpd.GeoDataFrame):
-    start_time = time.time()
 
-    building_max_level = buildings[building_level_column].max()
+def create_noise(
+        streets: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None] = None,
+        strides: Optional[Dict[str, int]] = None,
+        max_gap: int = facade_gap_segments
+):
+    """Лучи и шум фасадов пачки улиц.
 
-    noise_stars = make_noise_stars(
-        street_layer=streets,
-        stars_line_step=stars_line_step,
-        noise_limit=noise_limit,
-        point_interval=point_interval
+    strides - шаг точек начала лучей по типам улиц вместо origin_stride,
+    max_gap - самый длинный пропуск шума фасада, заполняемый при шаге
+    больше 1, см. core/origin_sharing.py.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    strides = origin_stride if strides is None else strides
+
+    on_stage('stars')
+    with span('stars'):
+        origins = shared_origin_points(
+            street_layer=streets,
+            noise_limit=noise_limit,
+            point_interval=point_interval,
+            strides=strides
+        )
+        coords = shapely.get_coordinates(origins.geometry.values)
+        distance_normal = origins['noise_distance'].to_numpy()
+        fan_origin, fan_angle = origin_fans(coords, distance_normal,
+                                            buildings, star_mode)
+        noise_stars = make_noise_stars_fans(
+            origins=coords,
+            distance_normal=distance_normal,
+            start_noise=origins['noise'].to_numpy(),
+            fan_origin=fan_origin,
+            fan_angle=fan_angle,
+            crs=streets.crs
+        )
+
+    intersect_noise_lines, intersect_buildings, non_intersect = (
+        _intersect(noise_stars, buildings, on_stage)
+    )
+    building_segments = _segment_buildings(intersect_buildings, on_stage)
+    noise_lines, noise_barriers = _reflect(
+        intersect_noise_lines, non_intersect, building_segments, on_stage
     )
+    if (street_strides(streets, strides) > 1).any():
+        noise_barriers = fill_facade_gaps(noise_barriers, building_segments,
+                                          max_gap)
+    _count_coverage(facade_keys(noise_barriers), building_segments)
+    return noise_lines, noise_barriers
+
 
+def create_noise_stream(
+        streets: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        block_origins: int = stream_block_origins,
+        on_stage: Callable[[str], None] = None,
+        strides: Optional[Dict[str, int]] = None,
+        max_gap: int = facade_gap_segments
+) -> Iterator[Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]]:
+    """create_noise по блокам из block_origins точек начала лучей.
 
+    Звёзды, пересечения и отражения считаются для одного блока, и его
+    линии и шум фасадов отдаются до начала следующего, поэтому память
+    зависит от размера блока, а не от длины улицы. Сегменты фасадов
+    строятся один раз для всех зданий, в которые попадает хоть один луч
+    улицы, поэтому вместе блоки дают те же линии и тот же шум фасадов,
+    что и create_noise (фасады блоков нужно сводить максимумом). strides и
+    max_gap - как у create_noise; пропуски фасадов заполняются один раз
+    по шуму всех блоков, и последний блок отдаёт его целиком.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    strides = origin_stride if strides is None else strides
+    with span('stars'):
+        origins = shared_origin_points(
+            street_layer=streets,
+            noise_limit=noise_limit,
+            point_interval=point_interval,
+            strides=strides
+        )
+        coords = shapely.get_coordinates(origins.geometry.values)
+        distance_normal = origins['noise_distance'].to_numpy()
+        fan_origin, fan_angle = origin_fans(coords, distance_normal,
+                                            buildings, star_mode)
+
+    on_stage('intersections')
+    with span('intersections'):
+        hit_buildings = fan_buildings(coords, distance_normal, fan_origin,
+                                      fan_angle, buildings)
+    building_segments = _segment_buildings(hit_buildings, on_stage)
+
+    sharing = (street_strides(streets, strides) > 1).any()
+    hit_facades, block_barriers = [], []
+    for start in range(0, len(origins), block_origins):
+        block = slice(start, start + block_origins)
+        fans = slice(*np.searchsorted(fan_origin, [start,
+                                                   start + block_origins]))
+        on_stage('stars')
+        with span('stars'):
+            noise_stars = make_noise_stars_fans(
+                origins=coords[block],
+                distance_normal=distance_normal[block],
+                start_noise=origins['noise'].to_numpy()[block],
+                fan_origin=fan_origin[fans] - start,
+                fan_angle=fan_angle[fans],
+                crs=streets.crs
+            )
+        intersect_noise_lines, _, non_intersect = _intersect(
+            noise_stars, buildings, on_stage
+        )
+        noise_lines, noise_barriers = _reflect(
+            intersect_noise_lines, non_intersect, building_segments, on_stage
+        )
+        if sharing:
+            # Пропуск может проходить через границу блоков, поэтому
+            # заполняется по шуму всех блоков, когда посчитан последний
+            block_barriers.append(noise_barriers)
+            if start + block_origins >= len(origins):
+                noise_barriers = fill_facade_gaps(
+                    merge_barrier_noise(block_barriers), building_segments,
+                    max_gap
+                )
+        hit_facades.append(facade_keys(noise_barriers))
+        yield noise_lines, noise_barriers
+    _count_coverage(np.unique(np.concatenate(hit_facades or [[]])),
+                    building_segments)
+
+
+def noise_blocks(
+        streets: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None] = None
+) -> Iterator[Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]]:
+    """Результаты пачки улиц одним блоком или блоками create_noise_stream.
+
+    С кэшем результатов улицы считаются целиком.
+    """
+    if stream_block_origins is None or get_result_cache() is not None:
+        yield create_noise_cached(streets, buildings, on_stage=on_stage)
+        return
+    yield from create_noise_stream(streets, buildings, on_stage=on_stage)
+
+
+def _intersect(
+        noise_stars: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None]
+):
+    rays_count = len(noise_stars)
+    RAYS_GENERATED.inc(rays_count)
+    building_max_level = buildings[building_level_column].max()
     noise_stars = noise_stars[noise_stars[noise_level_column] /
                               3 <= building_max_level]
 
-    start = time.time()
-    print('начинаю искать пересечения', len(noise_stars), len(buildings))
-
-    intersect_noise_lines = gpd.sjoin(
-        noise_stars,
-        buildings,
-        how="inner",
-        predicate='intersects'
-    )
+    on_stage('intersections')
+    with span('intersections'):
+        intersect_noise_lines, intersect_buildings, non_intersect = (
+            intersect_stars(noise_stars, buildings)
+        )
+    RAYS_CULLED.inc(rays_count - len(intersect_noise_lines))
+    return intersect_noise_lines, intersect_buildings, non_intersect
 
-    intersect_buildings = gpd.sjoin(
-        buildings,
-        noise_stars,
-        how="inner",
-        predicate='intersects'
-    ).drop_duplicates(subset=geometry_column)
 
-    end = time.time()
-    print('закончил за ', end - start)
+def _segment_buildings(
+        buildings: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None]
+) -> gpd.GeoDataFrame:
+    on_stage('segmentation')
+    with span('segmentation'):
+        if facade_segment_source == 'store':
+            building_segments = load_facade_segments(buildings)
+        else:
+            building_segments = polygons_to_segments(buildings)
+    if reflection_engine == 'legacy':
+        on_stage('floor expansion')
+        # Старый движок сравнивает этаж луча с этажом барьера, поэтому ему
+        # нужна копия каждого сегмента на каждый этаж; wavefront хранит
+        # сегмент один раз вместе с числом этажей
+        with span('floor_expansion'):
+            building_segments = segmentation_of_barrier_by_floors(
+                building_segments
+            )
+    return building_segments
 
-    intersect_noise_lines = intersect_noise_lines[
-        (intersect_noise_lines[noise_level_column] / 3).astype(int) <=
-        intersect_noise_lines[building_level_column]
-        ].drop_duplicates(subset=geometry_column)
 
-    non_intersect = noise_stars[
-        ~noise_stars.index.isin(intersect_noise_lines.index)
-    ]
+def _count_coverage(hit_facades: np.ndarray, building_segments):
+    FACADE_SEGMENTS_HIT.inc(len(hit_facades))
+    FACADE_SEGMENTS.inc(len(facade_keys(building_segments)))
 
-    building_segments = polygons_to_segments(intersect_buildings)
-    building_segments = segmentation_of_barrier_by_floors(building_segments)
 
-    noise_lines, noise_barriers = make_noise_reflection(
-        noize=intersect_noise_lines,
-        barriers=building_segments
-    )
+def _reflect(
+        intersect_noise_lines: gpd.GeoDataFrame,
+        non_intersect: gpd.GeoDataFrame,
+        building_segments: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None]
+):
+    on_stage('reflection')
+    with span('reflection'):
+        noise_lines, noise_barriers = reflection_engines[reflection_engine](
+            noize=intersect_noise_lines,
+            barriers=building_segments
+        )
+    BARRIER_HITS.inc(len(noise_barriers))
     noise_lines = gpd.GeoDataFrame(
         pd.concat([non_intersect, noise_lines], ignore_index=True),
-        crs=noise_stars.crs
+        crs=non_intersect.crs
     )
-
-    end_time = time.time()
-    execution_time = end_time - start_time
-    print(f"Время выполнения: {execution_time} секунд")
     return noise_lines, noise_barriers
 
 
-def save_to_postgis(gdf: gpd.GeoDataFrame, name):
+def create_noise_cached(
+        streets: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None] = None
+):
+    """create_noise через кэш результатов, если он включён.
+
+    С кэшем каждая улица считается отдельно на зданиях в пределах её
+    дальности шума, а результаты улиц пачки объединяются.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return create_noise(streets, buildings, on_stage=on_stage)
+    lines, barriers = [], []
+    for i in range(len(streets)):
+        street = streets.iloc[[i]]
+        key = street_cache_key(street.iloc[0], buildings)
+        with span('result_cache_read'):
+            cached = cache.get(key)
+        if cached is not None:
+            RESULT_CACHE_HITS.inc()
+        else:
+            RESULT_CACHE_MISSES.inc()
+            cached = create_noise(
+                street, buildings_in_reach(street.iloc[0], buildings),
+                on_stage=on_stage
+            )
+            with span('result_cache_write'):
+                cache.put(key, *cached)
+        lines.append(cached[0])
+        barriers.append(cached[1])
+    noise_lines = gpd.GeoDataFrame(
+        pd.concat(lines, ignore_index=True), crs=streets.crs
+    )
+    return noise_lines, merge_barrier_noise(barriers)
+
+
+def save_to_postgis(gdf: gpd.GeoDataFrame, name, con=engine):
+    if output_writer == 'copy':
+        copy_to_postgis(gdf, name, con)
+        return
     gdf.to_postgis(
         name=name,
         schema=schema,
-        con=engine,
+        con=con,
         if_exists='append',
         index=True,
         dtype={geometry_column: f'GEOMETRY(LINESTRING, {base_crs})'}
     )
 
 
-def noise_maker(count_streets_update: int):
-    i = 0
-    while i != count_streets_update:
-        streets = gpd.read_postgis(
-            con=engine,
-            crs=base_crs,
-            geom_col=geometry_column,
-            sql=f'''SELECT * FROM {schema}.{street_table_name} WHERE "highway" 
-            IN ('living_street', 'trunk', 'trunk_link', 'primary', 
-            'primary_link', 'secondary', 'secondary_link', 'tertiary', 
-            'tertiary_link', 'unclassified', 'residential') 
-            AND finished is not True ORDER BY id ASC LIMIT 1'''
-            )
-        street = streets.iloc[[0]].squeeze()
-        buildings = gpd.read_postgis(
-            con=engine,
-            crs=base_crs,
-            geom_col=geometry_column,
-            sql=f'SELECT * FROM {schema}.{building_table_name}'
-            )
-        print('-----------------------------------')
-        street_id = int(street['id'])
-        print(street['name'], street_id)
-        street = gpd.GeoDataFrame(
-            [street.to_dict()],
-            crs=streets.crs,
-            geometry=geometry_column)
-
-        noise_lines, noise_barrier = create_noise(street, buildings)
+def read_streets(street_ids: List[int]) -> gpd.GeoDataFrame:
+    ids = ', '.join(str(int(street_id)) for street_id in street_ids)
+    return gpd.read_postgis(
+        con=engine,
+        crs=base_crs,
+        geom_col=geometry_column,
+        sql=f'''SELECT * FROM {schema}.{street_table_name}
+        WHERE {street_id_column} IN ({ids}) ORDER BY {street_id_column}'''
+    )
+
+
+def street_blocks(
+        streets: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        on_stage: Callable[[str], None] = None
+) -> Iterator[Tuple[int, gpd.GeoDataFrame, gpd.GeoDataFrame]]:
+    """noise_blocks каждой улицы пачки по отдельности.
+
+    Отдаёт id улицы, лучи и шум фасадов каждого блока. Улицы считаются по
+    одной, как с кэшем результатов, чтобы при пересчёте улицы можно было
+    заменить именно её результаты.
+    """
+    for i in range(len(streets)):
+        street = streets.iloc[[i]]
+        street_id = int(street[street_id_column].iloc[0])
+        for noise_lines, noise_barriers in noise_blocks(street, buildings,
+                                                        on_stage=on_stage):
+            yield street_id, noise_lines, noise_barriers
+
+
+def save_noise_lines(
+        noise_lines: gpd.GeoDataFrame,
+        street_id: int,
+        connection,
+        part: int = 0
+):
+    """Сохраняет лучи одной улицы в формате noise_lines_format.
+
+    part - номер блока create_noise_stream, у каждого блока свой каталог
+    parquet. Прежние лучи улицы удаляет delete_noise_lines.
+    """
+    if noise_lines_format == 'linestring':
         noise_lines = gpd.GeoDataFrame(
-            noise_lines[['level', 'angle', 'start_noise']],
+            noise_lines[['level', 'angle', 'start_noise']].assign(
+                street_id=street_id
+            ),
             geometry=noise_lines.geometry,
             crs=noise_lines.crs
         )
-        save_to_postgis(noise_lines, noise_lines_table_name)
-        save_to_postgis(noise_barrier, barrier_noise_table_name)
-        mark_a_street_as_processed(street_id)
-        delete_duplicates_barriers()
-        print('-----------------------------------')
-        i += 1
+        save_to_postgis(noise_lines, noise_lines_table_name, connection)
+        return
+    rays = encode_rays(noise_lines)
+    if noise_lines_format == 'compact':
+        copy_compact_rays(rays, connection, street_id=street_id)
+    elif noise_lines_format == 'parquet':
+        name = _street_rays_dir(street_id)
+        if part:
+            name = f'{name}_part{part}'
+        write_rays_parquet(rays, os.path.join(compact_rays_dir, name))
+    else:
+        raise ValueError(f'Неизвестный формат лучей {noise_lines_format}')
+
+
+def delete_noise_lines(street_ids: List[int], connection):
+    """Удаляет лучи улиц, сохранённые их прошлым расчётом"""
+    if noise_lines_format == 'linestring':
+        delete_street_noise_lines(connection, street_ids)
+    elif noise_lines_format == 'compact':
+        delete_street_compact_rays(connection, street_ids)
+    elif noise_lines_format == 'parquet':
+        for street_id in street_ids:
+            name = os.path.join(compact_rays_dir, _street_rays_dir(street_id))
+            for directory in glob.glob(name) + glob.glob(f'{name}_part*'):
+                shutil.rmtree(directory)
+
+
+def _street_rays_dir(street_id: int) -> str:
+    return f'street_{int(street_id)}'
+
+
+def process_streets(street_ids: List[int], worker_id: str, job: NoiseJob):
+    """Считает и сохраняет одну пачку забранных улиц.
+
+    Прежние лучи, шум фасадов и вклад в растр каждой улицы заменяются
+    новыми, так что улицу, возвращённую в очередь mark_streets_dirty,
+    можно просто посчитать заново.
+    """
+    with span('read_streets'):
+        streets = read_streets(street_ids)
+    print('-----------------------------------')
+    print(', '.join(map(str, streets['name'])), street_ids)
+    job.report(stage='load buildings')
+    with span('load_buildings'):
+        buildings = load_buildings_near(streets)
+
+    street_barriers = {street_id: [] for street_id in street_ids}
+    street_cells = {street_id: [] for street_id in street_ids}
+    parts = dict.fromkeys(street_ids, 0)
+    with ExitStack() as stack:
+        connection = None
+
+        def begin():
+            # Транзакция открывается после первого блока: без потоковой
+            # обработки расчёт идёт вне её, как раньше
+            connection = stack.enter_context(engine.begin())
+            if output_mode in ('lines', 'both'):
+                with span('write_noise_lines'):
+                    delete_noise_lines(street_ids, connection)
+            return connection
+
+        for street_id, noise_lines, block_barrier in street_blocks(
+                streets, buildings, on_stage=lambda stage: job.report(stage)
+        ):
+            job.report(stage='save')
+            street_barriers[street_id].append(block_barrier)
+            if output_mode in ('grid', 'both'):
+                with span('rasterize'):
+                    street_cells[street_id].append(
+                        rasterize_noise_lines(noise_lines)
+                    )
+            if connection is None:
+                connection = begin()
+            if output_mode in ('lines', 'both'):
+                with span('write_noise_lines'):
+                    save_noise_lines(noise_lines, street_id, connection,
+                                     parts[street_id])
+            parts[street_id] += 1
+        if connection is None:
+            connection = begin()
+        with span('replace_street_barrier_noise'):
+            replace_street_barrier_noise(
+                street_barrier_noise(street_barriers), street_ids, connection
+            )
+        mark_streets_as_processed(connection, street_ids, worker_id)
+    if output_mode in ('grid', 'both'):
+        # Растр пишется после фиксации транзакции: если она откатится,
+        # растр не изменится, а новый вклад улицы заменяет прежний
+        with span('write_grid'):
+            for street_id, cells in street_cells.items():
+                merge_into_grid(max_per_cell(cells), grid_key([street_id]))
+    print('-----------------------------------')
+
+
+def street_barrier_noise(
+        street_barriers: Dict[int, List[gpd.GeoDataFrame]]
+) -> gpd.GeoDataFrame:
+    """Шум фасадов блоков, сведённый по улицам, с колонкой street_id"""
+    frames = [
+        merge_barrier_noise(frames).assign(street_id=street_id)
+        for street_id, frames in street_barriers.items()
+    ]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return merge_barrier_noise([]).assign(street_id=0).iloc[:0]
+    return gpd.GeoDataFrame(
+        pd.concat(frames, ignore_index=True),
+        geometry=geometry_column, crs=frames[0].crs
+    )
+
+
+def noise_maker(
+        count_streets_update: int,
+        batch_size: int = street_batch_size,
+        job: Optional[NoiseJob] = None
+):
+    """Обрабатывает улицы из общей очереди.
+
+    Несколько обработчиков могут работать с одной базой одновременно:
+    каждый забирает свою пачку улиц, считает её улицы по одной и
+    сохраняет результаты вместе с отметкой finished в одной транзакции.
+    Пачка, аренду которой сняла mark_streets_dirty, откатывается и
+    пропускается: её улицы заберутся заново. Если передан job, в него
+    пишется прогресс, а отмена проверяется между пачками улиц.
+    """
+    job = job or NoiseJob(id='local', count_streets=count_streets_update)
+    ensure_street_queue_columns()
+    ensure_barrier_noise_key()
+    if noise_lines_format == 'compact':
+        ensure_compact_ray_tables()
+    elif noise_lines_format == 'linestring':
+        ensure_noise_lines_street_id()
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    i = 0
+    while i < count_streets_update:
+        if job.cancelled:
+            print('обработка отменена')
+            break
+        job.report(stage='claim')
+        street_ids = claim_streets(
+            batch_size=min(batch_size, count_streets_update - i),
+            worker_id=worker_id,
+            lease_seconds=street_lease_seconds
+        )
+        if not street_ids:
+            print('необработанных улиц не осталось')
+            break
+        try:
+            with street_metrics(street_ids):
+                process_streets(street_ids, worker_id, job)
+        except LeaseLostError as error:
+            # Улицы вернули в очередь, пока они считались: результаты
+            # откачены, улицы заберёт следующая пачка
+            print(error)
+            continue
+        STREETS_PROCESSED.inc(len(street_ids))
+        i += len(street_ids)
+        job.report(streets_done=i)
         print(f'готово {i} из {count_streets_update}')
     print('готово')
 
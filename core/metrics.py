@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import metrics_json_dir
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Метрики текущей пачки улиц, см. street_metrics
+_street_record: ContextVar[Optional[dict]] = ContextVar(
+    'street_record', default=None
+)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: str):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+        record = _street_record.get()
+        if record is not None:
+            counters = record['counters']
+            counters[self.name] = counters.get(self.name, 0) + value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self.values)
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} counter',
+            *(f'{self.name}{_format_labels(key)} {_format_value(value)}'
+              for key, value in sorted(values.items()))
+        ]
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds"""
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            buckets: Sequence[float]
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счётчики корзин, сумма, количество
+        self.values: Dict[LabelKey, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            counts = [c + (value <= bound)
+                      for c, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self.values)
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram'
+        ]
+        for key, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                bucket_key = key + (('le', _format_value(bound)),)
+                lines.append(f'{self.name}_bucket'
+                             f'{_format_labels(bucket_key)} {bucket_count}')
+            lines.append(f'{self.name}_bucket'
+                         f'{_format_labels(key + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} '
+                         f'{_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of this process in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            buckets: Sequence[float]
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Метрика {metric.name} уже есть')
+        self.metrics[metric.name] = metric
+        return metric
+
+
+registry = MetricsRegistry()
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800,
+                   3600, 7200)
+
+STAGE_SECONDS = registry.histogram(
+    'noise_stage_seconds', 'Duration of noise pipeline stages',
+    SECONDS_BUCKETS
+)
+STREET_SECONDS = registry.histogram(
+    'noise_street_batch_seconds', 'Duration of one claimed street batch',
+    SECONDS_BUCKETS
+)
+STREETS_PROCESSED = registry.counter(
+    'noise_streets_processed_total', 'Streets saved and marked finished'
+)
+RAYS_GENERATED = registry.counter(
+    'noise_rays_generated_total', 'Rays of the noise stars'
+)
+RAYS_CULLED = registry.counter(
+    'noise_rays_culled_total',
+    'Rays not traced: above the highest building or hitting no building'
+)
+BOUNCES = registry.counter(
+    'noise_bounces_total', 'Reflections of rays off facade segments'
+)
+BARRIER_HITS = registry.counter(
+    'noise_barrier_hits_total', 'Facade segment and floor rows with noise'
+)
+FACADE_SEGMENTS = registry.counter(
+    'noise_facade_segments_total',
+    'Facade segments of the buildings hit by rays'
+)
+FACADE_SEGMENTS_HIT = registry.counter(
+    'noise_facade_segments_hit_total',
+    'Facade segments that received noise; ratio to the total is coverage'
+)
+RESULT_CACHE_HITS = registry.counter(
+    'noise_result_cache_hits_total', 'Streets taken from the result cache'
+)
+RESULT_CACHE_MISSES = registry.counter(
+    'noise_result_cache_misses_total', 'Streets computed and cached'
+)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage into noise_stage_seconds.
+
+    Inside street_metrics the duration is also added to the street record.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=stage)
+        record = _street_record.get()
+        if record is not None:
+            spans = record['spans']
+            spans[stage] = spans.get(stage, 0) + duration
+
+
+@contextmanager
+def street_metrics(
+        street_ids: Sequence[int],
+        directory: Optional[str] = metrics_json_dir
+) -> Iterator[dict]:
+    """Collect the spans and counters of one street batch.
+
+    The batch duration goes into noise_street_batch_seconds; if directory
+    is set, the record is also written there as a JSON file.
+    """
+    record = {
+        'street_ids': [int(street_id) for street_id in street_ids],
+        'started_at': time.time(),
+        'spans': {},
+        'counters': {}
+    }
+    token = _street_record.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _street_record.reset(token)
+        record['seconds'] = time.perf_counter() - start
+        STREET_SECONDS.observe(record['seconds'])
+        if directory:
+            write_street_record(record, directory)
+
+
+def write_street_record(record: dict, directory: str):
+    os.makedirs(directory, exist_ok=True)
+    name = '_'.join(map(str, record['street_ids'][:5]))
+    path = os.path.join(
+        directory, f'street_{name}_{int(record["started_at"] * 1000)}.json'
+    )
+    with open(path, 'w') as file:
+        json.dump(record, file, indent=2)
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    escaped = (
+        (name, value.replace('\\', r'\\').replace('"', r'\"')
+         .replace('\n', r'\n'))
+        for name, value in key
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
@@ -0,0 +1,330 @@
+import os
+import glob
+import shapely
+import numpy as np
+import pandas as pd
+from geopandas import GeoDataFrame
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from core.length_model import segment_lengths
+from config import (
+    grid_dir,
+    noise_limit,
+    grid_cell_size,
+    grid_tile_cells,
+    noise_level_column,
+    grid_floors_per_band
+)
+
+# Растр хранится тайлами grid_tile_cells x grid_tile_cells ячеек по полосам
+# этажей: в каждом файле band{полоса}_{i}_{j}.npz массив energy[x, y] с
+# суммой энергий 10 ** (L / 10) всех улиц и массив count[x, y] с числом
+# вкладов в ячейку, ячейка (ix, iy) покрывает
+# [ix * grid_cell_size, (ix + 1) * grid_cell_size) по x, так же по y.
+# Вклад каждой пачки улиц лежит отдельно в
+# contributions/band{полоса}_{i}_{j}/{ключ}.npz: новый вклад пачки
+# прибавляется к тайлу вместо прежнего, поэтому повторная запись той же
+# пачки тайл не меняет
+
+GRID_COLUMNS = ['band', 'ix', 'iy', 'noise_level']
+# Сколько точек лучей обрабатывается за раз при растеризации
+RASTER_CHUNK_SAMPLES = 2_000_000
+
+
+def rasterize_noise_lines(
+        noise_lines: GeoDataFrame,
+        cell_size: float = grid_cell_size,
+        floors_per_band: int = grid_floors_per_band
+) -> pd.DataFrame:
+    """Noise of one street's rays in grid cells.
+
+    Every ray is sampled each half cell along its path while it is louder
+    than noise_limit; the level at a sample follows the reflection formula
+    start_noise - 10 * log10(sqrt(path ** 2 + level ** 2)) with path
+    lengths from length_model. Rays of one street overlap by construction,
+    so a cell keeps the maximum of its samples, not the sum. Returns one
+    row per band and cell: band, ix, iy, noise_level.
+    """
+    lines = np.asarray(noise_lines.geometry.values)
+    if not len(lines):
+        return pd.DataFrame(columns=GRID_COLUMNS)
+    levels = noise_lines[noise_level_column].to_numpy(dtype=float)
+    start_noise = noise_lines['start_noise'].to_numpy(dtype=float)
+
+    coords, coord_line = shapely.get_coordinates(lines, return_index=True)
+    first = np.flatnonzero(coord_line[:-1] == coord_line[1:])
+    if not len(first):
+        return pd.DataFrame(columns=GRID_COLUMNS)
+    segments = RaySegments(
+        line=coord_line[first],
+        start=coords[first],
+        end=coords[first + 1]
+    )
+    # Дальше этой длины пути луч тише noise_limit
+    reach = np.sqrt(np.maximum(
+        10 ** ((start_noise - noise_limit) / 5) - levels ** 2, 0
+    ))
+    audible = np.clip(reach[segments.line] - segments.path_before, 0,
+                      segments.length)
+    step = cell_size / 2
+    samples = np.ceil(audible / segments.scale / step).astype(np.int64)
+
+    cells = []
+    ends = np.cumsum(samples)
+    bounds = np.searchsorted(
+        ends, np.arange(RASTER_CHUNK_SAMPLES, ends[-1],
+                        RASTER_CHUNK_SAMPLES), side='right'
+    )
+    for chunk in np.split(np.arange(len(samples)), bounds):
+        if not samples[chunk].sum():
+            continue
+        seg = np.repeat(chunk, samples[chunk])
+        first_sample = np.cumsum(samples[chunk]) - samples[chunk]
+        offset = (np.arange(len(seg)) -
+                  np.repeat(first_sample, samples[chunk]) + 0.5) * step
+        offset = np.minimum(offset, segments.planar[seg])
+        points = segments.start[seg] + (
+            segments.direction[seg] * offset[:, None]
+        )
+        line = segments.line[seg]
+        path = segments.path_before[seg] + offset * segments.scale[seg]
+        with np.errstate(divide='ignore'):
+            noise = start_noise[line] - 10 * np.log10(
+                np.hypot(path, levels[line])
+            )
+        loud = noise >= noise_limit
+        cells.append(_max_per_cell(pd.DataFrame({
+            'band': (levels[line[loud]] // 3 // floors_per_band).astype(
+                np.int64),
+            'ix': np.floor(points[loud, 0] / cell_size).astype(np.int64),
+            'iy': np.floor(points[loud, 1] / cell_size).astype(np.int64),
+            'noise_level': noise[loud]
+        })))
+    if not cells:
+        return pd.DataFrame(columns=GRID_COLUMNS)
+    return _max_per_cell(pd.concat(cells, ignore_index=True))
+
+
+class RaySegments:
+    """Straight pieces of ray polylines with their path lengths"""
+
+    def __init__(self, line: np.ndarray, start: np.ndarray, end: np.ndarray):
+        self.line = line
+        self.start = start
+        self.planar = np.hypot(*(end - start).T)
+        self.direction = np.divide(
+            end - start, self.planar[:, None],
+            out=np.zeros_like(start), where=self.planar[:, None] > 0
+        )
+        self.length = segment_lengths(start, end)
+        self.scale = np.divide(self.length, self.planar,
+                               out=np.ones(len(line)), where=self.planar > 0)
+        # Длина пути от начала луча до начала отрезка
+        before = np.cumsum(self.length) - self.length
+        first = np.ones(len(line), dtype=bool)
+        first[1:] = line[1:] != line[:-1]
+        line_start = np.maximum.accumulate(
+            np.where(first, np.arange(len(line)), 0)
+        )
+        self.path_before = before - before[line_start]
+
+
+def merge_into_grid(
+        cells: pd.DataFrame,
+        key: str,
+        directory: str = grid_dir,
+        tile_cells: int = grid_tile_cells
+):
+    """Put one street batch's cells into the stored grid.
+
+    The cells replace whatever was merged before under the same key: the
+    energy of the previous contribution is taken out of every touched
+    tile and the new one added, so merging a batch again leaves the grid
+    unchanged and a merge costs the same however many streets the tile
+    already holds.
+    noise_maker merges once per claimed batch after its transaction
+    commits; with street_batch_size above 1 the streets of one batch
+    combine by maximum, not by sum.
+    """
+    cells = cells.assign(
+        ti=cells['ix'] // tile_cells,
+        tj=cells['iy'] // tile_cells,
+        energy=10 ** (cells['noise_level'].astype(float) / 10)
+    )
+    tiles = {
+        (int(band), int(ti), int(tj)): tile
+        for (band, ti, tj), tile in cells.groupby(['band', 'ti', 'tj'])
+    }
+    previous = glob.glob(os.path.join(
+        _contributions_dir(directory), '*', f'{key}.npz'
+    ))
+    for path in previous:
+        band, ti, tj = os.path.basename(os.path.dirname(path))[4:].split('_')
+        tiles.setdefault((int(band), int(ti), int(tj)), None)
+
+    for (band, ti, tj), tile in sorted(tiles.items(), key=lambda t: t[0]):
+        with _locked_tile(directory, band, ti, tj) as path:
+            contributions = _tile_contributions(directory, band, ti, tj)
+            contribution = os.path.join(contributions, f'{key}.npz')
+            old = _read_contribution(contribution)
+            new = None if tile is None else {
+                'ix': (tile['ix'].to_numpy() - ti * tile_cells).astype(
+                    np.int32),
+                'iy': (tile['iy'].to_numpy() - tj * tile_cells).astype(
+                    np.int32),
+                'energy': tile['energy'].to_numpy(dtype=float)
+            }
+            if _same_contribution(old, new):
+                continue
+            _update_tile(path, old, new, tile_cells)
+            if new is None:
+                os.remove(contribution)
+            else:
+                os.makedirs(contributions, exist_ok=True)
+                _write_npz(contribution, **new)
+
+
+def read_noise_grid(
+        bounds: Tuple[float, float, float, float],
+        band: int,
+        directory: str = grid_dir,
+        cell_size: float = grid_cell_size,
+        tile_cells: int = grid_tile_cells
+) -> Tuple[np.ndarray, Tuple[float, float]]:
+    """Noise map of one floor band over a bounding box.
+
+    Returns the levels in dB indexed [x, y] (NaN where no ray reached) and
+    the coordinates of the lower left corner of the first cell.
+    """
+    ix0, iy0, ix1, iy1 = (int(np.floor(value / cell_size))
+                          for value in bounds)
+    energy = np.zeros((ix1 - ix0 + 1, iy1 - iy0 + 1))
+    for ti in range(ix0 // tile_cells, ix1 // tile_cells + 1):
+        for tj in range(iy0 // tile_cells, iy1 // tile_cells + 1):
+            path = _tile_path(directory, band, ti, tj)
+            if not os.path.exists(path):
+                continue
+            tile = _read_tile(path, tile_cells)
+            x0, y0 = ti * tile_cells, tj * tile_cells
+            xs = slice(max(ix0, x0), min(ix1, x0 + tile_cells - 1) + 1)
+            ys = slice(max(iy0, y0), min(iy1, y0 + tile_cells - 1) + 1)
+            energy[xs.start - ix0:xs.stop - ix0,
+                   ys.start - iy0:ys.stop - iy0] = tile[
+                xs.start - x0:xs.stop - x0, ys.start - y0:ys.stop - y0]
+    with np.errstate(divide='ignore'):
+        noise = np.where(energy > 0, 10 * np.log10(energy), np.nan)
+    return noise, (ix0 * cell_size, iy0 * cell_size)
+
+
+def grid_key(street_ids: List[int]) -> str:
+    """Key of the grid contribution of one street batch"""
+    return 'streets_' + '_'.join(map(str, street_ids))
+
+
+def max_per_cell(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Cells of several blocks of one street batch, the maximum per cell"""
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=GRID_COLUMNS)
+    return _max_per_cell(pd.concat(frames, ignore_index=True))
+
+
+def _max_per_cell(cells: pd.DataFrame) -> pd.DataFrame:
+    return cells.groupby(['band', 'ix', 'iy'], as_index=False)[
+        'noise_level'].max()
+
+
+def _tile_path(directory: str, band: int, ti: int, tj: int) -> str:
+    return os.path.join(
+        directory, f'band{int(band)}_{int(ti)}_{int(tj)}.npz'
+    )
+
+
+def _contributions_dir(directory: str) -> str:
+    return os.path.join(directory, 'contributions')
+
+
+def _tile_contributions(directory: str, band: int, ti: int, tj: int) -> str:
+    return os.path.join(_contributions_dir(directory),
+                        f'band{int(band)}_{int(ti)}_{int(tj)}')
+
+
+def _read_contribution(path: str) -> Optional[Dict[str, np.ndarray]]:
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as contribution:
+        return {name: contribution[name] for name in ('ix', 'iy', 'energy')}
+
+
+def _same_contribution(
+        old: Optional[Dict[str, np.ndarray]],
+        new: Optional[Dict[str, np.ndarray]]
+) -> bool:
+    if old is None or new is None:
+        return old is new
+    return all(np.array_equal(old[name], new[name]) for name in old)
+
+
+def _update_tile(
+        path: str,
+        old: Optional[Dict[str, np.ndarray]],
+        new: Optional[Dict[str, np.ndarray]],
+        tile_cells: int
+):
+    # Вместо прежнего вклада в тайл входит новый; без вкладов файла нет
+    energy, count = _read_tile_state(path, tile_cells)
+    for contribution, sign in ((old, -1), (new, 1)):
+        if contribution is None:
+            continue
+        cells = (contribution['ix'], contribution['iy'])
+        np.add.at(energy, cells, sign * contribution['energy'])
+        np.add.at(count, cells, sign)
+    if not count.any():
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    # Ячейка без вкладов тиха точно, а не с остатком округления
+    energy[count == 0] = 0
+    _write_npz(path, energy=np.maximum(energy, 0), count=count)
+
+
+@contextmanager
+def _locked_tile(
+        directory: str,
+        band: int,
+        ti: int,
+        tj: int
+) -> Iterator[str]:
+    # Несколько обработчиков могут дописывать один тайл одновременно;
+    # fcntl есть только на POSIX, без него модуль всё равно импортируется
+    import fcntl
+    os.makedirs(directory, exist_ok=True)
+    path = _tile_path(directory, band, ti, tj)
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield path
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_tile(path: str, tile_cells: int) -> np.ndarray:
+    return _read_tile_state(path, tile_cells)[0]
+
+
+def _read_tile_state(
+        path: str,
+        tile_cells: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    if not os.path.exists(path):
+        return (np.zeros((tile_cells, tile_cells)),
+                np.zeros((tile_cells, tile_cells), dtype=np.int32))
+    with np.load(path) as tile:
+        return tile['energy'].astype(float), tile['count'].astype(np.int32)
+
+
+def _write_npz(path: str, **arrays: np.ndarray):
+    temporary = f'{path}.tmp.npz'
+    np.savez_compressed(temporary, **arrays)
+    os.replace(temporary, path)
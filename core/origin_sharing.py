@@ -0,0 +1,288 @@
+"""Общие лучи соседних точек улицы.
+
+Соседние точки начала лучей улицы стоят через point_interval метров и
+дают почти одинаковые звёзды. Для типов улиц из origin_stride лучи
+трассируются только из каждой origin_stride[highway] точки (и из
+последней точки улицы), а шум фасадов, пропущенных из-за более редких
+точек, восстанавливается интерполяцией вдоль контура здания между
+задетыми соседними сегментами (fill_facade_gaps).
+
+Ошибку такого расчёта относительно полного по типам улиц даёт
+sharing_report; по выборке улиц из базы:
+    python -m core.origin_sharing --streets 20 --strides 2 3 4
+"""
+import sys
+import time
+import argparse
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from typing import Dict, List, Optional, Sequence
+
+from core.stars_maker import make_origin_points
+from config import (
+    schema,
+    base_crs,
+    origin_stride,
+    geometry_column,
+    street_id_column,
+    street_table_name,
+    facade_gap_segments,
+    street_highway_types,
+    building_level_column,
+    barrier_noise_level_column
+)
+
+HIGHWAY_COLUMN = 'highway'
+
+
+def street_strides(
+        streets: gpd.GeoDataFrame,
+        strides: Dict[str, int] = origin_stride
+) -> np.ndarray:
+    """Origin stride of every street by its highway type, 1 if not set"""
+    if HIGHWAY_COLUMN not in streets.columns or not strides:
+        return np.ones(len(streets), dtype=np.int64)
+    stride = streets[HIGHWAY_COLUMN].map(strides).fillna(1)
+    if (stride < 1).any():
+        raise ValueError('origin_stride должен быть не меньше 1')
+    return stride.to_numpy(dtype=np.int64)
+
+
+def shared_origin_points(
+        street_layer: gpd.GeoDataFrame,
+        noise_limit: int,
+        point_interval: int,
+        strides: Dict[str, int] = origin_stride
+) -> gpd.GeoDataFrame:
+    """make_origin_points keeping every stride-th origin of each street.
+
+    The first and the last origin of a street are always kept, so the
+    street ends are covered as with the full set of origins.
+    """
+    origins = make_origin_points(
+        street_layer=street_layer,
+        noise_limit=noise_limit,
+        point_interval=point_interval
+    )
+    stride = street_strides(street_layer, strides)
+    if (stride == 1).all():
+        return origins
+    if street_id_column in street_layer.columns:
+        street_ids = street_layer[street_id_column].to_numpy()
+    else:
+        street_ids = street_layer.index.to_numpy()
+    origin_step = pd.Series(stride, index=street_ids).reindex(
+        origins[street_id_column]
+    ).to_numpy()
+    street = origins.groupby(street_id_column, sort=False)
+    position = street.cumcount().to_numpy()
+    last = position == street[street_id_column].transform('size') - 1
+    return origins[(position % origin_step == 0) | last].reset_index(
+        drop=True
+    )
+
+
+def fill_facade_gaps(
+        noise_barriers: gpd.GeoDataFrame,
+        building_segments: gpd.GeoDataFrame,
+        max_gap: int = facade_gap_segments
+) -> gpd.GeoDataFrame:
+    """Facade noise with short gaps along the building outlines filled in.
+
+    A run of at most max_gap segments without noise between two segments
+    with noise on the same floor of one outline gets the noise level
+    interpolated linearly along the outline. Neighbouring segments are
+    the ones sharing an end point.
+    """
+    if noise_barriers.empty or max_gap < 1:
+        return noise_barriers
+    segments = np.unique(
+        shapely.to_wkb(np.asarray(building_segments.geometry.values))
+    )
+    coords = shapely.get_coordinates(
+        shapely.from_wkb(segments)
+    ).reshape(-1, 2, 2)
+    following = _following_segments(coords)
+    preceding = np.full(len(segments), -1)
+    has_next = following >= 0
+    preceding[following[has_next]] = np.flatnonzero(has_next)
+
+    hit_segment = np.searchsorted(
+        segments, shapely.to_wkb(np.asarray(noise_barriers.geometry.values))
+    )
+    hits = pd.DataFrame({
+        'segment': hit_segment,
+        'floor': noise_barriers[building_level_column].to_numpy(),
+        'level': noise_barriers[barrier_noise_level_column].to_numpy()
+    }).groupby(['segment', 'floor'], as_index=False)['level'].max()
+    known = pd.MultiIndex.from_frame(hits[['segment', 'floor']])
+
+    behind = _walk(hits, following, known, max_gap)
+    ahead = _walk(hits, preceding, known, max_gap)
+    gaps = behind.merge(ahead, on=['segment', 'floor'],
+                        suffixes=('_behind', '_ahead'))
+    gaps = gaps[gaps['steps_behind'] + gaps['steps_ahead'] - 1 <= max_gap]
+    if gaps.empty:
+        return noise_barriers
+    share = gaps['steps_behind'] / (gaps['steps_behind'] +
+                                    gaps['steps_ahead'])
+    filled = gpd.GeoDataFrame({
+        geometry_column: shapely.from_wkb(segments[gaps['segment']]),
+        building_level_column: gaps['floor'].to_numpy(),
+        barrier_noise_level_column: (
+            gaps['level_behind'] +
+            (gaps['level_ahead'] - gaps['level_behind']) * share
+        ).to_numpy()
+    }, geometry=geometry_column, crs=noise_barriers.crs)
+    return gpd.GeoDataFrame(
+        pd.concat([noise_barriers, filled], ignore_index=True),
+        geometry=geometry_column, crs=noise_barriers.crs
+    )
+
+
+def sharing_error(
+        full: gpd.GeoDataFrame,
+        shared: gpd.GeoDataFrame
+) -> Dict[str, float]:
+    """Facade noise of a shared trace against the full one.
+
+    Rows are matched by segment and floor. Errors are shared minus full
+    levels, in dB, over the rows present in both results.
+    """
+    def levels(barriers):
+        return pd.Series(
+            barriers[barrier_noise_level_column].to_numpy(dtype=float),
+            index=pd.MultiIndex.from_arrays([
+                shapely.to_wkb(np.asarray(barriers.geometry.values)),
+                barriers[building_level_column].to_numpy(dtype=float)
+            ])
+        ).groupby(level=[0, 1]).max()
+
+    full_levels, shared_levels = levels(full), levels(shared)
+    common = full_levels.index.intersection(shared_levels.index)
+    error = (shared_levels[common] - full_levels[common]).to_numpy()
+    if not len(error):
+        error = np.full(1, np.nan)
+    return {
+        'rows_full': len(full_levels),
+        'rows_missing': len(full_levels.index.difference(common)),
+        'rows_extra': len(shared_levels.index.difference(common)),
+        'mean_error': float(np.mean(error)),
+        'mean_abs_error': float(np.mean(np.abs(error))),
+        'p95_abs_error': float(np.percentile(np.abs(error), 95)),
+        'max_abs_error': float(np.max(np.abs(error)))
+    }
+
+
+def sharing_report(
+        streets: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame,
+        strides: Sequence[int] = (2, 3, 4),
+        max_gap: int = facade_gap_segments
+) -> pd.DataFrame:
+    """Error and speed of every stride against the full trace by highway.
+
+    The streets of each highway type are computed together with
+    create_noise, once with every origin and once per stride; one row per
+    type and stride.
+    """
+    from core.main_noise_creator import create_noise
+
+    rows = []
+    for highway, group in streets.groupby(HIGHWAY_COLUMN, sort=True):
+        started = time.perf_counter()
+        full = create_noise(group, buildings, strides={})[1]
+        full_seconds = time.perf_counter() - started
+        for stride in strides:
+            started = time.perf_counter()
+            shared = create_noise(group, buildings,
+                                  strides={highway: stride},
+                                  max_gap=max_gap)[1]
+            rows.append({
+                HIGHWAY_COLUMN: highway,
+                'stride': stride,
+                'streets': len(group),
+                'speedup': full_seconds / (time.perf_counter() - started),
+                **sharing_error(full, shared)
+            })
+    return pd.DataFrame(rows)
+
+
+def read_sample_streets(per_type: int) -> gpd.GeoDataFrame:
+    """Up to per_type streets of every highway type, the same every run"""
+    highway_types = ', '.join(f"'{value}'" for value in street_highway_types)
+    from core.db_connect import engine
+    return gpd.read_postgis(
+        con=engine,
+        crs=base_crs,
+        geom_col=geometry_column,
+        sql=f'''SELECT * FROM (
+            SELECT *, row_number() OVER (
+                PARTITION BY "{HIGHWAY_COLUMN}"
+                ORDER BY md5({street_id_column}::text)
+            ) AS sample_number
+            FROM {schema}.{street_table_name}
+            WHERE "{HIGHWAY_COLUMN}" IN ({highway_types})
+        ) AS streets WHERE sample_number <= {int(per_type)}'''
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streets', type=int, default=20,
+                        help='улиц каждого типа в выборке')
+    parser.add_argument('--strides', type=int, nargs='+', default=[2, 3, 4],
+                        help='шаги точек для сравнения с полным расчётом')
+    parser.add_argument('--max-gap', type=int, default=facade_gap_segments,
+                        help='самый длинный заполняемый пропуск, сегментов')
+    args = parser.parse_args(argv)
+
+    from core.building_loader import load_buildings_near
+    streets = read_sample_streets(args.streets)
+    report = sharing_report(streets, load_buildings_near(streets),
+                            args.strides, args.max_gap)
+    print(report.to_string(index=False, float_format='{:.2f}'.format))
+    return 0
+
+
+def _following_segments(coords: np.ndarray) -> np.ndarray:
+    """Segment starting where each segment ends, -1 if there is none"""
+    ends = pd.DataFrame(coords[:, 1], columns=['x', 'y'])
+    starts = pd.DataFrame(coords[:, 0], columns=['x', 'y']).assign(
+        following=np.arange(len(coords))
+    ).drop_duplicates(subset=['x', 'y'])
+    return ends.merge(starts, on=['x', 'y'], how='left')[
+        'following'].fillna(-1).to_numpy(dtype=np.int64)
+
+
+def _walk(
+        hits: pd.DataFrame,
+        step: np.ndarray,
+        known: pd.MultiIndex,
+        max_gap: int
+) -> pd.DataFrame:
+    """Segments without noise reached from each hit in 1..max_gap steps"""
+    segment = hits['segment'].to_numpy()
+    floor = hits['floor'].to_numpy()
+    level = hits['level'].to_numpy()
+    reached = []
+    for steps in range(1, max_gap + 1):
+        segment = step[segment]
+        alive = segment >= 0
+        segment, floor, level = segment[alive], floor[alive], level[alive]
+        alive = ~pd.MultiIndex.from_arrays([segment, floor]).isin(known)
+        segment, floor, level = segment[alive], floor[alive], level[alive]
+        reached.append(pd.DataFrame({
+            'segment': segment, 'floor': floor, 'level': level,
+            'steps': steps
+        }))
+    # Ближайший задетый сегмент с каждой стороны
+    return pd.concat(reached, ignore_index=True).drop_duplicates(
+        subset=['segment', 'floor']
+    )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
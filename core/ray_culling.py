@@ -0,0 +1,187 @@
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from typing import Tuple
+
+from config import geometry_column, noise_level_column, building_level_column
+
+# Ближе этого (в единицах base_crs) к входу в здание конец луча проверяется
+# точным пересечением
+ENTRY_TOLERANCE = 1e-6
+
+
+def intersect_stars(
+        noise_stars: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """Split the star rays by the buildings they hit.
+
+    Returns the rays hitting a building at least as tall as the ray's floor
+    (with the attributes of the first such building, as gpd.sjoin would
+    give them), the buildings hit by any ray and the remaining rays.
+
+    All rays of one fan - one origin and angle - lie on the fan's longest
+    ray, so a single STRtree query is made with one ray per fan. A ray of
+    the fan hits a building if the building is tall enough and the ray
+    reaches the building's entry point on the fan ray; fans hitting nothing
+    drop all their rays at once. Rays are matched by position, not by
+    geometry. Of buildings with the same footprint only the first is used.
+    """
+    buildings = unique_footprints(buildings)
+    lines = np.asarray(noise_stars.geometry.values)
+    ray_floor = (
+        noise_stars[noise_level_column].to_numpy() / 3
+    ).astype(int)
+    floors = buildings[building_level_column].to_numpy(dtype=float)
+    polygons = np.asarray(buildings.geometry.values)
+    tree = shapely.STRtree(polygons)
+
+    fan, longest = star_fans(noise_stars)
+    pair_fan, pair_building = tree.query(lines[longest],
+                                         predicate='intersects')
+    entry = entry_distances(lines[longest[pair_fan]], polygons[pair_building])
+    # Этажность самого высокого здания на пути веера; NaN здания пропускаются
+    fan_top = np.full(len(longest), -np.inf)
+    np.fmax.at(fan_top, pair_fan, floors[pair_building])
+
+    # Пары (луч, здание) для лучей, которые могут во что-то попасть
+    candidates = np.flatnonzero(ray_floor <= fan_top[fan])
+    pair_count = np.bincount(pair_fan, minlength=len(longest))
+    pair_start = np.cumsum(pair_count) - pair_count
+    counts = pair_count[fan[candidates]]
+    ray = np.repeat(candidates, counts)
+    pair = np.repeat(pair_start[fan[candidates]], counts) + (
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                            counts)
+    )
+    building = pair_building[pair]
+
+    length = shapely.length(lines)
+    reach = length[ray] - entry[pair]
+    hits = (ray_floor[ray] <= floors[building]) & (reach >= 0)
+    # Луч кончается на границе здания: решает точная проверка
+    close = (np.abs(reach) <= ENTRY_TOLERANCE) & (
+        ray_floor[ray] <= floors[building]
+    )
+    hits[close] = shapely.intersects(lines[ray[close]],
+                                     polygons[building[close]])
+
+    # Пары идут по лучам, для луча - в порядке обхода дерева, как у
+    # gpd.sjoin; берётся первое подходящее здание
+    ray, building = ray[hits], building[hits]
+    first = np.ones(len(ray), dtype=bool)
+    first[1:] = ray[1:] != ray[:-1]
+    ray, building = ray[first], building[first]
+
+    hit = np.zeros(len(noise_stars), dtype=bool)
+    hit[ray] = True
+    return (
+        _join_buildings(noise_stars.iloc[ray], buildings.iloc[building]),
+        buildings.iloc[np.unique(pair_building)],
+        noise_stars[~hit]
+    )
+
+
+def fan_buildings(
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        fan_origin: np.ndarray,
+        fan_angle: np.ndarray,
+        buildings: gpd.GeoDataFrame,
+        block_size: int = 1_000_000
+) -> gpd.GeoDataFrame:
+    """Buildings hit by any ray of the given fans.
+
+    Every ray lies on the ground level ray of its fan, so these are the
+    buildings intersect_stars returns for the full stars, found without
+    building them: only one ray per fan is made, block_size fans at a time.
+    """
+    buildings = unique_footprints(buildings)
+    polygons = np.asarray(buildings.geometry.values)
+    tree = shapely.STRtree(polygons)
+    hit = []
+    for start in range(0, len(fan_origin), block_size):
+        block = slice(start, start + block_size)
+        rays = ground_rays(origins, distance_normal, fan_origin[block],
+                           fan_angle[block])
+        hit.append(tree.query(rays, predicate='intersects')[1])
+    if not hit:
+        return buildings.iloc[:0]
+    return buildings.iloc[np.unique(np.concatenate(hit))]
+
+
+def unique_footprints(buildings: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Buildings without repeated geometries, the first of each kept"""
+    repeated = pd.Series(
+        shapely.to_wkb(np.asarray(buildings.geometry.values))
+    ).duplicated().to_numpy()
+    if not repeated.any():
+        return buildings
+    return buildings[~repeated]
+
+
+def ground_rays(
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        fan_origin: np.ndarray,
+        fan_angle: np.ndarray
+) -> np.ndarray:
+    """Ground level ray of every fan; None for origins without levels"""
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    distance = np.asarray(distance_normal, dtype=float)[fan_origin]
+    radians = np.radians(fan_angle)
+    coords = np.empty((len(fan_origin), 2, 2))
+    coords[:, 0] = origins[fan_origin]
+    coords[:, 1, 0] = coords[:, 0, 0] + distance * np.cos(radians)
+    coords[:, 1, 1] = coords[:, 0, 1] + distance * np.sin(radians)
+    rays = shapely.linestrings(coords)
+    # Как в make_noise_stars_fans: без уровней у точки нет и лучей
+    rays[np.trunc(distance) < 1] = None
+    return rays
+
+
+def star_fans(noise_stars: gpd.GeoDataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Fan of every ray and the position of each fan's longest ray"""
+    lines = np.asarray(noise_stars.geometry.values)
+    starts = shapely.get_coordinates(shapely.get_point(lines, 0))
+    fan = pd.DataFrame({
+        'x': starts[:, 0],
+        'y': starts[:, 1],
+        'angle': noise_stars['angle'].to_numpy()
+    }).groupby(['x', 'y', 'angle'], sort=False).ngroup().to_numpy()
+    order = np.lexsort((-shapely.length(lines), fan))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = fan[order][1:] != fan[order][:-1]
+    return fan, order[first]
+
+
+def entry_distances(rays: np.ndarray, polygons: np.ndarray) -> np.ndarray:
+    """Distance from the start of each ray to its first point in polygon"""
+    origins = shapely.get_coordinates(shapely.get_point(rays, 0))
+    coords, pair = shapely.get_coordinates(
+        shapely.intersection(rays, polygons), return_index=True
+    )
+    entry = np.full(len(rays), np.inf)
+    np.minimum.at(entry, pair, np.hypot(*(coords - origins[pair]).T))
+    return entry
+
+
+def _join_buildings(
+        rays: gpd.GeoDataFrame,
+        buildings: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
+    # Колонки как у gpd.sjoin(rays, buildings): index_right и атрибуты здания
+    attributes = pd.DataFrame(
+        buildings.drop(columns=buildings.geometry.name)
+    )
+    attributes.columns = [
+        f'{column}_right' if column in rays.columns else column
+        for column in attributes.columns
+    ]
+    attributes.insert(0, 'index_right', buildings.index)
+    attributes.index = rays.index
+    return gpd.GeoDataFrame(
+        pd.concat([rays, attributes], axis=1),
+        geometry=geometry_column, crs=rays.crs
+    )
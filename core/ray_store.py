@@ -0,0 +1,164 @@
+import os
+import shapely
+import numpy as np
+import geopandas as gpd
+from dataclasses import dataclass
+
+from config import geometry_column, noise_level_column
+
+# Этаж луча хранится в uint8
+MAX_STORED_FLOOR = np.iinfo(np.uint8).max
+
+
+@dataclass
+class CompactRays:
+    """Noise rays in a compact columnar form.
+
+    Origins are stored once; a ray refers to its origin and keeps its angle
+    (int16, degrees), floor (uint8, level / 3) and planar length (float32).
+    A ray that was not reflected is fully determined by these. For a
+    reflected ray the bounce points and the end point are kept relative to
+    the origin in vertex_dx / vertex_dy (float32); the vertices of ray i
+    are vertex_offsets[i]:vertex_offsets[i + 1].
+    """
+    origin_x: np.ndarray
+    origin_y: np.ndarray
+    origin_noise: np.ndarray
+    ray_origin: np.ndarray
+    angle: np.ndarray
+    floor: np.ndarray
+    length: np.ndarray
+    vertex_offsets: np.ndarray
+    vertex_dx: np.ndarray
+    vertex_dy: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ray_origin)
+
+    @property
+    def vertex_counts(self) -> np.ndarray:
+        return np.diff(self.vertex_offsets)
+
+
+def encode_rays(noise_lines: gpd.GeoDataFrame) -> CompactRays:
+    """Compact form of the noise lines returned by create_noise"""
+    lines = np.asarray(noise_lines.geometry.values)
+    levels = noise_lines[noise_level_column].to_numpy()
+    if len(levels) and levels.max() / 3 > MAX_STORED_FLOOR:
+        raise ValueError(f'Этаж луча больше {MAX_STORED_FLOOR}')
+    coords, line_idx = shapely.get_coordinates(lines, return_index=True)
+    counts = shapely.get_num_coordinates(lines)
+    first = np.cumsum(counts) - counts
+
+    # Точка начала вместе с уровнем шума определяет источник луча
+    starts = np.column_stack([
+        coords[first], noise_lines['start_noise'].to_numpy(dtype=float)
+    ])
+    origins, ray_origin = np.unique(starts, axis=0, return_inverse=True)
+    ray_origin = ray_origin.reshape(-1)
+
+    # Вершины после начала хранятся только у отражённых лучей
+    reflected = counts > 2
+    position = np.arange(len(coords)) - np.repeat(first, counts)
+    kept = (position > 0) & reflected[line_idx]
+    vertex_counts = np.where(reflected, counts - 1, 0)
+    origin_of_vertex = ray_origin[line_idx[kept]]
+    return CompactRays(
+        origin_x=origins[:, 0],
+        origin_y=origins[:, 1],
+        origin_noise=origins[:, 2].astype(np.int16),
+        ray_origin=ray_origin.astype(np.int32),
+        angle=noise_lines['angle'].to_numpy().astype(np.int16),
+        floor=(levels // 3).astype(np.uint8),
+        length=shapely.length(lines).astype(np.float32),
+        vertex_offsets=np.concatenate([[0], np.cumsum(vertex_counts)]),
+        vertex_dx=(coords[kept, 0] - origins[origin_of_vertex, 0]).astype(
+            np.float32),
+        vertex_dy=(coords[kept, 1] - origins[origin_of_vertex, 1]).astype(
+            np.float32)
+    )
+
+
+def decode_rays(rays: CompactRays, crs=None) -> gpd.GeoDataFrame:
+    """Noise lines (level, angle, start_noise, geometry) back from rays"""
+    vertex_counts = rays.vertex_counts
+    reflected = vertex_counts > 0
+    out_counts = 1 + np.where(reflected, vertex_counts, 1)
+    first = np.cumsum(out_counts) - out_counts
+    origin = np.column_stack([rays.origin_x, rays.origin_y])[rays.ray_origin]
+
+    coords = np.empty((out_counts.sum(), 2))
+    coords[first] = origin
+
+    straight = ~reflected
+    radians = np.radians(rays.angle[straight].astype(float))
+    length = rays.length[straight].astype(float)
+    coords[first[straight] + 1] = origin[straight] + np.column_stack(
+        [length * np.cos(radians), length * np.sin(radians)]
+    )
+
+    owner = np.repeat(np.arange(len(rays)), vertex_counts)
+    position = np.arange(len(owner)) - np.repeat(
+        rays.vertex_offsets[:-1], vertex_counts
+    )
+    coords[first[owner] + 1 + position] = origin[owner] + np.column_stack(
+        [rays.vertex_dx, rays.vertex_dy]
+    ).astype(float)
+
+    return gpd.GeoDataFrame({
+        noise_level_column: rays.floor.astype(np.int64) * 3,
+        'angle': rays.angle.astype(np.int64),
+        'start_noise': rays.origin_noise[rays.ray_origin].astype(np.int64),
+        geometry_column: shapely.linestrings(
+            coords, indices=np.repeat(np.arange(len(rays)), out_counts)
+        )
+    }, geometry=geometry_column, crs=crs)
+
+
+def write_rays_parquet(rays: CompactRays, directory: str):
+    """Write origins.parquet and rays.parquet into directory.
+
+    The bounce vertices become list<float32> columns, which Parquet keeps
+    as exactly the offsets and values arrays of CompactRays.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(directory, exist_ok=True)
+    offsets = pa.array(rays.vertex_offsets, type=pa.int32())
+    pq.write_table(pa.table({
+        'x': rays.origin_x,
+        'y': rays.origin_y,
+        'start_noise': rays.origin_noise
+    }), os.path.join(directory, 'origins.parquet'), compression='zstd')
+    pq.write_table(pa.table({
+        'origin': rays.ray_origin,
+        'angle': rays.angle,
+        'floor': rays.floor,
+        'length': rays.length,
+        'bounce_dx': pa.ListArray.from_arrays(offsets, rays.vertex_dx),
+        'bounce_dy': pa.ListArray.from_arrays(offsets, rays.vertex_dy)
+    }), os.path.join(directory, 'rays.parquet'), compression='zstd')
+
+
+def read_rays_parquet(directory: str) -> CompactRays:
+    """Rays written by write_rays_parquet"""
+    import pyarrow.parquet as pq
+
+    origins = pq.read_table(os.path.join(directory, 'origins.parquet'))
+    table = pq.read_table(os.path.join(directory, 'rays.parquet'))
+    bounce_dx = table.column('bounce_dx').combine_chunks()
+    bounce_dy = table.column('bounce_dy').combine_chunks()
+    return CompactRays(
+        origin_x=origins.column('x').to_numpy(),
+        origin_y=origins.column('y').to_numpy(),
+        origin_noise=origins.column('start_noise').to_numpy(),
+        ray_origin=table.column('origin').to_numpy(),
+        angle=table.column('angle').to_numpy(),
+        floor=table.column('floor').to_numpy(),
+        length=table.column('length').to_numpy(),
+        vertex_offsets=bounce_dx.offsets.to_numpy().astype(np.int64),
+        vertex_dx=bounce_dx.values.to_numpy(),
+        vertex_dy=bounce_dy.values.to_numpy()
+    )
+
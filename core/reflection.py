@@ -1,16 +1,14 @@
-from tqdm import tqdm
 from math import log10
-from os import cpu_count
 from pandas import Series
-from multiprocessing import Pool
 from geopandas import GeoDataFrame
-from pyproj import Geod, Transformer
 from typing import Tuple, List, Dict, Optional
 from shapely.geometry import Point, LineString
 
+from core.metrics import BOUNCES
+from core.executor import get_executor
 from core.geom_transform import check_geomtype
+from core.length_model import path_length
 from config import (
-    base_crs,
     geometry_column,
     noise_level_column,
     building_level_column,
@@ -18,44 +16,33 @@ from config import (
     barrier_noise_level_column
 )
 
-# Constants
-MAX_WORKERS = min(cpu_count() or 4, 32)
-geoid = Geod(ellps='WGS84')
-transformer = Transformer.from_crs(
-    crs_from=f"EPSG:{base_crs}",
-    crs_to="EPSG:4326",
-    always_xy=True
-)
-
 
 def make_noise_reflection(
         noize: GeoDataFrame,
         barriers: GeoDataFrame
 ) -> Tuple[GeoDataFrame, GeoDataFrame]:
     """Main function to process noise reflections with parallel processing"""
+    executor = get_executor()
     print('make noise reflection')
-    print(f'🚀 Processing with {MAX_WORKERS} cores')
+    print(f'🚀 Processing with {executor.workers} {executor.backend} workers')
 
-    chunk_size = max(len(noize) // (MAX_WORKERS * 2), 1)
+    chunk_size = max(len(noize) // (executor.workers * 2), 1)
     chunks = [
         noize.iloc[i:i + chunk_size]
         for i in range(0, len(noize), chunk_size)
     ]
-    args = [(chunk, barriers) for chunk in chunks]
 
-    with Pool(processes=MAX_WORKERS - 4) as pool:
-        with tqdm(total=len(chunks), desc="Processing chunks",
-                  unit="chunk") as pbar:
-            results = []
-            for chunk_result in pool.imap_unordered(process_chunk, args):
-                results.append(chunk_result)
-                pbar.update(1)
+    results = executor.map(
+        process_worker_chunk, chunks, context=barriers,
+        desc="Processing chunks"
+    )
 
     lines_results = []
     barriers_results = []
     for lines, _barriers in results:
         lines_results.extend(lines)
         barriers_results.extend(_barriers)
+    BOUNCES.inc(len(barriers_results))
 
     if lines_results:
         noize_lines = GeoDataFrame(lines_results, crs=noize.crs)
@@ -74,6 +61,14 @@ def make_noise_reflection(
     return noize_lines, barriers_gdf
 
 
+def process_worker_chunk(
+        chunk: GeoDataFrame,
+        barriers: GeoDataFrame
+) -> Tuple[List[Dict], List[Dict]]:
+    """Executor task: process a chunk of noise lines with the barriers"""
+    return process_chunk((chunk, barriers))
+
+
 def process_chunk(
         args: Tuple[GeoDataFrame, GeoDataFrame]
 ) -> Tuple[List[Dict], List[Dict]]:
@@ -153,7 +148,7 @@ def get_line_reflect(
 
     new_coords = [*noise_geom.coords[:-1], (intersection.x, intersection.y),
                   (reflected_x, reflected_y)]
-    len_initial = calculate_geodesic_length(new_coords[:-1])
+    len_initial = path_length(new_coords[:-1])
 
     noise_level = noise['start_noise'] - (
         10 * log10((len_initial ** 2 + noise[noise_level_column] ** 2) ** 0.5)
@@ -168,17 +163,6 @@ def get_line_reflect(
     return reflected_noise, reflected_barrier
 
 
-def calculate_geodesic_length(coords: List[Tuple[float, float]]) -> float:
-    """Calculate geodesic length for coordinates in EPSG:3857"""
-    total_length = 0.0
-    for i in range(len(coords) - 1):
-        lon1, lat1 = transformer.transform(*coords[i])
-        lon2, lat2 = transformer.transform(*coords[i + 1])
-        _, _, dist = geoid.inv(lon1, lat1, lon2, lat2)
-        total_length += abs(dist)
-    return total_length
-
-
 def find_near_line(
         line: LineString,
         target_lines: GeoDataFrame
@@ -0,0 +1,220 @@
+import os
+import json
+import shutil
+import hashlib
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from typing import List, Optional, Tuple
+
+import config
+from core.ray_store import (
+    decode_rays,
+    encode_rays,
+    read_rays_parquet,
+    write_rays_parquet
+)
+from config import (
+    base_crs,
+    noise_limit,
+    geometry_column,
+    result_cache_dir,
+    building_id_column,
+    street_column_noise,
+    building_level_column,
+    result_cache_max_bytes,
+    barrier_noise_level_column
+)
+
+# Меняется, когда меняется смысл сохранённых результатов без изменения
+# настроек из CACHE_CONFIG_KEYS
+CACHE_VERSION = 1
+# Настройки config.py, от которых зависит результат create_noise
+CACHE_CONFIG_KEYS = (
+    'noise_limit',
+    'point_interval',
+    'stars_line_step',
+    'noise_segment_size',
+    'amount_of_reflections',
+    'base_crs',
+    'length_model',
+    'reflection_engine',
+    'star_mode',
+    'adaptive_coarse_step',
+    'adaptive_min_step',
+    'origin_stride',
+    'facade_gap_segments'
+)
+
+
+def config_hash() -> str:
+    values = {name: getattr(config, name) for name in CACHE_CONFIG_KEYS}
+    values['version'] = CACHE_VERSION
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def street_noise_distance(street: pd.Series) -> float:
+    return 10 ** ((int(street[street_column_noise]) - noise_limit) / 10)
+
+
+def buildings_in_reach(
+        street: pd.Series,
+        buildings: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
+    """Buildings within the noise distance of one street"""
+    near = shapely.dwithin(
+        np.asarray(buildings.geometry.values),
+        street[geometry_column],
+        street_noise_distance(street)
+    )
+    return buildings[near].reset_index(drop=True)
+
+
+def street_cache_key(street: pd.Series, buildings: gpd.GeoDataFrame) -> str:
+    """Cache key of one street's results.
+
+    Hashes the street geometry and noise class, the settings listed in
+    CACHE_CONFIG_KEYS and the id, floors and geometry of every building
+    within the street's noise distance, in id order.
+    """
+    digest = hashlib.sha256(config_hash().encode())
+    digest.update(shapely.to_wkb(street[geometry_column]))
+    digest.update(str(int(street[street_column_noise])).encode())
+    near = buildings_in_reach(street, buildings).sort_values(
+        building_id_column, kind='stable'
+    )
+    for building_id, floors, wkb in zip(
+            near[building_id_column],
+            near[building_level_column],
+            shapely.to_wkb(np.asarray(near.geometry.values))
+    ):
+        digest.update(f'{building_id}:{floors}:'.encode())
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def merge_barrier_noise(frames: List[gpd.GeoDataFrame]) -> gpd.GeoDataFrame:
+    """Facade noise of several streets, the maximum per segment and floor.
+
+    Separately computed blocks and streets hit the same facade segments,
+    so their results are reduced to one row per segment and floor before
+    replace_street_barrier_noise writes them.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return gpd.GeoDataFrame(
+            columns=[geometry_column, building_level_column,
+                     barrier_noise_level_column],
+            geometry=geometry_column, crs=f'EPSG:{base_crs}'
+        )
+    barriers = pd.concat(frames, ignore_index=True)
+    key = shapely.to_wkb(np.asarray(barriers.geometry.values))
+    best = barriers.assign(_key=key).groupby(
+        ['_key', building_level_column], sort=False
+    )[barrier_noise_level_column].idxmax()
+    return gpd.GeoDataFrame(
+        barriers.loc[best.to_numpy()].reset_index(drop=True),
+        geometry=geometry_column, crs=barriers.crs
+    )
+
+
+class ResultCache:
+    """On-disk store of create_noise results with LRU eviction.
+
+    An entry is a directory named by its key with the rays in the compact
+    format of ray_store and barriers.parquet. Reading an entry refreshes
+    its modification time; after each put the least recently used entries
+    are removed until the store fits in max_bytes. Several workers may
+    share one directory: entries are written under a temporary name and
+    renamed into place, and an entry removed while being read is a miss.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            max_bytes: int = result_cache_max_bytes
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get(
+            self,
+            key: str
+    ) -> Optional[Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]]:
+        path = self._path(key)
+        try:
+            os.utime(path)
+            noise_lines = decode_rays(
+                read_rays_parquet(os.path.join(path, 'rays')),
+                crs=f'EPSG:{base_crs}'
+            )
+            barriers = gpd.read_parquet(os.path.join(path, 'barriers.parquet'))
+        except (OSError, ValueError):
+            return None
+        return noise_lines, barriers
+
+    def put(
+            self,
+            key: str,
+            noise_lines: gpd.GeoDataFrame,
+            barriers: gpd.GeoDataFrame
+    ):
+        path = self._path(key)
+        temporary = f'{path}.tmp{os.getpid()}'
+        shutil.rmtree(temporary, ignore_errors=True)
+        write_rays_parquet(encode_rays(noise_lines),
+                           os.path.join(temporary, 'rays'))
+        barriers.to_parquet(os.path.join(temporary, 'barriers.parquet'))
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # Ту же запись уже сохранил другой обработчик
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if '.tmp' in name or not os.path.isdir(path):
+                continue
+            try:
+                entries.append(
+                    (os.path.getmtime(path), _directory_size(path), path)
+                )
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def _path(self, key: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, key)
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Process-wide cache in result_cache_dir, None if it is not set"""
+    global _cache
+    if result_cache_dir is None:
+        return None
+    if _cache is None:
+        _cache = ResultCache(result_cache_dir)
+    return _cache
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
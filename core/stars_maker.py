@@ -1,11 +1,15 @@
 import math
+import shapely
 import numpy as np
-from tqdm import tqdm
 import geopandas as gpd
 from typing import List
-from multiprocessing import Pool, cpu_count
 from shapely.geometry import LineString, Point
-from config import noise_level_column, street_column_noise, geometry_column
+from config import (
+    geometry_column,
+    street_id_column,
+    noise_level_column,
+    street_column_noise
+)
 
 
 def make_noise_stars(
@@ -14,44 +18,154 @@ def make_noise_stars(
         point_interval: int,
         stars_line_step: int
 ) -> gpd.GeoDataFrame:
-    crs = street_layer.crs
-
-    noise_points = []
-    for _, street in tqdm(street_layer.iterrows(),
-                          total=len(street_layer),
-                          desc="Creating noise points"):
-        line = street.geometry
-        noise = int(street[street_column_noise])
-        noise_distance = 10 ** ((noise - noise_limit) / 10)
-        noise_points += make_points_on_line_with_attr(
-            linestring=line,
-            interval=point_interval,
-            noise=noise,
-            noise_distance=noise_distance
-        )
-
-    with Pool(cpu_count()) as pool:
-        star_args = [(point[geometry_column],
-                      point['noise_distance'],
-                      stars_line_step,
-                      point['noise'])
-                     for point in noise_points]
-
-        noise_stars = list(tqdm(pool.imap(make_noise_star_wrapper, star_args),
-                                total=len(star_args),
-                                desc="Generating noise stars"))
-
-    noise_stars = [item for sublist in noise_stars for item in sublist]
-    return gpd.GeoDataFrame(noise_stars).set_crs(crs)
-
-
-def make_noise_star_wrapper(args):
-    point, distance, step, noise = args
-    return make_noise_star(
-        point=point,
-        distance_normal=distance,
-        step=step,
-        start_noise=noise
+    origin_points = make_origin_points(
+        street_layer=street_layer,
+        noise_limit=noise_limit,
+        point_interval=point_interval
+    )
+    return make_noise_stars_batched(
+        origins=shapely.get_coordinates(origin_points.geometry.values),
+        distance_normal=origin_points['noise_distance'].to_numpy(),
+        start_noise=origin_points['noise'].to_numpy(),
+        step=stars_line_step,
+        crs=street_layer.crs
+    )
+
+
+def make_origin_points(
+        street_layer: gpd.GeoDataFrame,
+        noise_limit: int,
+        point_interval: int
+) -> gpd.GeoDataFrame:
+    """Sample the origin points of all streets at once.
+
+    Returns one row per origin with the street id, its noise and
+    noise_distance, at the same distances along each line as
+    make_points_on_line_with_attr.
+    """
+    lines = street_layer.geometry.values
+    lengths = shapely.length(lines)
+
+    # Количество точек совпадает с len(np.arange(3, length, interval))
+    counts = np.ceil((lengths - 3) / point_interval)
+    counts = np.maximum(np.nan_to_num(counts), 0).astype(np.int64)
+
+    street_idx = np.repeat(np.arange(len(street_layer)), counts)
+    first_point = np.cumsum(counts) - counts
+    distances = 3 + (
+        np.arange(counts.sum()) - np.repeat(first_point, counts)
+    ) * point_interval
+
+    noise = street_layer[street_column_noise].to_numpy().astype(int)
+    noise_distance = 10 ** ((noise - noise_limit) / 10)
+    if street_id_column in street_layer.columns:
+        street_ids = street_layer[street_id_column].to_numpy()
+    else:
+        street_ids = street_layer.index.to_numpy()
+
+    return gpd.GeoDataFrame(
+        {
+            street_id_column: street_ids[street_idx],
+            'noise': noise[street_idx],
+            'noise_distance': noise_distance[street_idx],
+        },
+        geometry=shapely.line_interpolate_point(
+            lines[street_idx], distances
+        ),
+        crs=street_layer.crs
+    )
+
+
+def star_angles(step: int) -> np.ndarray:
+    """Angles of the rays of one star level, in degrees"""
+    return np.arange(20, 380, step)
+
+
+def make_noise_stars_batched(
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        start_noise: np.ndarray,
+        step: int,
+        crs=None
+) -> gpd.GeoDataFrame:
+    """Build the stars of all origins x levels x angles in one pass.
+
+    Produces the same rows, in the same order, as calling make_noise_star
+    for every origin, but the endpoints are computed as NumPy arrays and the
+    geometry column is built with a single shapely.linestrings call.
+    """
+    angles = star_angles(step)
+    return make_noise_stars_fans(
+        origins=origins,
+        distance_normal=distance_normal,
+        start_noise=start_noise,
+        fan_origin=np.repeat(np.arange(len(distance_normal)), len(angles)),
+        fan_angle=np.tile(angles, len(distance_normal)),
+        crs=crs
+    )
+
+
+def make_noise_stars_fans(
+        origins: np.ndarray,
+        distance_normal: np.ndarray,
+        start_noise: np.ndarray,
+        fan_origin: np.ndarray,
+        fan_angle: np.ndarray,
+        crs=None
+) -> gpd.GeoDataFrame:
+    """Build the stars of the given fans, one ray per fan and level.
+
+    A fan is an origin and an angle; fans must be sorted by origin, and
+    origins may have different sets of angles. Rows go origin -> level ->
+    fan, so with the same angles at every origin the result is the one of
+    make_noise_stars_batched.
+    """
+    origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+    distance_normal = np.asarray(distance_normal, dtype=float)
+    start_noise = np.asarray(start_noise)
+    fan_origin = np.asarray(fan_origin, dtype=np.int64)
+    fan_angle = np.asarray(fan_angle)
+
+    # Число уровней у каждой точки: len(range(0, int(distance), 3))
+    levels_count = (np.trunc(distance_normal).astype(np.int64) + 2) // 3
+    levels_count = np.maximum(levels_count, 0)
+    levels_total = int(levels_count.sum())
+
+    origin_of_level = np.repeat(np.arange(len(origins)), levels_count)
+    first_level = np.cumsum(levels_count) - levels_count
+    levels = (
+        np.arange(levels_total) - np.repeat(first_level, levels_count)
+    ) * 3
+    distances = np.sqrt(
+        distance_normal[origin_of_level] ** 2 - levels.astype(float) ** 2
+    )
+
+    # Строки идут в порядке точка -> уровень -> угол, как в make_noise_star
+    fan_count = np.bincount(fan_origin, minlength=len(origins))
+    fan_start = np.cumsum(fan_count) - fan_count
+    rays_per_level = fan_count[origin_of_level]
+    level_idx = np.repeat(np.arange(levels_total), rays_per_level)
+    first_ray = np.cumsum(rays_per_level) - rays_per_level
+    fan = fan_start[origin_of_level[level_idx]] + (
+        np.arange(len(level_idx)) - np.repeat(first_ray, rays_per_level)
+    )
+    origin_idx = origin_of_level[level_idx]
+    ray_distances = distances[level_idx]
+    ray_angles = np.radians(fan_angle[fan])
+
+    coords = np.empty((len(origin_idx), 2, 2), dtype=float)
+    coords[:, 0, :] = origins[origin_idx]
+    coords[:, 1, 0] = coords[:, 0, 0] + ray_distances * np.cos(ray_angles)
+    coords[:, 1, 1] = coords[:, 0, 1] + ray_distances * np.sin(ray_angles)
+
+    return gpd.GeoDataFrame(
+        {
+            noise_level_column: levels[level_idx],
+            'angle': fan_angle[fan],
+            'start_noise': start_noise[origin_idx],
+        },
+        geometry=shapely.linestrings(coords),
+        crs=crs
     )
 
 
@@ -0,0 +1,327 @@
+import shapely
+import threading
+import numpy as np
+from pandas import DataFrame
+from collections import OrderedDict
+from contextlib import contextmanager
+from geopandas import GeoDataFrame
+from typing import Tuple, List, Union, Iterator
+
+from core.metrics import BOUNCES
+from core.executor import get_executor
+from core.barrier_index import BarrierIndex, share_barrier_arrays
+from core.length_model import segment_lengths
+from config import (
+    geometry_column,
+    noise_level_column,
+    building_level_column,
+    amount_of_reflections,
+    barrier_noise_level_column
+)
+
+# Ближе этого расстояния пересечение считается точкой последнего отражения
+MIN_REFLECTION_DISTANCE = 0.1
+
+# Индексы барьеров, подключённые к общей памяти в процессе-обработчике, по
+# имени блока; пул живёт дольше одного расчёта, поэтому старые вытесняются
+ATTACHED_INDEX_CACHE = 4
+_attached_indexes: 'OrderedDict[str, BarrierIndex]' = OrderedDict()
+_attached_lock = threading.Lock()
+
+
+def make_noise_reflection_wavefront(
+        noize: GeoDataFrame,
+        barriers: GeoDataFrame
+) -> Tuple[GeoDataFrame, GeoDataFrame]:
+    """Process noise reflections bounce by bounce for whole batches of rays.
+
+    Same outputs as make_noise_reflection: the reflected noise lines and the
+    barriers with the maximal noise level per geometry and floor.
+    """
+    print('make noise reflection (wavefront)')
+
+    ray_coords = segment_coords(noize.geometry.values)
+    levels = noize[noise_level_column].to_numpy(dtype=float)
+    start_noise = noize['start_noise'].to_numpy(dtype=float)
+    executor = get_executor()
+    chunk_size = max(len(noize) // (executor.workers * 2), 1)
+    starts = range(0, len(noize), chunk_size)
+    args = [(
+        ray_coords[i:i + chunk_size],
+        levels[i:i + chunk_size],
+        start_noise[i:i + chunk_size]
+    ) for i in starts]
+
+    with barrier_context(barriers, executor.backend) as context:
+        results = executor.map(
+            process_chunk_wavefront, args, context=context,
+            desc="Tracing wavefront chunks"
+        )
+
+    line_ids, line_geoms = [], []
+    hit_segments, hit_floors, hit_noise = [], [], []
+    for start, (ids, geoms, segments, floors, noise) in zip(starts, results):
+        line_ids.append(ids + start)
+        line_geoms.append(geoms)
+        hit_segments.append(segments)
+        hit_floors.append(floors)
+        hit_noise.append(noise)
+    BOUNCES.inc(sum(map(len, hit_segments)))
+
+    return (
+        _collect_lines(noize, line_ids, line_geoms),
+        _collect_barriers(barriers, hit_segments, hit_floors, hit_noise)
+    )
+
+
+@contextmanager
+def barrier_context(
+        barriers: GeoDataFrame,
+        backend: str
+) -> Iterator[Union[BarrierIndex, dict]]:
+    """What the executor tasks get to find the barriers.
+
+    Threads share one BarrierIndex. Worker processes get only the
+    description of the barrier arrays exported to shared memory and index
+    them once per run, see attached_barrier_index.
+    """
+    if backend != 'process':
+        yield BarrierIndex.from_barriers(barriers)
+        return
+    with share_barrier_arrays(barriers) as barrier_spec:
+        yield barrier_spec
+
+
+def attached_barrier_index(barrier_spec: dict) -> BarrierIndex:
+    """Index of the shared barrier arrays, built once per worker process"""
+    key = barrier_spec['coords'][0]
+    with _attached_lock:
+        if key in _attached_indexes:
+            _attached_indexes.move_to_end(key)
+            return _attached_indexes[key]
+        index = BarrierIndex.attach(barrier_spec)
+        _attached_indexes[key] = index
+        while len(_attached_indexes) > ATTACHED_INDEX_CACHE:
+            _attached_indexes.popitem(last=False)
+        return index
+
+
+def process_chunk_wavefront(
+        args: Tuple[np.ndarray, np.ndarray, np.ndarray],
+        barriers: Union[BarrierIndex, dict]
+) -> Tuple[np.ndarray, ...]:
+    """Executor task: trace one chunk of rays against the barrier index"""
+    ray_coords, levels, start_noise = args
+    if not isinstance(barriers, BarrierIndex):
+        barriers = attached_barrier_index(barriers)
+    return trace_wavefront(
+        ray_coords=ray_coords,
+        levels=levels,
+        start_noise=start_noise,
+        barrier_index=barriers
+    )
+
+
+def trace_wavefront(
+        ray_coords: np.ndarray,
+        levels: np.ndarray,
+        start_noise: np.ndarray,
+        barrier_index: BarrierIndex
+) -> Tuple[np.ndarray, ...]:
+    """Reflect all live rays at once, one bulk index query per bounce.
+
+    Returns the positions of the surviving rays, their polylines, and the
+    barrier positions hit together with the floor of the ray and the noise
+    level at each hit.
+    """
+    barrier_coords = barrier_index.coords
+    paths = np.asarray(ray_coords, dtype=float)
+    live = np.arange(len(paths))
+    travelled = np.zeros(len(paths))
+    ray_floors = levels / 3
+
+    line_ids, line_geoms = [], []
+    hit_segments, hit_floors, hit_noise = [], [], []
+
+    def emit(mask):
+        line_ids.append(live[mask])
+        line_geoms.append(shapely.linestrings(paths[mask]))
+
+    for bounce in range(amount_of_reflections + 1):
+        if not len(live):
+            break
+        if bounce == amount_of_reflections:
+            emit(np.ones(len(live), dtype=bool))
+            break
+
+        # Индекс отбирает кандидатов по охватам, пересечение точное ниже
+        ray_idx, seg_idx = barrier_index.query(
+            shapely.linestrings(paths), ray_floors[live]
+        )
+
+        distance, last_hit, last_point = _nearest_hits(
+            paths, ray_idx, barrier_coords[seg_idx]
+        )
+        crossed = np.isfinite(distance)
+        ray_idx, seg_idx = ray_idx[crossed], seg_idx[crossed]
+        distance, last_hit = distance[crossed], last_hit[crossed]
+        last_point = last_point[crossed]
+
+        if bounce == 0:
+            # Лучи, не задевшие ни одного барьера своего этажа, отбрасываются
+            has_barrier = np.zeros(len(live), dtype=bool)
+            has_barrier[ray_idx] = True
+            new_position = np.cumsum(has_barrier) - 1
+            ray_idx = new_position[ray_idx]
+            paths = paths[has_barrier]
+            live = live[has_barrier]
+            travelled = travelled[has_barrier]
+
+        # Для каждого луча ближайший барьер не ближе MIN_REFLECTION_DISTANCE
+        valid = distance >= MIN_REFLECTION_DISTANCE
+        ray_idx, seg_idx = ray_idx[valid], seg_idx[valid]
+        distance, last_hit = distance[valid], last_hit[valid]
+        last_point = last_point[valid]
+        order = np.lexsort((seg_idx, distance, ray_idx))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ray_idx[order][1:] != ray_idx[order][:-1]
+        nearest = order[first]
+
+        # Отражаются только лучи, у которых барьер на последнем отрезке
+        reflected = nearest[last_hit[nearest]]
+        reflecting = np.zeros(len(live), dtype=bool)
+        reflecting[ray_idx[reflected]] = True
+        emit(~reflecting)
+
+        rays = ray_idx[reflected]
+        segments = seg_idx[reflected]
+        intersection = last_point[reflected]
+        mirrored = reflect_points(paths[rays, -1], barrier_coords[segments])
+
+        travelled = travelled[rays] + segment_lengths(
+            paths[rays, -2], intersection
+        )
+        live = live[rays]
+        paths = np.concatenate(
+            [paths[rays, :-1], intersection[:, None], mirrored[:, None]],
+            axis=1
+        )
+
+        with np.errstate(divide='ignore'):
+            noise_level = start_noise[live] - 10 * np.log10(
+                np.sqrt(travelled ** 2 + levels[live] ** 2)
+            )
+        hit_segments.append(segments)
+        hit_floors.append(ray_floors[live])
+        hit_noise.append(noise_level)
+
+    return (
+        np.concatenate(line_ids) if line_ids else np.empty(0, int),
+        np.concatenate(line_geoms) if line_geoms else np.empty(0, object),
+        np.concatenate(hit_segments) if hit_segments else np.empty(0, int),
+        np.concatenate(hit_floors) if hit_floors else np.empty(0),
+        np.concatenate(hit_noise) if hit_noise else np.empty(0)
+    )
+
+
+def _nearest_hits(
+        paths: np.ndarray,
+        ray_idx: np.ndarray,
+        barriers: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Distance from the last reflection point to each ray/barrier pair.
+
+    As in find_near_line the distance is taken to the closest intersection
+    with the whole polyline; the hit on the last segment is returned
+    separately because only it can be reflected.
+    """
+    start = paths[ray_idx, -2]
+    a = barriers[:, 0]
+    s = barriers[:, 1] - a
+
+    distance = np.full(len(ray_idx), np.inf)
+    last_hit = np.zeros(len(ray_idx), dtype=bool)
+    last_point = np.full((len(ray_idx), 2), np.nan)
+
+    segments_count = paths.shape[1] - 1
+    for j in range(segments_count):
+        p = paths[ray_idx, j]
+        r = paths[ray_idx, j + 1] - p
+        qp = a - p
+        denom = _cross(r, s)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = _cross(qp, s) / denom
+            u = _cross(qp, r) / denom
+            point = p + t[:, None] * r
+        # Параллельные и коллинеарные отрезки не отражают
+        hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        point_distance = np.hypot(*(point - start).T)
+        distance = np.where(hit, np.minimum(distance, point_distance),
+                            distance)
+        if j == segments_count - 1:
+            last_hit = hit
+            last_point = point
+
+    return distance, last_hit, last_point
+
+
+def reflect_points(points: np.ndarray, barriers: np.ndarray) -> np.ndarray:
+    """Mirror points across the lines through the barrier segments"""
+    a = barriers[:, 0]
+    d = barriers[:, 1] - a
+    w = ((points - a) * d).sum(axis=1) / (d * d).sum(axis=1)
+    return 2 * (a + w[:, None] * d) - points
+
+
+def segment_coords(geoms: np.ndarray) -> np.ndarray:
+    """Coordinates of two-point lines as an (n, 2, 2) array"""
+    if np.any(shapely.get_num_coordinates(geoms) != 2):
+        raise ValueError('Expected two-point LineString geometries')
+    return shapely.get_coordinates(geoms).reshape(-1, 2, 2)
+
+
+def _cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+
+
+def _collect_lines(
+        noize: GeoDataFrame,
+        line_ids: List[np.ndarray],
+        line_geoms: List[np.ndarray]
+) -> GeoDataFrame:
+    if not line_ids or not sum(map(len, line_ids)):
+        return GeoDataFrame(geometry=[], crs=noize.crs)
+    ids = np.concatenate(line_ids)
+    geoms = np.concatenate(line_geoms)
+    order = np.argsort(ids, kind='stable')
+    lines = noize.iloc[ids[order]].reset_index(drop=True)
+    lines[geometry_column] = geoms[order]
+    return GeoDataFrame(lines, geometry=geometry_column, crs=noize.crs)
+
+
+def _collect_barriers(
+        barriers: GeoDataFrame,
+        hit_segments: List[np.ndarray],
+        hit_floors: List[np.ndarray],
+        hit_noise: List[np.ndarray]
+) -> GeoDataFrame:
+    if not hit_segments or not sum(map(len, hit_segments)):
+        return GeoDataFrame(geometry=[], crs=barriers.crs)
+    hits = DataFrame({
+        'segment': np.concatenate(hit_segments),
+        building_level_column: np.concatenate(hit_floors),
+        barrier_noise_level_column: np.concatenate(hit_noise)
+    }).groupby(['segment', building_level_column], as_index=False)[
+        barrier_noise_level_column].max()
+
+    # Строки по этажам появляются только здесь и только у задетых сегментов
+    barriers_gdf = GeoDataFrame({
+        geometry_column: barriers.geometry.values[hits['segment'].to_numpy()],
+        building_level_column: hits[building_level_column].to_numpy(),
+        barrier_noise_level_column: hits[
+            barrier_noise_level_column].to_numpy()
+    }, geometry=geometry_column, crs=barriers.crs)
+    result = barriers_gdf.groupby(
+        [geometry_column, building_level_column], as_index=False).agg(
+        noise_level=(barrier_noise_level_column, 'max'))
+    return GeoDataFrame(result, crs=barriers.crs)
@@ -0,0 +1,238 @@
+"""Бенчмарк create_noise по стадиям на синтетическом городе.
+
+Для каждого сценария замеряются время и пиковая память стадий create_noise
+(stars, intersections, segmentation, floor expansion, reflection) на одной
+улице синтетического города; сценарии образуют ряды по длине улицы и по
+плотности застройки. Результаты сравниваются с сохранёнными базовыми
+значениями, регрессия любой стадии даёт код возврата 1. База данных не
+нужна.
+
+Запуск из корня репозитория:
+    python -m test.benchmark.bench_pipeline
+    python -m test.benchmark.bench_pipeline --update
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from dataclasses import replace, asdict
+from typing import Dict, List, Optional
+
+from core.executor import configure_executor
+from core.main_noise_creator import create_noise
+from test.benchmark.synthetic_city import CityParams, make_city
+from config import street_column_noise
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Шум обрабатываемой улицы, дБ: задаёт дальность лучей
+STREET_NOISE = 70
+BASE_CITY = CityParams(streets_x=3, streets_y=3, density=0.7)
+
+# Ряды сценариев: параметр, который меняется, и его значения
+SERIES = {
+    'street_length': ('streets_y', (2, 3, 4)),
+    'buildings': ('density', (0.35, 0.7, 1.0)),
+}
+
+# Стадия считается регрессией, если она медленнее базы больше чем на
+# TIME_TOLERANCE и больше чем на TIME_MIN_DELTA секунд; для памяти так же
+TIME_TOLERANCE = 0.5
+TIME_MIN_DELTA = 0.05
+MEMORY_TOLERANCE = 0.25
+MEMORY_MIN_DELTA_MB = 5.0
+
+
+class StageRecorder:
+    """on_stage callback of create_noise measuring each stage.
+
+    A stage lasts until the next one starts or finish() is called. With
+    trace_memory the peak of traced memory above the stage start is kept
+    as well.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._stage: Optional[str] = None
+        self._start = 0.0
+        self._memory_start = 0
+
+    def __call__(self, stage: str):
+        self.finish()
+        self._stage = stage
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+        self._start = time.perf_counter()
+
+    def finish(self):
+        if self._stage is None:
+            return
+        result = {'seconds': time.perf_counter() - self._start}
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            result['peak_mb'] = (peak - self._memory_start) / 2 ** 20
+        self.stages[self._stage] = result
+        self._stage = None
+
+
+def scenarios() -> Dict[str, CityParams]:
+    result = {}
+    for series, (field, values) in SERIES.items():
+        for value in values:
+            result[f'{series}={value}'] = replace(BASE_CITY, **{field: value})
+    return result
+
+
+def run_scenario(params: CityParams, repeat: int) -> dict:
+    """Stage timings (best of repeat runs) and memory of one scenario"""
+    streets, buildings = make_city(params)
+    # Средняя улица с севера на юг: по обе стороны от неё есть кварталы
+    street = streets.iloc[[params.streets_x // 2]].copy()
+    street[street_column_noise] = STREET_NOISE
+
+    timings = []
+    for _ in range(repeat):
+        recorder = StageRecorder()
+        noise_lines, noise_barriers = create_noise(
+            street, buildings, on_stage=recorder
+        )
+        recorder.finish()
+        timings.append(recorder.stages)
+
+    memory = StageRecorder(trace_memory=True)
+    tracemalloc.start()
+    try:
+        create_noise(street, buildings, on_stage=memory)
+        memory.finish()
+    finally:
+        tracemalloc.stop()
+
+    stages = {
+        stage: {
+            'seconds': min(run[stage]['seconds'] for run in timings),
+            'peak_mb': memory.stages[stage]['peak_mb']
+        }
+        for stage in timings[0]
+    }
+    return {
+        'street_length': float(street.length.iloc[0]),
+        'buildings': len(buildings),
+        'noise_lines': len(noise_lines),
+        'barrier_rows': len(noise_barriers),
+        'total_seconds': sum(stage['seconds'] for stage in stages.values()),
+        'stages': stages
+    }
+
+
+def compare(results: dict, baselines: dict) -> List[str]:
+    """Descriptions of the stages that regressed against the baselines"""
+    regressions = []
+    for name, result in results.items():
+        base = baselines.get(name)
+        if base is None:
+            continue
+        for stage, values in result['stages'].items():
+            base_stage = base['stages'].get(stage)
+            if base_stage is None:
+                continue
+            seconds, base_seconds = values['seconds'], base_stage['seconds']
+            if (seconds > base_seconds * (1 + TIME_TOLERANCE) and
+                    seconds - base_seconds > TIME_MIN_DELTA):
+                regressions.append(
+                    f'{name} {stage}: {base_seconds:.3f} -> {seconds:.3f} c'
+                )
+            peak, base_peak = values['peak_mb'], base_stage['peak_mb']
+            if (peak > base_peak * (1 + MEMORY_TOLERANCE) and
+                    peak - base_peak > MEMORY_MIN_DELTA_MB):
+                regressions.append(
+                    f'{name} {stage}: {base_peak:.1f} -> {peak:.1f} МБ'
+                )
+    return regressions
+
+
+def print_curves(results: dict):
+    """One table per series: stage seconds / peak MB by scenario"""
+    for series in SERIES:
+        rows = {name: result for name, result in results.items()
+                if name.startswith(f'{series}=')}
+        if not rows:
+            continue
+        stages = list(next(iter(rows.values()))['stages'])
+        print(f'\n{series}')
+        print(f'{"":>22} {"length, м":>10} {"зданий":>7} {"лучей":>8} ' +
+              ' '.join(f'{stage:>20}' for stage in stages))
+        for name, result in rows.items():
+            cells = ' '.join(
+                f'{result["stages"][stage]["seconds"]:>9.3f} c '
+                f'{result["stages"][stage]["peak_mb"]:>6.1f} МБ'
+                for stage in stages
+            )
+            print(f'{name:>22} {result["street_length"]:>10.0f} '
+                  f'{result["buildings"]:>7} {result["noise_lines"]:>8} '
+                  f'{cells}')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--update', action='store_true',
+                        help='записать результаты как новые базовые')
+    parser.add_argument('--repeat', type=int, default=2,
+                        help='число замеров времени на сценарий')
+    parser.add_argument('--backend', default='thread',
+                        choices=('serial', 'thread', 'process'),
+                        help='исполнитель; память обработчиков-процессов '
+                             'не учитывается')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = parser.parse_args(argv)
+
+    executor = configure_executor(backend=args.backend, workers=args.workers)
+    results = {name: run_scenario(params, args.repeat)
+               for name, params in scenarios().items()}
+    print_curves(results)
+
+    report = {
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'backend': executor.backend,
+            'workers': executor.workers
+        },
+        'city': asdict(BASE_CITY),
+        'street_noise': STREET_NOISE,
+        'scenarios': results
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    if args.update:
+        with open(BASELINES_PATH, 'w') as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+        print(f'\nбазовые значения записаны в {BASELINES_PATH}')
+        return 0
+
+    if not os.path.exists(BASELINES_PATH):
+        print('\nбазовых значений нет, запустите с --update')
+        return 0
+    with open(BASELINES_PATH) as file:
+        baselines = json.load(file)
+    if baselines['machine'] != report['machine']:
+        print('\nвнимание: базовые значения сняты на другой машине:',
+              baselines['machine'])
+    regressions = compare(results, baselines['scenarios'])
+    if regressions:
+        print('\nрегрессии:')
+        print('\n'.join(regressions))
+        return 1
+    print('\nрегрессий нет')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
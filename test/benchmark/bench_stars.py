@@ -0,0 +1,72 @@
+"""Сравнение построчного и пакетного построения звёзд шума.
+
+Запуск из корня репозитория:
+    python -m test.benchmark.bench_stars
+"""
+import os
+import time
+import geopandas as gpd
+from core.stars_maker import (
+    make_noise_star,
+    make_noise_stars,
+    make_points_on_line_with_attr
+)
+from config import (
+    noise_limit,
+    point_interval,
+    stars_line_step,
+    street_column_noise
+)
+
+FILES_DIR = os.path.join(os.path.dirname(__file__), '..', 'files')
+
+
+def legacy_noise_stars(street_layer: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Построение звёзд по одному лучу, как до пакетного движка"""
+    rows = []
+    for _, street in street_layer.iterrows():
+        noise = int(street[street_column_noise])
+        noise_distance = 10 ** ((noise - noise_limit) / 10)
+        points = make_points_on_line_with_attr(
+            linestring=street.geometry,
+            interval=point_interval,
+            noise=noise,
+            noise_distance=noise_distance
+        )
+        for point in points:
+            rows.extend(make_noise_star(
+                point=point['geometry'],
+                distance_normal=noise_distance,
+                step=stars_line_step,
+                start_noise=noise
+            ))
+    return gpd.GeoDataFrame(rows).set_crs(street_layer.crs)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    street = gpd.read_file(os.path.join(FILES_DIR, 'test_street.gpkg'))
+
+    legacy, legacy_time = timed(legacy_noise_stars, street)
+    batched, batched_time = timed(
+        make_noise_stars,
+        street_layer=street,
+        noise_limit=noise_limit,
+        point_interval=point_interval,
+        stars_line_step=stars_line_step
+    )
+
+    assert len(legacy) == len(batched)
+    print(f'лучей: {len(batched)}')
+    print(f'построчно: {legacy_time:.2f} c')
+    print(f'пакетно:   {batched_time:.2f} c')
+    print(f'ускорение: {legacy_time / batched_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Синтетический город для бенчмарков: сетка улиц и кварталы зданий.
+
+Улицы идут с севера на юг и с запада на восток через каждые block_size
+метров. Здания - прямоугольники, расставленные по сетке мест внутри
+кварталов с отступом от осей улиц; доля занятых мест задаётся density.
+"""
+import shapely
+import numpy as np
+import geopandas as gpd
+from dataclasses import dataclass
+from typing import Tuple
+
+from config import (
+    base_crs,
+    geometry_column,
+    street_id_column,
+    building_id_column,
+    street_column_noise,
+    building_level_column
+)
+
+# Центр Москвы в EPSG:3857, чтобы масштаб длин был как у реальных данных
+ORIGIN = (4185000.0, 7513000.0)
+
+
+@dataclass
+class CityParams:
+    streets_x: int = 3
+    streets_y: int = 3
+    block_size: float = 120.0
+    # Расстояние от оси улицы до ближайших фасадов
+    setback: float = 10.0
+    building_size: Tuple[float, float] = (10.0, 24.0)
+    building_gap: float = 6.0
+    density: float = 0.7
+    floors: Tuple[int, int] = (2, 16)
+    noise: Tuple[int, int] = (60, 75)
+    seed: int = 0
+
+
+def make_city(
+        params: CityParams = CityParams()
+) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+    """Streets and buildings of a synthetic city.
+
+    Streets have the id, name and noise columns read by create_noise,
+    buildings have id and floors. The result depends only on params.
+    """
+    rng = np.random.default_rng(params.seed)
+    return make_streets(params, rng), make_buildings(params, rng)
+
+
+def make_streets(
+        params: CityParams,
+        rng: np.random.Generator
+) -> gpd.GeoDataFrame:
+    x0, y0 = ORIGIN
+    width = (params.streets_x - 1) * params.block_size
+    height = (params.streets_y - 1) * params.block_size
+    xs = x0 + np.arange(params.streets_x) * params.block_size
+    ys = y0 + np.arange(params.streets_y) * params.block_size
+    coords = np.concatenate([
+        np.stack([np.stack([xs, np.full_like(xs, y0)], axis=1),
+                  np.stack([xs, np.full_like(xs, y0 + height)], axis=1)],
+                 axis=1),
+        np.stack([np.stack([np.full_like(ys, x0), ys], axis=1),
+                  np.stack([np.full_like(ys, x0 + width), ys], axis=1)],
+                 axis=1)
+    ])
+    count = len(coords)
+    return gpd.GeoDataFrame({
+        street_id_column: np.arange(1, count + 1),
+        'name': [f'Улица {i}' for i in range(1, count + 1)],
+        'highway': 'primary',
+        street_column_noise: rng.integers(
+            params.noise[0], params.noise[1], count, endpoint=True
+        ),
+        geometry_column: shapely.linestrings(coords)
+    }, geometry=geometry_column, crs=f'EPSG:{base_crs}')
+
+
+def make_buildings(
+        params: CityParams,
+        rng: np.random.Generator
+) -> gpd.GeoDataFrame:
+    x0, y0 = ORIGIN
+    min_size, max_size = params.building_size
+    stride = max_size + params.building_gap
+    inner = params.block_size - 2 * params.setback
+    slots = max(int((inner + params.building_gap) // stride), 1)
+
+    # Левые нижние углы кварталов и мест под здания в них
+    block_i, block_j, slot_i, slot_j = np.meshgrid(
+        np.arange(params.streets_x - 1), np.arange(params.streets_y - 1),
+        np.arange(slots), np.arange(slots), indexing='ij'
+    )
+    block_x = (x0 + block_i * params.block_size).ravel()
+    block_y = (y0 + block_j * params.block_size).ravel()
+    min_x = block_x + params.setback + slot_i.ravel() * stride
+    min_y = block_y + params.setback + slot_j.ravel() * stride
+
+    taken = rng.random(len(min_x)) < params.density
+    block_x, block_y = block_x[taken], block_y[taken]
+    min_x, min_y = min_x[taken], min_y[taken]
+    count = len(min_x)
+    # Здания не заходят за отступ от улиц с дальней стороны квартала
+    far = params.block_size - params.setback
+    max_x = np.minimum(min_x + rng.uniform(min_size, max_size, count),
+                       block_x + far)
+    max_y = np.minimum(min_y + rng.uniform(min_size, max_size, count),
+                       block_y + far)
+    return gpd.GeoDataFrame({
+        building_id_column: np.arange(1, count + 1),
+        building_level_column: rng.integers(
+            params.floors[0], params.floors[1], count, endpoint=True
+        ),
+        geometry_column: shapely.box(min_x, min_y, max_x, max_y)
+    }, geometry=geometry_column, crs=f'EPSG:{base_crs}')
@@ -0,0 +1,73 @@
+import shapely
+import numpy as np
+import pytest
+from core import adaptive_stars, main_noise_creator
+from core.stars_maker import star_angles, make_origin_points
+from core.result_cache import merge_barrier_noise
+from core.adaptive_stars import adaptive_fans, facade_keys
+from test.benchmark.synthetic_city import CityParams, make_city
+
+
+def street_origins():
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    street = streets.iloc[[1]].copy()
+    street['noise_from_type'] = 62
+    origins = make_origin_points(street, noise_limit=45, point_interval=6)
+    return (street, buildings,
+            shapely.get_coordinates(origins.geometry.values),
+            origins['noise_distance'].to_numpy())
+
+
+def test_adaptive_fans_refine_only_near_buildings():
+    _, buildings, origins, distance_normal = street_origins()
+
+    fan_origin, fan_angle = adaptive_fans(origins, distance_normal,
+                                          buildings, coarse_step=24,
+                                          min_step=3)
+
+    assert set(fan_angle) <= set(star_angles(3))
+    # Грубый веер есть у каждой точки целиком
+    for origin in range(len(origins)):
+        assert set(star_angles(24)) <= set(fan_angle[fan_origin == origin])
+    assert len(fan_angle) < len(origins) * len(star_angles(3))
+    assert (np.diff(fan_origin) >= 0).all()
+
+
+def test_adaptive_stars_cover_the_facades_of_fixed_stars(monkeypatch):
+    street, buildings, _, _ = street_origins()
+    monkeypatch.setattr(adaptive_stars, 'stars_line_step', 3)
+    monkeypatch.setattr(main_noise_creator, 'noise_limit', 45)
+    fixed_lines, fixed_barriers = main_noise_creator.create_noise(
+        street, buildings
+    )
+    monkeypatch.setattr(main_noise_creator, 'star_mode', 'adaptive')
+    adaptive_lines, adaptive_barriers = main_noise_creator.create_noise(
+        street, buildings
+    )
+
+    assert len(adaptive_lines) < len(fixed_lines)
+    assert set(facade_keys(fixed_barriers)) <= set(
+        facade_keys(adaptive_barriers)
+    )
+
+
+@pytest.mark.parametrize('coarse_step, min_step', [(24, 5), (24, 9),
+                                                   (25, 5), (180, 45)])
+def test_adaptive_fans_reject_bad_steps(coarse_step, min_step):
+    _, buildings, origins, distance_normal = street_origins()
+    with pytest.raises(ValueError):
+        adaptive_fans(origins, distance_normal, buildings,
+                      coarse_step=coarse_step, min_step=min_step)
+
+
+def test_adaptive_stream_matches_create_noise(monkeypatch):
+    street, buildings, _, _ = street_origins()
+    monkeypatch.setattr(main_noise_creator, 'star_mode', 'adaptive')
+    lines, barriers = main_noise_creator.create_noise(street, buildings)
+
+    blocks = list(main_noise_creator.create_noise_stream(
+        street, buildings, block_origins=7
+    ))
+
+    assert sum(len(block_lines) for block_lines, _ in blocks) == len(lines)
+    assert len(merge_barrier_noise([b for _, b in blocks])) == len(barriers)
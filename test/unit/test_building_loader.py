@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import geopandas as gpd
+from core import building_loader
+
+
+def test_load_buildings_near_reads_each_tile_once(monkeypatch):
+    street = gpd.read_file(os.path.join('..', 'files', 'test_street.gpkg'))
+    buildings = gpd.read_file(
+        os.path.join('..', 'files', 'test_buildings.gpkg')
+    )[['id', 'floors', 'geometry']]
+    street['noise_from_type'] = 62
+    reads = []
+
+    def read_tile(tile):
+        reads.append(tile)
+        return buildings
+
+    building_loader.clear_building_cache()
+    monkeypatch.setattr(building_loader, 'read_buildings_tile', read_tile)
+
+    near = building_loader.load_buildings_near(street)
+    assert list(near.columns) == ['id', 'floors', 'geometry']
+    assert sorted(near['id']) == sorted(buildings['id'])
+    tiles_read = len(reads)
+    assert tiles_read > 0
+
+    building_loader.load_buildings_near(street)
+    assert len(reads) == tiles_read
+
+    street['noise_from_type'] = 60
+    near = building_loader.load_buildings_near(street)
+    assert sorted(near['id']) == [269, 270, 17456]
+    building_loader.clear_building_cache()
+
+
+def test_tile_cache_is_shared_by_threads():
+    reads = []
+
+    def read_tile(tile):
+        reads.append(tile)
+        return tile
+
+    cache = building_loader.TileCache(max_tiles=8)
+    tiles = [(i % 12, 0) for i in range(2000)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        got = list(pool.map(lambda tile: cache.get(tile, read_tile), tiles))
+
+    assert got == tiles
+    assert len(cache) == 8
+    assert set(reads) == {(i, 0) for i in range(12)}
+    cache.clear()
+    assert len(cache) == 0
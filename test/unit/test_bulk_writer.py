@@ -0,0 +1,193 @@
+import csv
+import pytest
+import shapely
+import geopandas as gpd
+from contextlib import contextmanager
+from shapely.geometry import LineString
+from core import db_connect
+from core.bulk_writer import (
+    csv_batches,
+    replace_street_barrier_noise
+)
+from config import schema
+
+
+def test_csv_batches_encode_rows_as_hex_ewkb():
+    lines = gpd.GeoDataFrame(
+        {'level': [0, 3, 6], 'angle': [20, 23, 26], 'start_noise': [73] * 3},
+        geometry=[LineString([(i, 0), (i, 10)]) for i in range(3)],
+        crs=3857
+    ).reset_index()
+
+    batches = list(csv_batches(lines, batch_size=2))
+
+    batch_rows = [list(csv.reader(buffer)) for buffer in batches]
+    assert [len(rows) for rows in batch_rows] == [2, 1]
+    rows = [row for rows in batch_rows for row in rows]
+    assert [row[:4] for row in rows] == [
+        ['0', '0', '20', '73'], ['1', '3', '23', '73'], ['2', '6', '26', '73']
+    ]
+    geoms = shapely.from_wkb([row[4] for row in rows])
+    assert list(shapely.get_srid(geoms)) == [3857] * 3
+    assert all(shapely.equals(geoms, lines.geometry.values))
+
+
+class StubCursor:
+    def __init__(self, copies):
+        self.copies = copies
+
+    def copy_expert(self, sql, buffer):
+        self.copies.append((sql, list(csv.reader(buffer))))
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    """Records the SQL a writer sends instead of running it"""
+
+    def __init__(self, has_index=True, has_sources=True):
+        self.statements = []
+        self.copies = []
+        self.has_index = has_index
+        self.has_sources = has_sources
+        self.parameters = None
+        self.connection = self
+
+    def cursor(self):
+        return StubCursor(self.copies)
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(' '.join(str(statement).split()))
+        self.parameters = parameters
+        return self
+
+    def scalar(self):
+        if self.parameters['name'].endswith('_sources'):
+            return self.has_sources
+        return self.has_index
+
+
+class StubEngine:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @contextmanager
+    def begin(self):
+        yield self.connection
+
+
+def make_barriers():
+    return gpd.GeoDataFrame(
+        {'floors': [1.0, 2.0], 'noise_level': [61.5, 58.0]},
+        geometry=[LineString([(0, 0), (3, 0)]), LineString([(3, 0), (3, 3)])],
+        crs=3857
+    )
+
+
+def test_replace_street_barrier_noise_uses_new_temp_tables_per_call():
+    connection = StubConnection()
+    barriers = make_barriers().assign(street_id=[7, 7])
+
+    replace_street_barrier_noise(barriers, [7], connection)
+    replace_street_barrier_noise(barriers, [7], connection)
+
+    tables = [statement.split()[3] for statement in connection.statements
+              if statement.startswith('CREATE TEMP TABLE')]
+    assert len(tables) == 4 and len(set(tables)) == 4
+    assert not any('DROP TABLE' in statement
+                   for statement in connection.statements)
+
+
+def test_replace_without_streets_sends_nothing():
+    connection = StubConnection()
+
+    replace_street_barrier_noise(make_barriers().assign(street_id=7), [],
+                                 connection)
+
+    assert connection.statements == [] and connection.copies == []
+
+
+def test_replace_street_barrier_noise_overwrites_the_affected_segments():
+    connection = StubConnection()
+    barriers = make_barriers().assign(street_id=[7, 8])
+
+    replace_street_barrier_noise(barriers, [7, 8, 9], connection)
+
+    statements = connection.statements
+    lock = statements.index(
+        'SELECT pg_advisory_xact_lock(hashtext(:table))'
+    )
+    affected, delete_sources, insert_sources, delete_target, update = \
+        statements[lock + 1:]
+    sources = f'{schema}.barrier_noise_sources'
+    assert f'FROM {sources} WHERE street_id = ANY(:street_ids) UNION ' \
+           f'SELECT md5(ST_AsEWKB(geometry))' in affected
+    assert delete_sources.startswith(f'DELETE FROM {sources}')
+    assert insert_sources.startswith(f'INSERT INTO {sources}')
+    assert 'NOT EXISTS' in delete_target
+    assert 'ORDER BY s.segment_key, s."floors", s."noise_level" DESC' in \
+        update
+    assert update.endswith('ON CONFLICT (segment_key, "floors") DO UPDATE '
+                           'SET "noise_level" = EXCLUDED."noise_level"')
+    assert 'GREATEST' not in update
+    (copy, rows), = connection.copies
+    assert copy.split('(')[1].startswith('"street_id", "floors"')
+    assert [row[:3] for row in rows] == [['7', '1.0', '61.5'],
+                                         ['8', '2.0', '58.0']]
+
+
+def test_replace_removes_the_noise_of_streets_without_facade_hits():
+    connection = StubConnection()
+
+    replace_street_barrier_noise(
+        make_barriers().iloc[:0].assign(street_id=[]), [7], connection
+    )
+
+    assert connection.copies == []
+    assert any(statement.startswith(f'DELETE FROM {schema}.barrier_noise t')
+               for statement in connection.statements)
+
+
+@pytest.mark.parametrize('has_index', [True, False])
+def test_ensure_barrier_noise_key(monkeypatch, has_index):
+    connection = StubConnection(has_index=has_index)
+    monkeypatch.setattr(db_connect, 'engine', StubEngine(connection))
+
+    db_connect.ensure_barrier_noise_key()
+
+    statements = connection.statements
+    assert 'GENERATED ALWAYS AS (md5(ST_AsEWKB(geometry))) STORED' in \
+        statements[1]
+    created = [statement for statement in statements
+               if statement.startswith('CREATE UNIQUE INDEX')]
+    if has_index:
+        assert not created
+    else:
+        assert created == [
+            'CREATE UNIQUE INDEX IF NOT EXISTS '
+            f'barrier_noise_segment_key_uidx ON {schema}.barrier_noise '
+            f'(segment_key, floors)'
+        ]
+
+
+@pytest.mark.parametrize('has_sources', [True, False])
+def test_ensure_barrier_noise_key_backfills_new_sources(monkeypatch,
+                                                        has_sources):
+    connection = StubConnection(has_sources=has_sources)
+    monkeypatch.setattr(db_connect, 'engine', StubEngine(connection))
+
+    db_connect.ensure_barrier_noise_key()
+
+    backfill = [statement for statement in connection.statements
+                if statement.startswith(
+                    f'INSERT INTO {schema}.barrier_noise_sources')]
+    if has_sources:
+        assert not backfill
+    else:
+        # Уже записанный шум фасадов остаётся в максимуме по улицам
+        assert len(backfill) == 1
+        assert backfill[0].endswith(
+            f'SELECT {db_connect.LEGACY_STREET_ID}, geometry, floors, '
+            f'noise_level FROM {schema}.barrier_noise'
+        )
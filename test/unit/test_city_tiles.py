@@ -0,0 +1,72 @@
+from contextlib import nullcontext
+from types import SimpleNamespace
+from core import city_tiles
+from core.result_cache import merge_barrier_noise
+from test.benchmark.synthetic_city import CityParams, make_city
+
+
+def run_tiles(monkeypatch, tiles, replaced=None, deleted=None):
+    """Facade noise and finished streets of process_tile calls"""
+    upserts, finished = [], []
+    replaced = [] if replaced is None else replaced
+    deleted = [] if deleted is None else deleted
+
+    def replace(barriers, street_ids, con):
+        upserts.append(barriers)
+        replaced.append((barriers, street_ids))
+
+    monkeypatch.setattr(city_tiles, 'read_tile_streets',
+                        lambda tile, tile_size: tiles[tile])
+    monkeypatch.setattr(city_tiles, 'engine',
+                        SimpleNamespace(begin=lambda: nullcontext(None)))
+    monkeypatch.setattr(city_tiles, 'save_noise_lines',
+                        lambda *args: None)
+    monkeypatch.setattr(city_tiles, 'delete_noise_lines',
+                        lambda ids, con: deleted.append(ids))
+    monkeypatch.setattr(city_tiles, 'replace_street_barrier_noise', replace)
+    monkeypatch.setattr(city_tiles, 'mark_streets_finished',
+                        lambda con, ids: finished.extend(ids))
+    for tile in tiles:
+        city_tiles.process_tile(tile)
+    return merge_barrier_noise(upserts), finished
+
+
+def test_tiles_merge_like_one_partition(monkeypatch):
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    streets['noise_from_type'] = 58
+    monkeypatch.setattr(city_tiles, 'load_buildings_near',
+                        lambda tile_streets: buildings)
+
+    whole, whole_ids = run_tiles(monkeypatch, {(0, 0): streets})
+    split, split_ids = run_tiles(monkeypatch, {
+        (0, 0): streets.iloc[:2], (0, 1): streets.iloc[2:]
+    })
+
+    assert sorted(split_ids) == sorted(whole_ids) == sorted(streets['id'])
+    assert len(whole) > 0
+
+    def rows(barriers):
+        return sorted(zip(barriers.geometry.to_wkb(), barriers['floors'],
+                          barriers['noise_level'].round(9)))
+    assert rows(split) == rows(whole)
+
+
+def test_tiles_replace_the_results_of_each_street(monkeypatch):
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    streets['noise_from_type'] = 58
+    monkeypatch.setattr(city_tiles, 'load_buildings_near',
+                        lambda tile_streets: buildings)
+    monkeypatch.setattr(city_tiles, 'output_mode', 'lines')
+    replaced, deleted = [], []
+
+    run_tiles(monkeypatch, {(0, 0): streets}, replaced, deleted)
+    alone, _ = run_tiles(monkeypatch, {(0, 0): streets.iloc[[0]]})
+
+    street_ids = streets['id'].tolist()
+    assert deleted == [street_ids]
+    (barriers, replaced_ids), = replaced
+    assert replaced_ids == street_ids
+    # Шум фасадов хранится по улицам, а не сведённым по тайлу
+    first = barriers[barriers['street_id'] == street_ids[0]]
+    assert len(first) == len(alone) > 0
+    assert sorted(first['noise_level']) == sorted(alone['noise_level'])
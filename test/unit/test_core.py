@@ -1,6 +1,21 @@
 import os
+import pytest
+import numpy as np
+import shapely
+import pandas as pd
 import geopandas as gpd
-from core.main_noise_creator import create_noise
+from shapely.geometry import Point, LineString
+from core.result_cache import merge_barrier_noise
+from core import main_noise_creator
+from core.db_connect import LeaseLostError
+from core.main_noise_creator import create_noise, create_noise_stream
+from core.stars_maker import (
+    make_noise_star,
+    make_origin_points,
+    make_noise_stars_batched,
+    make_points_on_line_with_attr
+)
+from test.benchmark.synthetic_city import CityParams, make_city
 
 
 def test_create_noise():
@@ -13,3 +28,119 @@ def test_create_noise():
     assert isinstance(noise_barrier, gpd.GeoDataFrame)
     assert len(noise_lines) > 1
     assert len(noise_barrier) > 1
+
+
+def test_make_noise_stars_batched_matches_star():
+    origins = np.array([[10.0, 20.0], [-5.0, 7.5]])
+    distances = np.array([20.0, 9.5])
+    expected = []
+    for (x, y), distance in zip(origins, distances):
+        expected += make_noise_star(
+            point=Point(x, y),
+            distance_normal=distance,
+            step=30,
+            start_noise=70
+        )
+
+    stars = make_noise_stars_batched(
+        origins=origins,
+        distance_normal=distances,
+        start_noise=np.array([70, 70]),
+        step=30
+    )
+
+    assert len(stars) == len(expected)
+    assert list(stars['level']) == [row['level'] for row in expected]
+    assert list(stars['angle']) == [row['angle'] for row in expected]
+    np.testing.assert_allclose(
+        shapely.get_coordinates(stars.geometry.values),
+        shapely.get_coordinates([row['geometry'] for row in expected])
+    )
+
+
+def test_make_origin_points_matches_per_street_sampling():
+    streets = gpd.GeoDataFrame(
+        {'id': [1, 2, 3], 'noise_from_type': [60, 70, 55]},
+        geometry=[
+            LineString([(0, 0), (10, 0)]),
+            LineString([(0, 0), (1, 0)]),
+            LineString([(0, 0), (0, 20), (15, 20)]),
+        ],
+        crs=3857
+    )
+    expected = []
+    for _, street in streets.iterrows():
+        expected += [
+            (street['id'], point['geometry'].x, point['geometry'].y)
+            for point in make_points_on_line_with_attr(
+                linestring=street.geometry, interval=3
+            )
+        ]
+
+    origins = make_origin_points(streets, noise_limit=45, point_interval=3)
+
+    assert list(origins['id']) == [row[0] for row in expected]
+    np.testing.assert_allclose(
+        shapely.get_coordinates(origins.geometry.values),
+        [row[1:] for row in expected]
+    )
+    np.testing.assert_allclose(
+        origins['noise_distance'], 10 ** ((origins['noise'] - 45) / 10)
+    )
+
+
+@pytest.mark.parametrize('noise, strides, block_origins', [
+    (58, {}, 7),
+    # Общие лучи: пропуски фасадов заполняются через границы блоков
+    (62, {'primary': 3}, 3)
+])
+def test_create_noise_stream_matches_create_noise(noise, strides,
+                                                  block_origins):
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    street = streets.iloc[[1]].copy()
+    street['noise_from_type'] = noise
+    street['highway'] = 'primary'
+
+    noise_lines, noise_barrier = create_noise(street, buildings,
+                                              strides=strides, max_gap=4)
+    blocks = list(create_noise_stream(street, buildings,
+                                      block_origins=block_origins,
+                                      strides=strides, max_gap=4))
+    stream_lines = pd.concat([lines for lines, _ in blocks])
+    stream_barrier = merge_barrier_noise([barrier for _, barrier in blocks])
+
+    def rows(lines):
+        return sorted(zip(lines.geometry.to_wkb(), lines['level'],
+                          lines['angle']))
+
+    def barrier_rows(barrier):
+        return sorted(zip(barrier.geometry.to_wkb(), barrier['floors'],
+                          barrier['noise_level'].round(9)))
+
+    assert len(blocks) > 2
+    assert rows(stream_lines) == rows(noise_lines)
+    assert len(noise_barrier) > 0
+    assert barrier_rows(stream_barrier) == barrier_rows(noise_barrier)
+
+
+def test_noise_maker_drops_a_batch_whose_lease_was_lost(monkeypatch):
+    claims = [[1, 2], [3], [1, 2], []]
+    processed = []
+
+    def process_streets(street_ids, worker_id, job):
+        if street_ids == [3]:
+            raise LeaseLostError('улица 3 возвращена в очередь')
+        processed.append(street_ids)
+
+    for name in ('ensure_street_queue_columns', 'ensure_barrier_noise_key',
+                 'ensure_noise_lines_street_id'):
+        monkeypatch.setattr(main_noise_creator, name, lambda: None)
+    monkeypatch.setattr(main_noise_creator, 'claim_streets',
+                        lambda **kwargs: claims.pop(0))
+    monkeypatch.setattr(main_noise_creator, 'process_streets',
+                        process_streets)
+
+    main_noise_creator.noise_maker(10)
+
+    assert processed == [[1, 2], [1, 2]]
+    assert not claims
@@ -0,0 +1,60 @@
+import pytest
+
+from core.executor import Executor
+
+
+def _square(x):
+    return x * x
+
+
+def _shift(x, offset):
+    return x + offset
+
+
+@pytest.mark.parametrize('backend', ['serial', 'thread', 'process'])
+def test_executor_keeps_order_and_passes_context(backend):
+    executor = Executor(backend=backend, workers=2, chunk_size=2)
+    try:
+        assert executor.map(_square, range(10)) == [x * x for x in range(10)]
+        assert executor.map(_shift, range(5), context=10) == list(
+            range(10, 15))
+        # Пул создаётся один раз и переиспользуется
+        pool = executor._pool
+        executor.map(_square, range(10))
+        assert executor._pool is pool
+    finally:
+        executor.shutdown()
+
+
+def test_executor_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        Executor(backend='gpu')
+
+
+class CountedContext:
+    """Context that counts how many times it is pickled"""
+
+    def __init__(self, offset, pickled):
+        self.offset = offset
+        self.pickled = pickled
+
+    def __getstate__(self):
+        self.pickled.append(1)
+        return {'offset': self.offset, 'pickled': []}
+
+
+def _shift_by_context(x, context):
+    return x + context.offset
+
+
+def test_process_context_is_pickled_once_per_map():
+    pickled = []
+    context = CountedContext(100, pickled)
+    executor = Executor(backend='process', workers=2, chunk_size=1)
+    try:
+        results = executor.map(_shift_by_context, range(20), context=context)
+    finally:
+        executor.shutdown()
+
+    assert results == list(range(100, 120))
+    assert len(pickled) == 1
@@ -0,0 +1,150 @@
+import os
+import shapely
+from contextlib import nullcontext
+from types import SimpleNamespace
+import numpy as np
+import geopandas as gpd
+from core import facade_store, main_noise_creator
+from core.geom_transform import polygons_to_segments
+
+
+def read_test_buildings():
+    return gpd.read_file(
+        os.path.join('..', 'files', 'test_buildings.gpkg')
+    )[['id', 'floors', 'geometry']]
+
+
+def use_store(monkeypatch, segments):
+    reads = []
+
+    def read_tile(tile):
+        reads.append(tile)
+        return segments
+
+    facade_store.clear_facade_cache()
+    monkeypatch.setattr(facade_store, 'read_facade_tile', read_tile)
+    return reads
+
+
+def stored_segments(buildings):
+    segments = facade_store.building_segments(buildings)
+    hashes = dict(zip(buildings['id'],
+                      facade_store.building_hashes(buildings)))
+    return segments.assign(
+        id=np.arange(len(segments)) + 1,
+        building_hash=segments['building_id'].map(hashes)
+    )[['id', 'building_id', 'building_hash', 'geometry']]
+
+
+def test_store_gives_the_segments_of_polygons_to_segments(monkeypatch):
+    buildings = read_test_buildings()
+    reads = use_store(monkeypatch, stored_segments(buildings))
+    # Порядок зданий не совпадает с порядком записи в хранилище
+    buildings = buildings.iloc[::-1].reset_index(drop=True)
+    expected = polygons_to_segments(buildings)
+
+    segments = facade_store.load_facade_segments(buildings)
+    tiles_read = len(reads)
+    facade_store.load_facade_segments(buildings)
+
+    assert list(segments.columns) == list(expected.columns)
+    assert list(segments['id']) == list(expected['id'])
+    assert list(segments['floors']) == list(expected['floors'])
+    assert shapely.equals(segments.geometry.values,
+                          expected.geometry.values).all()
+    assert tiles_read > 0 and len(reads) == tiles_read
+    facade_store.clear_facade_cache()
+
+
+def test_buildings_missing_from_the_store_are_segmented(monkeypatch):
+    buildings = read_test_buildings()
+    stored = stored_segments(buildings)
+    missing = buildings['id'].iloc[[0, 3]]
+    use_store(monkeypatch, stored[~stored['building_id'].isin(missing)])
+    expected = polygons_to_segments(buildings)
+
+    segments = facade_store.load_facade_segments(buildings)
+
+    assert list(segments['id']) == list(expected['id'])
+    assert shapely.equals(segments.geometry.values,
+                          expected.geometry.values).all()
+    facade_store.clear_facade_cache()
+
+
+def test_buildings_changed_after_the_refresh_are_segmented(monkeypatch):
+    buildings = read_test_buildings()
+    use_store(monkeypatch, stored_segments(buildings))
+    # Здания 0 и 3 сдвинуты после записи их сегментов, у здания 1 другая
+    # этажность
+    changed = buildings.copy()
+    changed.loc[[0, 3], 'geometry'] = changed.geometry[[0, 3]].translate(5)
+    changed.loc[1, 'floors'] = changed['floors'][1] + 1
+    expected = polygons_to_segments(changed)
+
+    segments = facade_store.load_facade_segments(changed)
+
+    assert list(segments['id']) == list(expected['id'])
+    assert list(segments['floors']) == list(expected['floors'])
+    assert shapely.equals(segments.geometry.values,
+                          expected.geometry.values).all()
+    facade_store.clear_facade_cache()
+
+
+class StubConnection:
+    def execute(self, *args):
+        pass
+
+
+def test_refresh_reads_each_building_once(monkeypatch):
+    buildings = read_test_buildings().sort_values('id', ignore_index=True)
+    stored = dict(zip(buildings['id'],
+                      facade_store.building_hashes(buildings)))
+    # Хранилище устарело для первого и последнего зданий
+    stored.pop(buildings['id'].iloc[0])
+    stored[buildings['id'].iloc[-1]] = 'old'
+    pages, replaced = [], []
+
+    def read_page(connection, last_id, batch_size, only):
+        after = buildings[buildings['id'] > (last_id or -1)]
+        pages.append(after['id'].iloc[:batch_size].tolist())
+        return after.iloc[:batch_size]
+
+    monkeypatch.setattr(facade_store, 'ensure_facade_segment_tables',
+                        lambda: None)
+    monkeypatch.setattr(facade_store, 'engine', SimpleNamespace(
+        begin=lambda: nullcontext(StubConnection())
+    ))
+    monkeypatch.setattr(facade_store, 'read_building_page', read_page)
+    monkeypatch.setattr(facade_store, 'read_stored_hashes',
+                        lambda connection, ids: stored)
+    monkeypatch.setattr(
+        facade_store, 'replace_segments',
+        lambda connection, page, hashes: replaced.extend(page['id'])
+    )
+
+    refreshed = facade_store.refresh_facade_segments(batch_size=2)
+
+    read = [building_id for page in pages for building_id in page]
+    assert read == buildings['id'].tolist()
+    assert refreshed == 2
+    assert replaced == [buildings['id'].iloc[0], buildings['id'].iloc[-1]]
+
+
+def test_create_noise_with_stored_segments(monkeypatch):
+    street = gpd.read_file(os.path.join('..', 'files', 'test_street.gpkg'))
+    street['noise_from_type'] = 62
+    buildings = read_test_buildings()
+    lines, barriers = main_noise_creator.create_noise(street, buildings)
+
+    use_store(monkeypatch, stored_segments(buildings))
+    monkeypatch.setattr(main_noise_creator, 'facade_segment_source',
+                        'store')
+    stored_lines, stored_barriers = main_noise_creator.create_noise(
+        street, buildings
+    )
+
+    assert len(stored_lines) == len(lines)
+    assert list(stored_barriers['noise_level']) == list(
+        barriers['noise_level']
+    )
+    facade_store.clear_facade_cache()
@@ -0,0 +1,31 @@
+import shapely
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import MultiPolygon, Polygon, box
+from core.geom_transform import polygons_to_segments
+from config import noise_segment_size
+
+
+def test_polygons_to_segments_splits_all_rings():
+    with_hole = Polygon(
+        box(0, 0, 12, 12).exterior.coords,
+        [box(3, 3, 6, 6).exterior.coords]
+    )
+    buildings = gpd.GeoDataFrame(
+        {'id': [1, 2], 'floors': [5, 2]},
+        geometry=[with_hole, MultiPolygon([box(20, 0, 23, 3),
+                                           box(30, 0, 36, 3)])],
+        crs=3857
+    )
+
+    segments = polygons_to_segments(buildings)
+
+    geoms = segments.geometry.values
+    assert np.all(shapely.get_num_coordinates(geoms) == 2)
+    assert np.all(shapely.length(geoms) <= noise_segment_size + 1e-9)
+    for building_id, building in zip(buildings['id'], buildings.geometry):
+        own = geoms[segments['id'].to_numpy() == building_id]
+        assert abs(shapely.length(own).sum() -
+                   building.boundary.length) < 1e-6
+    assert segments.loc[segments['id'] == 1, 'floors'].eq(5).all()
+    assert segments.crs == buildings.crs
@@ -0,0 +1,96 @@
+import time
+import threading
+from core.jobs import JobManager
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_job_reports_progress_and_finishes():
+    def runner(count_streets_update, job):
+        for i in range(count_streets_update):
+            job.report(stage='reflection', streets_done=i + 1)
+
+    manager = JobManager(runner=runner, max_jobs=1)
+    job = manager.submit(count_streets=3)
+    wait_for(lambda: job.status == 'finished')
+
+    state = manager.get(job.id).to_dict()
+    assert state['streets_done'] == 3
+    assert state['stage'] == 'reflection'
+    assert state['streets_per_hour'] > 0
+    manager.shutdown()
+
+
+def test_jobs_cancel_running_and_queued():
+    release = threading.Event()
+
+    def runner(count_streets_update, job):
+        while not job.cancelled:
+            release.wait(0.01)
+
+    manager = JobManager(runner=runner, max_jobs=1)
+    running = manager.submit(count_streets=10)
+    queued = manager.submit(count_streets=10)
+    wait_for(lambda: running.status == 'running')
+
+    assert manager.cancel(queued.id).status == 'cancelled'
+    assert manager.cancel(running.id).status == 'cancelling'
+    wait_for(lambda: running.status == 'cancelled')
+    assert manager.cancel('missing') is None
+    manager.shutdown()
+
+
+def test_failed_job_keeps_error():
+    def runner(count_streets_update, job):
+        raise ValueError('нет улиц')
+
+    manager = JobManager(runner=runner, max_jobs=2)
+    job = manager.submit(count_streets=1)
+    wait_for(lambda: job.status == 'failed')
+    assert job.to_dict()['error'] == 'нет улиц'
+    manager.shutdown()
+
+
+def test_ended_jobs_are_evicted_beyond_max_finished():
+    def runner(count_streets_update, job):
+        pass
+
+    manager = JobManager(runner=runner, max_jobs=1, max_finished=2)
+    submitted = []
+    for _ in range(4):
+        job = manager.submit(count_streets=1)
+        wait_for(lambda: job.status == 'finished')
+        submitted.append(job)
+
+    assert [job.id for job in manager.list()] == [
+        job.id for job in submitted[2:]
+    ]
+    assert manager.get(submitted[0].id) is None
+    manager.shutdown()
+
+
+def test_ended_jobs_are_evicted_after_the_ttl():
+    release = threading.Event()
+
+    def runner(count_streets_update, job):
+        release.wait(5)
+
+    manager = JobManager(runner=runner, max_jobs=1, ttl_seconds=0.05)
+    running = manager.submit(count_streets=1)
+    queued = manager.submit(count_streets=1)
+    wait_for(lambda: running.status == 'running')
+    manager.cancel(queued.id)
+    time.sleep(0.1)
+
+    # Идущая задача остаётся, сколько бы она ни шла
+    assert manager.list() == [running]
+    release.set()
+    wait_for(lambda: running.status == 'finished')
+    time.sleep(0.1)
+    assert manager.get(running.id) is None
+    manager.shutdown()
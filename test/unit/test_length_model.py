@@ -0,0 +1,42 @@
+import numpy as np
+from core.length_model import segment_lengths, path_length
+
+
+def random_segments(count=500, max_length=1500.0, seed=0):
+    rng = np.random.default_rng(seed)
+    # Москва и окрестности в EPSG:3857
+    start = np.column_stack([
+        rng.uniform(4170000, 4200000, count),
+        rng.uniform(7500000, 7530000, count)
+    ])
+    angle = rng.uniform(0, 2 * np.pi, count)
+    length = rng.uniform(0, max_length, count)
+    end = start + np.column_stack([
+        length * np.cos(angle), length * np.sin(angle)
+    ])
+    return start, end
+
+
+def test_batched_lengths_match_geodesic():
+    start, end = random_segments()
+    exact = segment_lengths(start, end, model='geodesic')
+    np.testing.assert_allclose(
+        segment_lengths(start, end, model='batched'), exact, atol=1e-6
+    )
+
+
+def test_mercator_lengths_error_is_bounded():
+    start, end = random_segments()
+    exact = segment_lengths(start, end, model='geodesic')
+    error = np.abs(segment_lengths(start, end, model='mercator') - exact)
+    assert error.max() < 0.01
+
+
+def test_path_length_sums_segments():
+    coords = [(4185000, 7513000), (4185300, 7513100), (4185200, 7513600)]
+    start, end = np.array(coords[:-1]), np.array(coords[1:])
+    for model in ('geodesic', 'batched', 'mercator'):
+        assert abs(
+            path_length(coords, model=model)
+            - segment_lengths(start, end, model=model).sum()
+        ) < 1e-9
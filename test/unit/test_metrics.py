@@ -0,0 +1,40 @@
+import json
+import os
+
+from core.metrics import MetricsRegistry, span, street_metrics, STAGE_SECONDS
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    rays = registry.counter('rays_total', 'Rays')
+    seconds = registry.histogram('stage_seconds', 'Stages', (0.5, 1))
+    rays.inc(3)
+    rays.inc(2)
+    seconds.observe(0.2, stage='stars')
+    seconds.observe(0.7, stage='stars')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE rays_total counter' in lines
+    assert 'rays_total 5' in lines
+    assert '# TYPE stage_seconds histogram' in lines
+    assert 'stage_seconds_bucket{stage="stars",le="0.5"} 1' in lines
+    assert 'stage_seconds_bucket{stage="stars",le="1"} 2' in lines
+    assert 'stage_seconds_bucket{stage="stars",le="+Inf"} 2' in lines
+    assert 'stage_seconds_count{stage="stars"} 2' in lines
+
+
+def test_street_metrics_writes_spans_and_counters(tmp_path):
+    registry = MetricsRegistry()
+    hits = registry.counter('hits_total', 'Hits')
+    with street_metrics([7, 8], directory=str(tmp_path)) as record:
+        with span('reflection'):
+            hits.inc(4)
+    hits.inc(1)
+
+    assert record['counters'] == {'hits_total': 4}
+    assert set(record['spans']) == {'reflection'}
+    assert STAGE_SECONDS.values[(('stage', 'reflection'),)][2] >= 1
+    files = os.listdir(tmp_path)
+    assert len(files) == 1
+    with open(tmp_path / files[0]) as file:
+        assert json.load(file)['street_ids'] == [7, 8]
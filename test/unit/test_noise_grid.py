@@ -0,0 +1,114 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import LineString
+from core import noise_grid
+from core.noise_grid import (
+    merge_into_grid,
+    read_noise_grid,
+    rasterize_noise_lines
+)
+
+ORIGIN = (4185000.0, 7513000.0)
+
+
+def make_rays():
+    x, y = ORIGIN
+    return gpd.GeoDataFrame({
+        'level': [0, 0, 3],
+        'angle': [0, 0, 0],
+        'start_noise': [70, 60, 70],
+        'geometry': [LineString([(x, y + 1), (x + 20, y + 1)])] * 3
+    }, crs=3857)
+
+
+def test_rasterize_keeps_street_maximum_per_band():
+    cells = rasterize_noise_lines(make_rays(), cell_size=2.0,
+                                  floors_per_band=1)
+    ground = cells[cells['band'] == 0].sort_values('ix')
+    assert len(ground) == 10
+    assert (ground['iy'] == int(np.floor((ORIGIN[1] + 1) / 2))).all()
+    # Уровень 70 дБ перекрывает 60 дБ, шум убывает вдоль луча
+    assert np.all(np.diff(ground['noise_level'].to_numpy()) < 0)
+    assert ground['noise_level'].iloc[0] > 60
+    assert set(cells['band']) == {0, 1}
+
+
+def read_ground(directory):
+    bounds = (ORIGIN[0], ORIGIN[1], ORIGIN[0] + 19.9, ORIGIN[1] + 1.5)
+    return read_noise_grid(bounds, band=0, directory=directory,
+                           cell_size=2.0, tile_cells=8)
+
+
+def test_merge_sums_energy_across_streets(tmp_path):
+    cells = rasterize_noise_lines(make_rays(), cell_size=2.0,
+                                  floors_per_band=1)
+    merge_into_grid(cells, 'streets_1', directory=str(tmp_path),
+                    tile_cells=8)
+    once, corner = read_ground(str(tmp_path))
+    merge_into_grid(cells, 'streets_2', directory=str(tmp_path),
+                    tile_cells=8)
+    twice, _ = read_ground(str(tmp_path))
+
+    assert corner == (ORIGIN[0], ORIGIN[1])
+    assert once.shape == (10, 1)
+    ground = cells[cells['band'] == 0].sort_values('ix')
+    np.testing.assert_allclose(once[:, 0], ground['noise_level'], atol=1e-4)
+    np.testing.assert_allclose(twice - once, 10 * np.log10(2), atol=1e-4)
+
+
+def test_merging_the_same_batch_again_leaves_the_grid_unchanged(tmp_path):
+    cells = rasterize_noise_lines(make_rays(), cell_size=2.0,
+                                  floors_per_band=1)
+    merge_into_grid(cells, 'streets_1', directory=str(tmp_path),
+                    tile_cells=8)
+    once, _ = read_ground(str(tmp_path))
+    merge_into_grid(cells, 'streets_1', directory=str(tmp_path),
+                    tile_cells=8)
+    again, _ = read_ground(str(tmp_path))
+    np.testing.assert_array_equal(again, once)
+
+    # Новый вклад той же пачки заменяет прежний, пустой - убирает его
+    quieter = cells.assign(noise_level=cells['noise_level'] - 10)
+    merge_into_grid(quieter, 'streets_1', directory=str(tmp_path),
+                    tile_cells=8)
+    replaced, _ = read_ground(str(tmp_path))
+    np.testing.assert_allclose(once - replaced, 10, atol=1e-4)
+    merge_into_grid(cells.iloc[:0], 'streets_1', directory=str(tmp_path),
+                    tile_cells=8)
+    removed, _ = read_ground(str(tmp_path))
+    assert np.isnan(removed).all()
+
+
+def test_merge_creates_the_grid_directory(tmp_path):
+    cells = rasterize_noise_lines(make_rays(), cell_size=2.0,
+                                  floors_per_band=1)
+    directory = str(tmp_path / 'noise_grid' / 'city')
+    merge_into_grid(cells, 'streets_1', directory=directory, tile_cells=8)
+
+    noise, _ = read_ground(directory)
+    ground = cells[cells['band'] == 0].sort_values('ix')
+    np.testing.assert_allclose(noise[:, 0], ground['noise_level'], atol=1e-4)
+
+
+def test_merge_reads_only_the_tile_and_its_own_contribution(tmp_path,
+                                                            monkeypatch):
+    cells = rasterize_noise_lines(make_rays(), cell_size=2.0,
+                                  floors_per_band=1)
+    directory = str(tmp_path)
+    merge_into_grid(cells, 'streets_1', directory=directory, tile_cells=8)
+    once, _ = read_ground(directory)
+    for key in ('streets_2', 'streets_3'):
+        merge_into_grid(cells, key, directory=directory, tile_cells=8)
+    loaded = []
+    load = np.load
+    monkeypatch.setattr(noise_grid.np, 'load',
+                        lambda path: loaded.append(path) or load(path))
+
+    merge_into_grid(cells.iloc[:0], 'streets_2', directory=directory,
+                    tile_cells=8)
+    merge_into_grid(cells.iloc[:0], 'streets_3', directory=directory,
+                    tile_cells=8)
+
+    assert not any('streets_1' in path for path in loaded)
+    remaining, _ = read_ground(directory)
+    np.testing.assert_allclose(remaining, once, atol=1e-9)
@@ -0,0 +1,75 @@
+import shapely
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon
+from core.stars_maker import make_origin_points
+from core.geom_transform import polygons_to_segments
+from core.origin_sharing import (
+    sharing_report,
+    fill_facade_gaps,
+    shared_origin_points
+)
+from test.benchmark.synthetic_city import CityParams, make_city
+
+
+def test_shared_origins_keep_every_stride_and_the_street_ends():
+    streets, _ = make_city(CityParams(streets_x=2, streets_y=2))
+    streets['highway'] = ['primary', 'primary', 'residential', 'residential']
+    full = make_origin_points(streets, noise_limit=45, point_interval=3)
+
+    shared = shared_origin_points(streets, noise_limit=45, point_interval=3,
+                                  strides={'residential': 4})
+
+    for street_id, highway in zip(streets['id'], streets['highway']):
+        full_points = full.geometry[full['id'] == street_id].values
+        points = shared.geometry[shared['id'] == street_id].values
+        expected = full_points if highway == 'primary' else np.concatenate(
+            [full_points[::4], full_points[-1:]]
+        )
+        assert shapely.equals(points, expected).all()
+
+
+def test_fill_facade_gaps_interpolates_along_the_outline():
+    segments = polygons_to_segments(gpd.GeoDataFrame(
+        {'floors': [2.0]},
+        geometry=[Polygon([(0, 0), (12, 0), (12, 3), (0, 3)])], crs=3857
+    ))
+    coords = shapely.get_coordinates(segments.geometry.values).reshape(
+        -1, 2, 2
+    )
+    # Сегменты нижней стороны прямоугольника слева направо
+    bottom = np.flatnonzero(coords[:, :, 1].max(axis=1) == 0)
+    along = segments.iloc[bottom[np.argsort(coords[bottom, :, 0].min(1))]]
+    assert len(along) == 4
+    barriers = gpd.GeoDataFrame(
+        {'floors': [1.0, 1.0], 'noise_level': [60.0, 57.0]},
+        geometry=along.geometry.values[[0, 3]], crs=3857
+    )
+
+    filled = fill_facade_gaps(barriers, segments, max_gap=2)
+    assert len(fill_facade_gaps(barriers, segments, max_gap=1)) == 2
+
+    levels = dict(zip(shapely.to_wkb(filled.geometry.values),
+                      filled['noise_level']))
+    assert [levels[key] for key in shapely.to_wkb(along.geometry.values)] \
+        == [60.0, 59.0, 58.0, 57.0]
+    assert (filled['floors'] == 1.0).all()
+
+
+def test_sharing_report_compares_strides_with_the_full_trace():
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    streets = streets.iloc[[1, 3]].copy()
+    streets['highway'] = ['primary', 'residential']
+    streets['noise_from_type'] = 60
+
+    report = sharing_report(streets, buildings, strides=(1, 3))
+
+    assert list(zip(report['highway'], report['stride'])) == [
+        ('primary', 1), ('primary', 3), ('residential', 1),
+        ('residential', 3)
+    ]
+    exact = report[report['stride'] == 1]
+    assert (exact['rows_missing'] == 0).all()
+    assert (exact['rows_extra'] == 0).all()
+    assert (exact['max_abs_error'] == 0).all()
+    assert (report['rows_full'] > 0).all()
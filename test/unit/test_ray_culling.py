@@ -0,0 +1,101 @@
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from core.stars_maker import (
+    star_angles,
+    make_noise_stars,
+    make_origin_points
+)
+from core.ray_culling import fan_buildings, intersect_stars
+from test.benchmark.synthetic_city import CityParams, make_city
+
+
+def sjoin_intersections(noise_stars, buildings):
+    """The two gpd.sjoin passes create_noise used before intersect_stars"""
+    lines = gpd.sjoin(noise_stars, buildings, how='inner',
+                      predicate='intersects')
+    hit_buildings = gpd.sjoin(buildings, noise_stars, how='inner',
+                              predicate='intersects')
+    lines = lines[
+        (lines['level'] / 3).astype(int) <= lines['floors']
+    ].drop_duplicates(subset='geometry')
+    return (
+        lines,
+        hit_buildings.drop_duplicates(subset='geometry'),
+        noise_stars[~noise_stars.index.isin(lines.index)]
+    )
+
+
+def test_intersect_stars_matches_sjoin():
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    street = streets.iloc[[1]].copy()
+    street['noise_from_type'] = 62
+    stars = make_noise_stars(street, noise_limit=45, point_interval=6,
+                             stars_line_step=6)
+    stars = stars[stars['level'] / 3 <= buildings['floors'].max()]
+
+    lines, hit_buildings, missed = intersect_stars(stars, buildings)
+    expected_lines, expected_buildings, expected_missed = (
+        sjoin_intersections(stars, buildings)
+    )
+
+    assert 0 < len(lines) < len(stars)
+    assert list(lines.columns) == list(expected_lines.columns)
+    assert lines.drop(columns='geometry').equals(
+        expected_lines.drop(columns='geometry')
+    )
+    assert list(hit_buildings.index) == list(expected_buildings.index)
+    assert list(missed.index) == list(expected_missed.index)
+
+
+def test_intersect_stars_uses_one_building_per_footprint():
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    street = streets.iloc[[1]].copy()
+    street['noise_from_type'] = 62
+    stars = make_noise_stars(street, noise_limit=45, point_interval=6,
+                             stars_line_step=6)
+    lines, hit_buildings, missed = intersect_stars(stars, buildings)
+    # Копии всех зданий под другими индексами, как дубли в таблице зданий
+    doubled = gpd.GeoDataFrame(
+        pd.concat([buildings, buildings.set_index(buildings.index + 10000)]),
+        crs=buildings.crs
+    )
+
+    doubled_lines, doubled_hit, doubled_missed = intersect_stars(stars,
+                                                                 doubled)
+
+    assert doubled_lines.equals(lines)
+    assert list(doubled_hit.index) == list(hit_buildings.index)
+    assert list(doubled_missed.index) == list(missed.index)
+
+
+def test_intersect_stars_without_buildings():
+    streets, buildings = make_city(CityParams(streets_x=2, streets_y=2))
+    stars = make_noise_stars(streets.iloc[[0]], noise_limit=45,
+                             point_interval=30, stars_line_step=30)
+
+    lines, hit_buildings, missed = intersect_stars(stars, buildings.iloc[:0])
+
+    assert lines.empty and hit_buildings.empty
+    assert len(missed) == len(stars)
+
+
+def test_fan_buildings_are_the_buildings_hit_by_stars():
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    street = streets.iloc[[1]].copy()
+    street['noise_from_type'] = 62
+    stars = make_noise_stars(street, noise_limit=45, point_interval=6,
+                             stars_line_step=6)
+    origins = make_origin_points(street, noise_limit=45, point_interval=6)
+
+    angles = star_angles(6)
+
+    hit = fan_buildings(
+        shapely.get_coordinates(origins.geometry.values),
+        origins['noise_distance'].to_numpy(),
+        np.repeat(np.arange(len(origins)), len(angles)),
+        np.tile(angles, len(origins)), buildings, block_size=5
+    )
+
+    assert list(hit.index) == list(intersect_stars(stars, buildings)[1].index)
@@ -0,0 +1,68 @@
+import shapely
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import LineString
+from core.ray_store import (
+    decode_rays,
+    encode_rays,
+    read_rays_parquet,
+    write_rays_parquet
+)
+
+ORIGIN = (4185000.0, 7513000.0)
+
+
+def make_rays():
+    x, y = ORIGIN
+    angles = np.radians([30, 150])
+    return gpd.GeoDataFrame({
+        'level': [0, 6, 0],
+        'angle': [30, 150, 0],
+        'start_noise': [72, 72, 65],
+        'geometry': [
+            LineString([(x, y), (x + 50 * np.cos(angles[0]),
+                                 y + 50 * np.sin(angles[0]))]),
+            LineString([(x, y), (x + 40 * np.cos(angles[1]),
+                                 y + 40 * np.sin(angles[1]))]),
+            # Отражённый луч из другой точки
+            LineString([(x + 3, y), (x + 13, y), (x + 5, y + 7),
+                        (x + 1, y + 30)])
+        ]
+    }, crs=3857)
+
+
+def test_encode_keeps_only_bounce_vertices():
+    rays = encode_rays(make_rays())
+
+    assert len(rays) == 3
+    assert len(rays.origin_x) == 2
+    assert rays.ray_origin[0] == rays.ray_origin[1] != rays.ray_origin[2]
+    assert list(rays.floor) == [0, 2, 0]
+    assert list(rays.vertex_counts) == [0, 0, 3]
+    np.testing.assert_allclose(rays.vertex_dx, [10, 2, -2])
+    np.testing.assert_allclose(rays.vertex_dy, [0, 7, 30])
+
+
+def test_decode_restores_noise_lines():
+    lines = make_rays()
+
+    decoded = decode_rays(encode_rays(lines), crs=lines.crs)
+
+    assert decoded.crs == lines.crs
+    for column in ('level', 'angle', 'start_noise'):
+        assert list(decoded[column]) == list(lines[column])
+    distance = shapely.hausdorff_distance(
+        np.asarray(decoded.geometry.values), np.asarray(lines.geometry.values)
+    )
+    assert distance.max() < 1e-3
+
+
+def test_parquet_round_trip(tmp_path):
+    rays = encode_rays(make_rays())
+
+    write_rays_parquet(rays, str(tmp_path / 'batch'))
+    restored = read_rays_parquet(str(tmp_path / 'batch'))
+
+    for field in rays.__dataclass_fields__:
+        np.testing.assert_array_equal(getattr(restored, field),
+                                      getattr(rays, field))
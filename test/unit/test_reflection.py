@@ -0,0 +1,106 @@
+import numpy as np
+import geopandas as gpd
+from shapely.affinity import rotate
+from shapely.geometry import LineString, box
+from core.reflection import process_chunk
+from core.geom_transform import (
+    lines_to_segments,
+    segmentation_of_barrier_by_floors
+)
+from core.barrier_index import (
+    BarrierIndex,
+    covers_floor,
+    share_barrier_arrays
+)
+from core.wavefront import trace_wavefront, segment_coords
+
+ORIGIN = (4185000.0, 7513000.0)
+
+
+def make_scene():
+    x, y = ORIGIN
+    walls = gpd.GeoDataFrame(
+        {'floors': [1.0, 2.0, 2.0]},
+        geometry=[
+            LineString(box(x + 20, y - 40, x + 26, y + 40).exterior.coords),
+            # Повёрнута, чтобы у лучей между параллельными стенами не было
+            # равноудалённых пересечений, порядок выбора которых не определён
+            LineString(rotate(box(x - 30, y - 40, x - 24, y + 40),
+                              10).exterior.coords),
+            LineString(box(x - 10, y + 30, x + 10, y + 36).exterior.coords),
+        ],
+        crs=3857
+    )
+    barriers = lines_to_segments(walls)
+    rays = []
+    for level in (0, 3, 6):
+        for angle in range(0, 360, 7):
+            rad = np.radians(angle)
+            end = (x + 200 * np.cos(rad), y + 200 * np.sin(rad))
+            rays.append({'geometry': LineString([ORIGIN, end]),
+                         'level': level, 'angle': angle, 'start_noise': 70})
+    return gpd.GeoDataFrame(rays, crs=3857), barriers
+
+
+def test_wavefront_matches_legacy_reflection():
+    rays, barriers = make_scene()
+    legacy_lines, legacy_barriers = process_chunk(
+        (rays, segmentation_of_barrier_by_floors(barriers))
+    )
+
+    ids, geoms, segments, floors, noise = trace_wavefront(
+        ray_coords=segment_coords(rays.geometry.values),
+        levels=rays['level'].to_numpy(dtype=float),
+        start_noise=rays['start_noise'].to_numpy(dtype=float),
+        barrier_index=BarrierIndex.from_barriers(barriers)
+    )
+
+    expected_lines = sorted(
+        (line['angle'], line['level'], tuple(line['geometry'].coords))
+        for line in legacy_lines
+    )
+    lines = sorted(
+        (rays['angle'].iloc[i], rays['level'].iloc[i], tuple(g.coords))
+        for i, g in zip(ids, geoms)
+    )
+    assert len(lines) == len(expected_lines) > 0
+    for (angle, level, coords), (exp_angle, exp_level, exp_coords) in zip(
+            lines, expected_lines):
+        assert (angle, level) == (exp_angle, exp_level)
+        np.testing.assert_allclose(coords, exp_coords, atol=1e-6)
+
+    expected_hits = {}
+    for hit in legacy_barriers:
+        key = (hit['geometry'].wkb, hit['floors'])
+        expected_hits[key] = max(expected_hits.get(key, -np.inf),
+                                 hit['noise_level'])
+    hits = {}
+    for segment, floor, level in zip(segments, floors, noise):
+        key = (barriers.geometry.iloc[segment].wkb, floor)
+        hits[key] = max(hits.get(key, -np.inf), level)
+    assert hits.keys() == expected_hits.keys()
+    for key, level in hits.items():
+        assert abs(level - expected_hits[key]) < 1e-6
+
+
+def test_shared_barrier_index_matches_local():
+    rays, barriers = make_scene()
+    local = BarrierIndex.from_barriers(barriers)
+    geoms = rays.geometry.values
+    floors = rays['level'].to_numpy() / 3
+
+    with share_barrier_arrays(barriers) as spec:
+        shared = BarrierIndex.attach(spec)
+        np.testing.assert_array_equal(shared.coords, local.coords)
+        pairs = sorted(zip(*shared.query(geoms, floors)))
+        assert pairs == sorted(zip(*local.query(geoms, floors)))
+        assert pairs
+
+
+def test_barrier_covers_floors_up_to_its_floor_count():
+    barrier_floors = np.array([2.0, 2.0, 2.0, 2.0, 0.0, 2.5])
+    floors = np.array([0.0, 1.0, 2.0, 3.0, 0.0, 2.0])
+    np.testing.assert_array_equal(
+        covers_floor(barrier_floors, floors),
+        [False, True, True, False, True, True]
+    )
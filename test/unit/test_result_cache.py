@@ -0,0 +1,101 @@
+import os
+import shapely
+import geopandas as gpd
+from shapely.geometry import LineString
+from core import main_noise_creator
+from core.result_cache import (
+    ResultCache,
+    street_cache_key,
+    merge_barrier_noise
+)
+from test.benchmark.synthetic_city import CityParams, make_city
+
+
+def make_street_and_buildings():
+    streets, buildings = make_city(CityParams(streets_x=3, streets_y=2))
+    street = streets.iloc[[1]].copy()
+    street['noise_from_type'] = 60
+    return street, buildings
+
+
+def test_key_changes_only_with_buildings_in_reach():
+    street, buildings = make_street_and_buildings()
+    key = street_cache_key(street.iloc[0], buildings)
+    # Дальность шума 60 дБ - около 32 м от оси улицы
+    distance = buildings.distance(street.geometry.iloc[0])
+    near, far = distance.idxmin(), distance.idxmax()
+    assert distance[far] > 40
+
+    changed = buildings.copy()
+    changed.loc[far, 'floors'] += 1
+    assert street_cache_key(street.iloc[0], changed) == key
+    changed.loc[near, 'floors'] += 1
+    assert street_cache_key(street.iloc[0], changed) != key
+
+    louder = street.copy()
+    louder['noise_from_type'] = 61
+    assert street_cache_key(louder.iloc[0], buildings) != key
+
+
+def test_cached_results_match_computed(tmp_path, monkeypatch):
+    street, buildings = make_street_and_buildings()
+    cache = ResultCache(str(tmp_path))
+    monkeypatch.setattr(main_noise_creator, 'get_result_cache', lambda: cache)
+
+    lines, barriers = main_noise_creator.create_noise_cached(street, buildings)
+    calls = []
+    monkeypatch.setattr(main_noise_creator, 'create_noise',
+                        lambda *args, **kwargs: calls.append(args))
+    cached_lines, cached_barriers = main_noise_creator.create_noise_cached(
+        street, buildings
+    )
+
+    assert not calls
+    assert len(cached_lines) == len(lines)
+    assert list(cached_lines['level']) == list(lines['level'])
+    assert shapely.hausdorff_distance(
+        cached_lines.geometry.values, lines.geometry.values
+    ).max() < 1e-3
+    assert len(cached_barriers) == len(barriers) > 0
+    assert (cached_barriers['noise_level'] == barriers['noise_level']).all()
+
+
+def test_eviction_keeps_recently_read_entries(tmp_path):
+    lines = gpd.GeoDataFrame(
+        {'level': [0], 'angle': [0], 'start_noise': [60]},
+        geometry=[LineString([(0, 0), (10, 0)])], crs=3857
+    )
+    barriers = gpd.GeoDataFrame(
+        {'floors': [2.0], 'noise_level': [50.0]},
+        geometry=[LineString([(10, -1), (10, 1)])], crs=3857
+    )
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, lines, barriers)
+        os.utime(tmp_path / key, (0, {'a': 1, 'b': 2, 'c': 3}[key]))
+    assert cache.get('a') is not None
+    entry_size = sum(f.stat().st_size for f in (tmp_path / 'a').rglob('*')
+                     if f.is_file())
+
+    cache.max_bytes = 2 * entry_size
+    cache.evict()
+
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+
+
+def test_merge_barrier_noise_keeps_maximum():
+    segment = LineString([(0, 0), (3, 0)])
+    first = gpd.GeoDataFrame(
+        {'floors': [1.0, 2.0], 'noise_level': [50.0, 55.0]},
+        geometry=[segment, segment], crs=3857
+    )
+    second = gpd.GeoDataFrame(
+        {'floors': [1.0], 'noise_level': [58.0]},
+        geometry=[segment], crs=3857
+    )
+
+    merged = merge_barrier_noise([first, second])
+
+    assert sorted(zip(merged['floors'], merged['noise_level'])) == [
+        (1.0, 58.0), (2.0, 55.0)
+    ]
@@ -0,0 +1,23 @@
+import shapely
+import numpy as np
+from test.benchmark.synthetic_city import CityParams, make_city
+
+
+def test_make_city_is_deterministic_and_keeps_streets_clear():
+    params = CityParams(streets_x=3, streets_y=4, density=0.8, seed=7)
+    streets, buildings = make_city(params)
+    same_streets, same_buildings = make_city(params)
+
+    assert len(streets) == params.streets_x + params.streets_y
+    assert streets.geometry.geom_equals(same_streets.geometry).all()
+    assert buildings.geometry.geom_equals(same_buildings.geometry).all()
+    assert buildings['floors'].between(*params.floors).all()
+    assert streets['noise_from_type'].between(*params.noise).all()
+
+    houses = np.asarray(buildings.geometry)
+    roads = np.asarray(streets.geometry)
+    distance = shapely.distance(houses[:, None], roads[None, :])
+    assert distance.min() >= params.setback - 1e-9
+    # Каждое здание пересекается только само с собой
+    overlaps = shapely.intersects(houses[:, None], houses[None, :])
+    assert (overlaps.sum(axis=1) == 1).all()